@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Script to benchmark all the stages of the processing of a catalog using
+a synthetic catalog.
+
+Each stage is run in its own process to measure its time and its peak of
+memory. The results are saved to a JSON file and could be compared with the
+results of a previous run.
+"""
+
+import sys
+import os
+import csv
+import json
+import time
+import shutil
+import tempfile
+import platform
+import resource
+import argparse
+import multiprocessing
+
+from ctes import *
+from synthcat import generate_catalog, DEFAULT_SEED
+from extcol import process_text_file
+from extzone import grid_tiles, zone_core, partition_catalog
+from findcpmb import search_cpmb, save_candidates, ENGINES, DEFAULT_ENGINE, \
+    SPHERICAL_ENGINES
+from convout import find_files, convert_files
+import sort_wds
+from wdsmatch import match_catalogs
+
+DEFAULT_RESULTS_FILE = "bench.json"
+
+# Relative change of time with respect to the baseline considered relevant.
+TIME_TOLERANCE = 0.1
+
+def run_in_process(conn, function, args, quiet):
+    """Run a function measuring its time and memory, and send the results
+    through a connection.
+    
+    Args:
+        conn: Connection to send the results.
+        function: Function to run.
+        args: Arguments of the function.
+        quiet: Indicates if the output of the function must be discarded.
+        
+    """
+    
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+        
+    try:
+        start_time = time.time()
+        start_cpu = os.times()
+        
+        result = function(*args)
+        
+        end_cpu = os.times()
+        
+        seconds = time.time() - start_time
+        cpu_seconds = (end_cpu[0] - start_cpu[0]) + (end_cpu[1] - start_cpu[1])
+        
+        # In Linux the maximum resident set size is given in kilobytes.
+        conn.send((seconds, cpu_seconds,
+                   resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   result, None))
+    except Exception as e:
+        conn.send((0, 0, 0, None, "%s: %s" % (type(e).__name__, e)))
+        
+    conn.close()
+
+def run_stage(name, num_rows, function, args, quiet=True):
+    """Run a stage of the benchmark in its own process.
+    
+    Args:
+        name: Name of the stage.
+        num_rows: Number of rows processed by the stage.
+        function: Function that implements the stage.
+        args: Arguments of the function.
+        quiet: Indicates if the output of the stage must be discarded.
+        
+    Return:
+        A dictionary with the measures of the stage and the value returned
+        by the function.
+        
+    """
+    
+    print "Running stage: %s" % name
+    
+    parent_conn, child_conn = multiprocessing.Pipe(False)
+    
+    process = multiprocessing.Process(target=run_in_process,
+                                      args=(child_conn, function, args, quiet))
+    process.start()
+    
+    seconds, cpu_seconds, peak_memory, result, error = parent_conn.recv()
+    
+    process.join()
+    
+    if error is not None:
+        print "ERROR: Stage %s failed: %s" % (name, error)
+        
+    stage = { "name": name,
+              "rows": num_rows,
+              "seconds": seconds,
+              "cpu_seconds": cpu_seconds,
+              "rows_per_second": num_rows / seconds if seconds > 0 else 0.0,
+              "peak_memory_kb": peak_memory,
+              "error": error }
+    
+    print "Stage %s: %d rows in %.3f s (%.0f rows/s), peak memory %d KB" % \
+        (name, num_rows, seconds, stage["rows_per_second"], peak_memory)
+    
+    return stage, result
+
+def partition_stage(csv_file_name, spherical):
+    """Extract the zones of the catalog.
+    
+    Args:
+        csv_file_name: Name of the CSV file of the catalog.
+        spherical: Indicates if the margins are angular distances.
+        
+    Return:
+        List of tuples with the tile and the file of each zone.
+        
+    """
+    
+    return partition_catalog(csv_file_name, grid_tiles(), spherical).items()
+
+def search_stage(zones, engine):
+    """Search the pairs of all the zones.
+    
+    Args:
+        zones: List of tuples with the tile and the file of each zone.
+        engine: Engine used to search the pairs.
+        
+    Return:
+        The number of candidates found.
+        
+    """
+    
+    num_candidates = 0
+    
+    for tile, zone_file in zones:
+        store, candidates = search_cpmb(zone_file, engine,
+                                        zone_core(*tile[:4]))
+        
+        save_candidates(store, candidates, zone_file)
+        
+        num_candidates += len(candidates)
+        
+    return num_candidates
+
+def convert_stage(work_dir):
+    """Merge the files of pairs of all the zones.
+    
+    Args:
+        work_dir: Directory with the files of pairs.
+        
+    Return:
+        The number of rows written.
+        
+    """
+    
+    return convert_files(sorted(find_files(OUT_FILE_PREFIX + "*", work_dir)))
+
+def count_lines(file_name):
+    """Count the lines of a file.
+    
+    Args:
+        file_name: Name of the file.
+        
+    """
+    
+    num_lines = 0
+    
+    if os.path.exists(file_name):
+        with open(file_name, "rb") as fr:
+            for _ in fr:
+                num_lines += 1
+                
+    return num_lines
+
+def recovered_pairs(pairs, converted_file_name):
+    """Count how many of the pairs injected has been found.
+    
+    Args:
+        pairs: List of the pairs injected.
+        converted_file_name: Name of the file with the pairs found.
+        
+    Return:
+        The number of pairs found and the number of pairs injected among
+        them.
+        
+    """
+    
+    found = set()
+    
+    if os.path.exists(converted_file_name):
+        with open(converted_file_name, "rb") as fr:
+            for row in csv.reader(fr, delimiter=CSV_DELIMITER):
+                second_star_pos = len(row) / 2
+                
+                found.add(frozenset([row[ID_COL],
+                                     row[second_star_pos + ID_COL]]))
+                
+    return len(found), \
+        len([ p for p in pairs if frozenset(p) in found ])
+
+def clean_outputs(work_dir):
+    """Remove the outputs of a previous run from the working directory.
+    
+    Args:
+        work_dir: Working directory.
+        
+    """
+    
+    for file_name in find_files(OUT_FILE_PREFIX + "*", work_dir) + \
+        [ os.path.join(work_dir, CONVERTED_FILE_OUTPUT),
+          os.path.join(work_dir, MATCHES_FILENAME) ]:
+    
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+def run_benchmark(num_rows, seed, engine, work_dir, quiet=True):
+    """Run all the stages of the processing for a synthetic catalog.
+    The catalog is generated in the working directory, unless it already
+    exists there from a previous run with the same number of rows and seed.
+    
+    Args:
+        num_rows: Number of rows of the catalog.
+        seed: Seed of the random generator of the catalog.
+        engine: Engine used to search the pairs.
+        work_dir: Working directory.
+        quiet: Indicates if the output of the stages must be discarded.
+        
+    Return:
+        A dictionary with the results of the benchmark.
+        
+    """
+    
+    base_name = "synth_%d_%d" % (num_rows, seed)
+    text_file_name = base_name + ".txt"
+    csv_file_name = base_name + ".csv"
+    wds_file_name = base_name + ".wds.csv"
+    
+    # The stages use relative names for some of their outputs.
+    os.chdir(work_dir)
+    
+    clean_outputs(work_dir)
+    
+    stages = []
+    
+    if not os.path.exists(text_file_name):
+        stage, _ = run_stage("synthcat", num_rows, generate_catalog,
+                             (text_file_name, num_rows, seed), quiet)
+        stages.append(stage)
+        
+    with open(base_name + ".pairs.json", "r") as fr:
+        pairs = json.load(fr)
+        
+    stage, _ = run_stage("extcol", num_rows, process_text_file,
+                         (text_file_name,), quiet)
+    stages.append(stage)
+    
+    stage, zones = run_stage("extzone", num_rows, partition_stage,
+                             (csv_file_name, engine in SPHERICAL_ENGINES),
+                             quiet)
+    stages.append(stage)
+    
+    stage, num_candidates = run_stage("findcpmb", num_rows, search_stage,
+                                      (zones or [], engine), quiet)
+    stages.append(stage)
+    
+    # The search could have failed.
+    num_candidates = num_candidates or 0
+    
+    stage, _ = run_stage("convout", num_candidates, convert_stage,
+                         (work_dir,), quiet)
+    stages.append(stage)
+    
+    stage, _ = run_stage("sort_wds", count_lines(wds_file_name) - 1,
+                         sort_wds.process_file, (wds_file_name,), quiet)
+    stages.append(stage)
+    
+    stage, _ = run_stage("wdsmatch", count_lines(CONVERTED_FILE_OUTPUT),
+                         match_catalogs,
+                         (sort_wds.OUT_FILE_PREFIX + wds_file_name,
+                          CONVERTED_FILE_OUTPUT), quiet)
+    stages.append(stage)
+    
+    pairs_found, pairs_recovered = recovered_pairs(pairs,
+                                                   CONVERTED_FILE_OUTPUT)
+    
+    print "Pairs found: %d, injected: %d, recovered: %d" % \
+        (pairs_found, len(pairs), pairs_recovered)
+    
+    return { "rows": num_rows,
+             "seed": seed,
+             "engine": engine,
+             "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+             "python": platform.python_version(),
+             "cpus": multiprocessing.cpu_count(),
+             "stages": stages,
+             "candidates": num_candidates,
+             "pairs_injected": len(pairs),
+             "pairs_found": pairs_found,
+             "pairs_recovered": pairs_recovered,
+             "matches": count_lines(MATCHES_FILENAME) }
+
+def compare_results(results, baseline):
+    """Compare the results of a benchmark with those of a baseline.
+    
+    Args:
+        results: Results of the benchmark.
+        baseline: Results of the baseline.
+        
+    """
+    
+    if results["rows"] != baseline["rows"] or \
+        results["seed"] != baseline["seed"]:
+        print "ERROR: The baseline uses a different catalog: %d rows " \
+            "and seed %d." % (baseline["rows"], baseline["seed"])
+        
+    base_stages = dict([ (s["name"], s) for s in baseline["stages"] ])
+    
+    print "%-10s %12s %12s %7s %-6s %13s %13s" % \
+        ("Stage", "Time", "Baseline", "Ratio", "", "Memory", "Baseline")
+    
+    for stage in results["stages"]:
+        
+        base = base_stages.get(stage["name"])
+        
+        if base is not None and base["seconds"] > 0:
+            
+            ratio = stage["seconds"] / base["seconds"]
+            
+            if ratio > 1 + TIME_TOLERANCE:
+                change = "slower"
+            elif ratio < 1 - TIME_TOLERANCE:
+                change = "faster"
+            else:
+                change = "same"
+                
+            print "%-10s %10.3f s %10.3f s %6.2fx %-6s %10d KB %10d KB" % \
+                (stage["name"], stage["seconds"], base["seconds"], ratio,
+                 change, stage["peak_memory_kb"], base["peak_memory_kb"])
+            
+    for key in [ "pairs_found", "pairs_recovered", "matches" ]:
+        if results[key] != baseline.get(key):
+            print "Different %s: %s, baseline: %s" % \
+                (key, results[key], baseline.get(key))
+
+def main(progargs):
+    """Run the benchmark, save its results and compare them with a baseline.
+    
+    Args:
+        progargs: Program arguments.
+        
+    """
+    
+    work_dir = progargs.work_dir
+    
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="cpmb_bench_")
+    elif not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+        
+    results_file_name = os.path.abspath(progargs.results_file)
+    
+    baseline = None
+    
+    if progargs.baseline_file is not None:
+        with open(progargs.baseline_file, "r") as fr:
+            baseline = json.load(fr)
+            
+    cwd = os.getcwd()
+    
+    try:
+        results = run_benchmark(progargs.num_rows, progargs.seed,
+                                progargs.engine, os.path.abspath(work_dir),
+                                not progargs.verbose)
+    finally:
+        os.chdir(cwd)
+        
+        # A temporary directory is removed, a directory given is kept to
+        # reuse the catalog.
+        if progargs.work_dir is None:
+            shutil.rmtree(work_dir)
+            
+    print "Saving results to file: %s" % results_file_name
+    
+    with open(results_file_name, "w") as fw:
+        json.dump(results, fw, indent=2, sort_keys=True)
+        
+    if baseline is not None:
+        compare_results(results, baseline)
+
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description= \
+        "Benchmark the stages of the processing with a synthetic catalog.")
+    
+    parser.add_argument("num_rows", type=int,
+                        help="Number of rows of the synthetic catalog.")
+    
+    parser.add_argument("-s", dest="seed", type=int, default=DEFAULT_SEED,
+                        help="Seed of the random generator.")
+    
+    parser.add_argument("-e", dest="engine", choices=sorted(ENGINES),
+                        default=DEFAULT_ENGINE,
+                        help="Engine used to search the pairs.")
+    
+    parser.add_argument("-d", dest="work_dir",
+                        help="Working directory, kept to reuse the catalog.")
+    
+    parser.add_argument("-o", dest="results_file",
+                        default=DEFAULT_RESULTS_FILE,
+                        help="File to save the results.")
+    
+    parser.add_argument("-b", dest="baseline_file",
+                        help="File with the results of a baseline.")
+    
+    parser.add_argument("-v", dest="verbose", action="store_true",
+                        help="Show the output of the stages.")
+    
+    main(parser.parse_args())
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Binary columnar cache of a catalog.
+
+The cache is a directory with a binary file for each column and a header
+describing the columns and the number of rows, so the columns could be
+opened directly with numpy.memmap without parsing any text.
+The identifier column is saved as fixed width strings and the rest of
+columns as float64 values.
+"""
+
+import os
+import csv
+import json
+import itertools
+import numpy as np
+
+from ctes import *
+from common import *
+from loader import float_column
+
+# Extension of the directories containing a cache.
+CACHE_EXT = ".cols"
+
+HEADER_FILE_NAME = "header.json"
+
+ID_TMP_FILE_NAME = "ids.tmp"
+
+# Rows kept in memory before writing them to the column files.
+CHUNK_ROWS = 100000
+
+FLOAT_DTYPE = "<f8"
+
+def column_file_name(cache_dir, col):
+    """Get the name of the file for a column of the cache.
+    
+    Args:
+        cache_dir: Directory of the cache.
+        col: Index of the column.
+        
+    """
+    
+    return os.path.join(cache_dir, "col_%02d.bin" % col)
+
+def is_cache(path):
+    """Indicates if the path received is a cache.
+    
+    Args:
+        path: Path to check.
+        
+    """
+    
+    return os.path.isfile(os.path.join(path, HEADER_FILE_NAME))
+
+def cache_name(file_name):
+    """Get the name of the cache for a CSV or text file, compressed or not.
+    
+    Args:
+        file_name: Name of the file.
+        
+    """
+    
+    return os.path.splitext(uncompressed_name(file_name))[0] + CACHE_EXT
+
+def write_header(cache_dir, names, dtypes, num_rows):
+    """Write the header of a cache.
+    
+    Args:
+        cache_dir: Directory of the cache.
+        names: Names of the columns.
+        dtypes: Data type of each column.
+        num_rows: Number of rows of the cache.
+        
+    """
+    
+    with open(os.path.join(cache_dir, HEADER_FILE_NAME), "w") as fw:
+        json.dump({ "columns": names, "dtypes": dtypes, "rows": num_rows },
+                  fw)
+
+class ColumnCacheWriter(object):
+    """Writes the rows of a catalog to a cache, column by column.
+    
+    """
+    
+    def __init__(self, cache_dir, names):
+        """Create the directory and the files of the cache.
+        
+        Args:
+            cache_dir: Directory of the cache.
+            names: Names of the columns.
+            
+        """
+        
+        self._cache_dir = cache_dir
+        self._names = names
+        self._num_rows = 0
+        self._max_id_len = 1
+        self._rows = []
+        
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+            
+        # The identifiers are saved as text until their maximum length is
+        # known.
+        self._id_file = open(os.path.join(cache_dir, ID_TMP_FILE_NAME), "w")
+        
+        self._col_files = [ None if c == ID_COL else \
+                           open(column_file_name(cache_dir, c), "wb") \
+                           for c in range(len(names)) ]
+        
+    @property
+    def num_rows(self):
+        return self._num_rows
+        
+    def add_row(self, row):
+        """Add a row to the cache.
+        
+        Args:
+            row: List of values of the row as strings.
+            
+        """
+        
+        self._rows.append(row)
+        
+        if len(self._rows) >= CHUNK_ROWS:
+            self._flush()
+            
+    def _flush(self):
+        """Write the rows in memory to the files of the columns.
+        
+        """
+        
+        for c in range(len(self._names)):
+            
+            if c == ID_COL:
+                ids = [ r[c].replace("...", "") for r in self._rows ]
+                
+                for id_str in ids:
+                    self._id_file.write("%s\n" % id_str)
+                    
+                    self._max_id_len = max(self._max_id_len, len(id_str))
+            else:
+                row_nums = xrange(self._num_rows + 1,
+                                  self._num_rows + len(self._rows) + 1)
+                
+                values = float_column([ r[c] for r in self._rows ], row_nums)
+                
+                values.astype(FLOAT_DTYPE).tofile(self._col_files[c])
+                
+        self._num_rows += len(self._rows)
+        
+        del self._rows[:]
+        
+    def close(self):
+        """Write the pending rows, the column of identifiers and the header.
+        
+        """
+        
+        self._flush()
+        
+        self._id_file.close()
+        
+        for f in self._col_files:
+            if f is not None:
+                f.close()
+                
+        id_tmp_file_name = os.path.join(self._cache_dir, ID_TMP_FILE_NAME)
+        
+        id_dtype = "S%d" % self._max_id_len
+        
+        with open(id_tmp_file_name, "r") as fr:
+            with open(column_file_name(self._cache_dir, ID_COL), "wb") as fw:
+                while True:
+                    ids = [ line.rstrip("\n") for line in \
+                           itertools.islice(fr, CHUNK_ROWS) ]
+                    
+                    if not ids:
+                        break
+                        
+                    np.array(ids, dtype=id_dtype).tofile(fw)
+                    
+        os.remove(id_tmp_file_name)
+        
+        dtypes = [ id_dtype if c == ID_COL else FLOAT_DTYPE \
+                  for c in range(len(self._names)) ]
+        
+        write_header(self._cache_dir, self._names, dtypes, self._num_rows)
+
+def write_cache(cache_dir, names, columns):
+    """Write a cache from the arrays of its columns.
+    
+    Args:
+        cache_dir: Directory of the cache.
+        names: Names of the columns.
+        columns: List of arrays, one for each column.
+        
+    """
+    
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+        
+    for c in range(len(columns)):
+        columns[c].tofile(column_file_name(cache_dir, c))
+        
+    write_header(cache_dir, names, [ col.dtype.str for col in columns ],
+                 len(columns[0]) if columns else 0)
+
+def open_cache(cache_dir):
+    """Open the columns of a cache as memory mapped arrays.
+    
+    Args:
+        cache_dir: Directory of the cache.
+        
+    Return:
+        The names of the columns and a list with an array for each column.
+        
+    """
+    
+    with open(os.path.join(cache_dir, HEADER_FILE_NAME), "r") as fr:
+        header = json.load(fr)
+        
+    num_rows = header["rows"]
+    
+    columns = []
+    
+    for c in range(len(header["columns"])):
+        
+        dtype = np.dtype(str(header["dtypes"][c]))
+        
+        # An empty file can't be mapped in memory.
+        if num_rows > 0:
+            columns.append(np.memmap(column_file_name(cache_dir, c),
+                                     dtype=dtype, mode="r",
+                                     shape=(num_rows,)))
+        else:
+            columns.append(np.empty(0, dtype=dtype))
+            
+    return [ str(n) for n in header["columns"] ], columns
+
+def csv_to_cache(csv_file_name):
+    """Create the cache of a CSV file. The first row of the file must be the
+    header with the names of the columns.
+    
+    Args:
+        csv_file_name: Name of the CSV file.
+        
+    Return:
+        The directory of the cache created.
+        
+    """
+    
+    cache_dir = cache_name(csv_file_name)
+    
+    print "Creating cache %s from file %s" % (cache_dir, csv_file_name)
+    
+    with open_file(csv_file_name, 'rb') as csv_in:
+        reader = csv.reader(csv_in, delimiter=CSV_DELIMITER)
+        
+        writer = ColumnCacheWriter(cache_dir, next(reader))
+        
+        for row in reader:
+            writer.add_row(row)
+            
+        writer.close()
+        
+    print "Cache created with %d rows." % writer.num_rows
+    
+    return cache_dir
@@ -20,9 +20,301 @@
 """Common functions used is several modules.
 """
 
-def get_float_value(str_val, row_num):
+import io
+import os
+import sys
+import bz2
+import gzip
+import Queue
+import shutil
+import threading
+import contextlib
+
+# The xz files need the module lzma, from the backports in python 2.
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Name of the temporary file used to write a file, it starts with a dot so it
+# doesn't match the patterns of the output files.
+TMP_FILE_FORMAT = ".%s.tmp"
+
+# Extensions of the compressed files.
+GZIP_EXT = ".gz"
+BZIP2_EXT = ".bz2"
+XZ_EXT = ".xz"
+
+COMPRESSED_EXTS = [ GZIP_EXT, BZIP2_EXT, XZ_EXT ]
+
+# Size of the blocks of data passed to the thread that compresses a file.
+WRITE_BLOCK_SIZE = 1 << 20
+
+# Maximum number of blocks waiting to be compressed.
+WRITE_QUEUE_BLOCKS = 8
+
+class BackgroundWriter(object):
+    """File opened for writing whose data is written by a thread, so the 
+    compression of the data, that releases the GIL, runs in parallel with 
+    the code that generates the data.
+    The data is passed to the thread in blocks, and the errors of the thread 
+    are raised when the file is closed.
+    """
+    
+    def __init__(self, f, raw_file=None):
+        """Start the thread that writes to the file.
+        
+        Args:
+            f: File to write.
+            raw_file: File under the file to write, to close it too.
+            
+        """
+        
+        self._file = f
+        self._raw_file = raw_file
+        self._blocks = Queue.Queue(WRITE_QUEUE_BLOCKS)
+        self._buffer = []
+        self._buffer_size = 0
+        self._error = None
+        self.closed = False
+        
+        self._thread = threading.Thread(target=self._write_blocks)
+        self._thread.daemon = True
+        self._thread.start()
+        
+    def _write_blocks(self):
+        """Write the blocks received until the end is signaled with None.
+        
+        """
+        
+        while True:
+            block = self._blocks.get()
+            
+            if block is None:
+                break
+            
+            # After an error the blocks are discarded.
+            if self._error is None:
+                try:
+                    self._file.write(block)
+                except Exception as e:
+                    self._error = e
+                    
+    def _put_buffer(self):
+        """Pass the data buffered to the thread.
+        
+        """
+        
+        if self._buffer:
+            self._blocks.put("".join(self._buffer))
+            
+            self._buffer = []
+            self._buffer_size = 0
+        
+    def write(self, data):
+        """Write data to the file.
+        
+        Args:
+            data: String to write.
+            
+        """
+        
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        
+        if self._buffer_size >= WRITE_BLOCK_SIZE:
+            self._put_buffer()
+            
+    def writelines(self, lines):
+        """Write several strings to the file.
+        
+        Args:
+            lines: Strings to write.
+            
+        """
+        
+        for l in lines:
+            self.write(l)
+        
+    def close(self):
+        """Write the data pending, wait for the thread and close the file.
+        
+        """
+        
+        if not self.closed:
+            self.closed = True
+            
+            self._put_buffer()
+            self._blocks.put(None)
+            self._thread.join()
+            
+            self._file.close()
+            
+            if self._raw_file is not None:
+                self._raw_file.close()
+                
+            if self._error is not None:
+                raise self._error
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+def compression(file_name):
+    """Get the extension of the compression of a file, or None if the file 
+    isn't compressed.
+    
+    Args:
+        file_name: Name of the file.
+        
+    """
+    
+    for ext in COMPRESSED_EXTS:
+        if file_name.endswith(ext):
+            return ext
+        
+    return None
+
+def uncompressed_name(file_name):
+    """Get the name of a file without the extension of its compression.
+    
+    Args:
+        file_name: Name of the file.
+        
+    """
+    
+    ext = compression(file_name)
+    
+    return file_name[:-len(ext)] if ext is not None else file_name
+
+def open_file(file_name, mode="r", format_file_name=None):
+    """Open a file for reading or writing, compressed or not according to 
+    the extension of its name. The compressed files are always opened in 
+    binary mode and, when writing, the compression runs in a thread.
+    
+    Args:
+        file_name: Name of the file.
+        mode: Mode to open the file.
+        format_file_name: Name of the file whose extension determines the 
+            compression, by default the name of the file.
+        
+    """
+    
+    ext = compression(format_file_name or file_name)
+    
+    if ext is None:
+        return open(file_name, mode)
+    
+    if ext == XZ_EXT and lzma is None:
+        raise IOError("Module lzma not available to open file: %s" % \
+                      file_name)
+    
+    binary_mode = mode.replace("b", "") + "b"
+    
+    if binary_mode == "rb":
+        if ext == GZIP_EXT:
+            # Lines are read faster through a buffered reader.
+            f = io.BufferedReader(gzip.open(file_name, binary_mode))
+        elif ext == BZIP2_EXT:
+            f = bz2.BZ2File(file_name, binary_mode)
+        else:
+            f = lzma.LZMAFile(file_name, binary_mode)
+    else:
+        raw_file = None
+        
+        if ext == GZIP_EXT:
+            # The header gets the name of the final file and no time, so 
+            # the same data is always compressed to the same bytes.
+            raw_file = open(file_name, binary_mode)
+            
+            compressed_file = gzip.GzipFile(os.path.basename( \
+                format_file_name or file_name), binary_mode, 
+                fileobj=raw_file, mtime=0)
+        elif ext == BZIP2_EXT:
+            compressed_file = bz2.BZ2File(file_name, binary_mode)
+        else:
+            compressed_file = lzma.LZMAFile(file_name, binary_mode)
+            
+        f = BackgroundWriter(compressed_file, raw_file)
+        
+    return f
+
+def temp_file_name(file_name):
+    """Get the name of the temporary file used to write a file.
+    
+    Args:
+        file_name: Name of the file.
+        
+    """
+    
+    path, name = os.path.split(file_name)
+    
+    return os.path.join(path, TMP_FILE_FORMAT % name)
+
+@contextlib.contextmanager
+def atomic_open(file_name, mode="w"):
+    """Open a file to write it atomically. The data is written to a 
+    temporary file that is renamed to the final name when the context ends 
+    without errors, so the file never exists partially written.
+    The file is compressed according to the extension of its name.
+    
+    Args:
+        file_name: Name of the file.
+        mode: Mode to open the file.
+        
+    """
+    
+    tmp_file_name = temp_file_name(file_name)
+    
+    f = open_file(tmp_file_name, mode, file_name)
+    
+    try:
+        yield f
+        
+        # Closing the file could also fail, when its data is written.
+        f.close()
+    except BaseException:
+        exc_info = sys.exc_info()
+        
+        # The original error is raised, not those of the cleaning.
+        try:
+            f.close()
+        except BaseException:
+            pass
+        
+        try:
+            os.remove(tmp_file_name)
+        except OSError:
+            pass
+        
+        raise exc_info[0], exc_info[1], exc_info[2]
+    
+    os.rename(tmp_file_name, file_name)
+
+def compress_file(file_name, compressed_file_name):
+    """Compress a file according to the extension of the name of the 
+    compressed file, and remove the original file.
+    
+    Args:
+        file_name: Name of the file to compress.
+        compressed_file_name: Name of the compressed file.
+        
+    """
+    
+    with open(file_name, "rb") as fr:
+        with atomic_open(compressed_file_name, "wb") as fw:
+            shutil.copyfileobj(fr, fw, WRITE_BLOCK_SIZE)
+            
+    os.remove(file_name)
+
+def get_float_value(str_val, row_num, default=0.0):
     
-    val = 0.0
+    val = default
     
     pos = str_val.find('...')
     
@@ -20,11 +20,17 @@
 for RA and DEC. 
 """
 
+import sys
 import os
 import fnmatch
 import csv
-from operator import itemgetter
+import heapq
 from ctes import *
+from common import atomic_open, open_file
+from instrument import measured, count, enable, save_report
+
+# Option to save a JSON report of the instrumentation to a file.
+REPORT_OPTION = "-r"
 
 def find_files(pattern, path):
     
@@ -89,73 +95,117 @@ def convert_row_values(row, second_star_pos):
     
     return new_row
 
-def convert_files(files):
-    """Process a set of files to convert decimal degrees to the conventional 
-    values of hours for RA and sexagesimal for DEC.
-    Each row in the input file must contain sequentially the columns for two
-    stars, so in each row two AR and DEC values are converted. The middle of
-    the row indicates the initial position of the values for the second star.
+def read_converted_rows(file_name, file_index):
+    """Read the rows of a file of pairs and convert its values.
+    The rows of the file must be sorted by the identifiers of both stars.
     
     Args:
-        files: List of files to process.
+        file_name: Name of the file.
+        file_index: Index of the file, to distinguish rows of different files
+            with the same identifiers.
+            
+    Return:
+        Tuples with the identifiers of both stars, the index of the file and 
+        the row converted.
+        
     """
     
-    compiled_rows = []
+    print "Processing file: %s" % file_name
     
-    # Compìle the rows.
-    for f in files:   
+    with open_file(file_name, 'rb') as csv_in:
+        reader = csv.reader(csv_in, delimiter=CSV_DELIMITER)
+        
+        # Skip header but use it to get the initial position for the 
+        # values of the second star.
+        row = next(reader, None)
         
-        print "Processing file: %s" % f
-             
-        with open(f, 'rb') as csv_in:
-                reader = csv.reader(csv_in, delimiter=CSV_DELIMITER)
+        if row is not None:
+            second_star_pos = len(row) / 2
+            
+            previous_key = None
+            
+            # Convert AR and DEC for each row.
+            for row in reader:
+                key = (row[ID_COL], row[second_star_pos + ID_COL])
                 
-                # Skip header but use it to get the initial position for the 
-                # values of the second star.
-                row = next(reader, None)
+                if previous_key is not None and key < previous_key:
+                    print "ERROR: Rows not sorted in file %s: %s" % \
+                        (file_name, key)
                 
-                second_star_pos = len(row) / 2
+                previous_key = key
                 
-                # Convert AR and DEC for each row.
-                for row in reader:
-                    new_row = convert_row_values(row, second_star_pos)                                      
-              
-                    compiled_rows.append(new_row)
+                yield key, file_index, convert_row_values(row, second_star_pos)
+
+@measured("convert_files")
+def convert_files(files):
+    """Process a set of files to convert decimal degrees to the conventional 
+    values of hours for RA and sexagesimal for DEC.
+    Each row in the input file must contain sequentially the columns for two
+    stars, so in each row two AR and DEC values are converted. The middle of
+    the row indicates the initial position of the values for the second star.
+    The rows of each file must be sorted by the identifiers of both stars, 
+    the files are merged as they are read keeping that order, so only a row 
+    of each file is kept in memory.
     
-    # Sort the rows by the identifiers of both stars.
-    sorted_compiled_rows = sorted(compiled_rows, key=itemgetter(0, second_star_pos))
+    Args:
+        files: List of files to process.
+        
+    Return:
+        The number of rows written.
+        
+    """
     
-    # Remove duplicates. As the zones have are overlapped, some pairs could be
-    # repeated.
-    final_compiled_rows = []
+    num_rows = 0
+    num_read = 0
     
-    for i in range(0, len(sorted_compiled_rows) - 1):
-        curr = sorted_compiled_rows[i]
-        nxt = sorted_compiled_rows[i + 1]
-        
-        # If current row is the same that next one, ignore current row.
-        if curr[ID_COL] != nxt[ID_COL] or \
-            curr[second_star_pos + ID_COL] != nxt[second_star_pos + ID_COL]:
-            final_compiled_rows.append(curr)
+    previous_key = None
     
-    # In any case the last row must be added.
-    final_compiled_rows.append(sorted_compiled_rows[-1])
+    merged_rows = heapq.merge(*[ read_converted_rows(f, i) \
+                                for i, f in enumerate(files) ])
     
     print "Writing output file."
     
     # Write the converted rows.
-    with open(CONVERTED_FILE_OUTPUT, 'wb') as csvfile:
+    with atomic_open(CONVERTED_FILE_OUTPUT, 'wb') as csvfile:
         writer = csv.writer(csvfile, delimiter=CSV_DELIMITER)   
         
-        for cr in final_compiled_rows:
-            writer.writerow(cr)  
+        for key, _, cr in merged_rows:
+            
+            num_read += 1
+            
+            # Remove duplicates. As the zones are overlapped, some pairs 
+            # could be repeated.
+            if key != previous_key:
+                writer.writerow(cr)
+                
+                num_rows += 1
+            
+            previous_key = key
+              
+    count("rows_read", num_read)
+    count("rows_written", num_rows)
+    
+    print "Written %d rows." % num_rows
               
-    return compiled_rows      
+    return num_rows      
 
 if __name__ == "__main__":
     
-    # Look for the files in current path with the appropriate file format.
-    files = find_files(OUT_FILE_PREFIX + "*", os.getcwd())
+    args = sys.argv[1:]
     
-    # All the files found are processed.
-    convert_files(files)
\ No newline at end of file
+    if not args or (len(args) == 2 and args[0] == REPORT_OPTION):
+        
+        if args:
+            enable()
+        
+        # Look for the files in current path with the appropriate file format.
+        files = find_files(OUT_FILE_PREFIX + "*", os.getcwd())
+        
+        # All the files found are processed.
+        convert_files(files)
+        
+        if args:
+            save_report(args[1])
+    else:
+        print "ERROR: Wrong number of parameters. Use: %s [%s report_file]" % \
+            (sys.argv[0], REPORT_OPTION)
\ No newline at end of file
@@ -23,38 +23,591 @@ common proper motion.
 """ 
 
 import sys
+import os
+import Queue
+import itertools
+import threading
+import traceback
+import multiprocessing
 import mparser
+import instrument
 
 from ctes import *
-from extzone import extract_zone
-from findcpmb import find_cpmb
+from extzone import extract_zone, grid_tiles, zone_core, zone_limits, \
+    zone_file_name, partition_catalog
+from findcpmb import find_cpmb, search_cpmb, save_candidates, load_catalog, \
+    select_zone, SPHERICAL_ENGINES
+from zoneplan import read_plan
+from manifest import manifest_name, markers_name, tile_key, zone_entry, \
+    is_unchanged, read_manifest, write_manifest, write_marker, read_markers, \
+    clear_markers, catalog_signature, is_catalog_unchanged, prune_manifest
 
-def process_catalog_file(catalog_file_name):
+PROFILE_FILE_NAME = "profile_%s_%s.prof"
+
+# Maximum number of zones waiting in each stage of the pipeline.
+PIPELINE_QUEUE_SIZE = 4
+
+# Seconds waiting for the extraction before checking that it is running.
+PIPELINE_POLL_SECONDS = 5
+
+EXTRACTOR_DIED = "The extraction process finished unexpectedly with exit " \
+    "code %s.\n"
+
+def get_zone_file(zone):
+    """Get the file of a zone, extracting the objects of the zone if it 
+    hasn't been already extracted.
+    
+    Args:
+        zone: Dictionary with the data of the zone.
+        
+    """
+    
+    ar, dec, ra_size, dec_size, margin = zone["tile"]
+    
+    out_file_name = zone["zone_file"]
+    
+    if out_file_name is None:
+        out_file_name = extract_zone(zone["catalog"], ar, dec, ra_size, 
+                                     dec_size, margin, 
+                                     zone["engine"] in SPHERICAL_ENGINES)
+        
+    return out_file_name
+
+def remove_old_output(entry, cpmb_file):
+    """Remove the candidates of a zone saved by a previous run, if they 
+    haven't been saved again to the same file.
+    
+    Args:
+        entry: Entry of the manifest for the zone, or None.
+        cpmb_file: File with the candidates found now.
+        
+    """
+    
+    # The candidates of a previous run not found now mustn't be used.
+    if entry is not None and entry["output"] != cpmb_file and \
+        os.path.isfile(entry["output"]):
+        os.remove(entry["output"])
+
+def search_zone(zone):
+    """Extract the objects of a zone and search the pairs with common proper
+    motion in it.
+    If the zone has been already extracted its file is used directly, and if
+    its objects are in memory no file is used, the candidates are saved to 
+    the file named after the file the zone would have.
+    The search is skipped if the objects of the zone and the parameters of 
+    the criteria are those recorded in the manifest for the zone, without 
+    extracting the zone if the catalog hasn't changed either.
+    
+    Args:
+        zone: Dictionary with the data of the zone.
+            
+    Return:
+        The file with the candidates found, the entry of the manifest for 
+        the zone and if the search has been skipped.
+        
+    """
+    
+    entry = zone["manifest_entry"]
+    
+    if zone["catalog_unchanged"]:
+        return entry["output"], entry, True
+    
+    store = zone["store"]
+    
+    if store is None:
+        out_file_name = get_zone_file(zone)
+        
+        objects = out_file_name
+    else:
+        out_file_name = zone_file_name(zone["catalog"], *zone["tile"][:2])
+        
+        objects = store
+        
+    if is_unchanged(entry, objects, zone["engine"]):
+        return entry["output"], dict(entry, catalog=zone["signature"]), True
+    
+    cpmb_file = find_cpmb(out_file_name, zone["engine"], 
+                          zone_core(*zone["tile"][:4]), store)
+    
+    remove_old_output(entry, cpmb_file)
+    
+    return cpmb_file, zone_entry(objects, cpmb_file, zone["engine"], 
+                                 zone["signature"]), False
+
+def process_zone(zone):
+    """Search the pairs with common proper motion in a zone, profiling the
+    search if a file for the profile is indicated.
+    Any error is caught and returned so a failure in a zone doesn't stop the 
+    processing of the rest of zones.
+    
+    Args:
+        zone: Dictionary with the catalog file name, the tile of the zone, 
+            the name of the engine used to search the near stars, the file
+            of the zone if already extracted, its objects if they are in 
+            memory, the file to save the profile and the entry of the zone 
+            in the manifest.
+            
+    Return:
+        The RA and DEC of the zone, the file with the candidates found, the 
+        error found, if any, the new entry of the manifest, if the search has
+        been skipped and the measures of the instrumentation.
+        
+    """
+    
+    ar, dec = zone["tile"][:2]
+    
+    cpmb_file = None
+    error = None
+    entry = None
+    skipped = False
+    
+    try:
+        if zone["profile_file"] is None:
+            cpmb_file, entry, skipped = search_zone(zone)
+        else:
+            with instrument.profile(zone["profile_file"]):
+                cpmb_file, entry, skipped = search_zone(zone)
+    except Exception:
+        error = traceback.format_exc()
+        
+    return ar, dec, cpmb_file, error, entry, skipped, instrument.collect()
+
+def extract_zones(zones, extracted):
+    """Extract the zones in order for the pipeline, checking also if they 
+    have changed since the last run. It runs in its own process.
+    
+    Args:
+        zones: Dictionaries with the data of the zones.
+        extracted: Queue to put, for each zone, its file, if it is unchanged
+            and the error found, if any. At the end the measures of the 
+            instrumentation are put.
+        
+    """
+    
+    # The process starts without the measures of its parent.
+    instrument.reset()
+    
+    for zone in zones:
+        
+        zone_file = None
+        unchanged = False
+        error = None
+        
+        try:
+            if zone["catalog_unchanged"]:
+                extracted.put((None, True, None))
+                
+                continue
+            
+            zone_file = get_zone_file(zone)
+            
+            unchanged = is_unchanged(zone["manifest_entry"], zone_file, 
+                                     zone["engine"])
+        except Exception:
+            error = traceback.format_exc()
+            
+        extracted.put((zone_file, unchanged, error))
+        
+    extracted.put(instrument.collect())
+    
+def save_zones(searched, results):
+    """Save the candidates of the zones searched in the pipeline, until None
+    is received. It runs in its own thread.
+    
+    Args:
+        searched: Queue to get the zones searched, each one with the data of
+            the zone, its file and the store and candidates found, or the 
+            result of the zone if there is nothing to save.
+        results: Queue to put the result of each zone, as process_zone 
+            returns it.
+        
+    """
+    
+    while True:
+        item = searched.get()
+        
+        if item is None:
+            break
+        
+        if len(item) == 2:
+            results.put(item[1])
+        else:
+            zone, zone_file, store, candidates = item
+            
+            ar, dec = zone["tile"][:2]
+            
+            try:
+                cpmb_file = save_candidates(store, candidates, zone_file)
+                
+                remove_old_output(zone["manifest_entry"], cpmb_file)
+                
+                results.put((ar, dec, cpmb_file, None, 
+                             zone_entry(zone_file, cpmb_file, zone["engine"],
+                                        zone["signature"]), 
+                             False, []))
+            except Exception:
+                results.put((ar, dec, None, traceback.format_exc(), None, 
+                             False, []))
+    
+def get_extracted(extracted, extractor):
+    """Get the next item put by the extraction process, checking that it is
+    still running while waiting for it.
+    
+    Args:
+        extracted: Queue where the extraction process puts its items.
+        extractor: Extraction process.
+        
+    Return:
+        The item or None if the extraction process has finished without 
+        putting it.
+        
+    """
+    
+    while True:
+        try:
+            return extracted.get(timeout=PIPELINE_POLL_SECONDS)
+        except Queue.Empty:
+            if not extractor.is_alive():
+                break
+            
+    # The last items could arrive just after the process finishes.
+    try:
+        return extracted.get(timeout=PIPELINE_POLL_SECONDS)
+    except Queue.Empty:
+        return None
+
+def pipeline_zones(zones):
+    """Process the zones in a pipeline of three stages, so the extraction, 
+    the search and the saving of different zones overlap.
+    A process extracts the zones, this process searches the pairs and a 
+    thread saves the candidates. The stages are connected by bounded queues
+    so only a few zones are kept between stages. If the extraction process
+    dies, the zones not extracted yet fail.
+    
+    Args:
+        zones: Dictionaries with the data of the zones.
+        
+    Return:
+        The result of each zone in order, as process_zone returns it.
+        
+    """
+    
+    extracted = multiprocessing.Queue(PIPELINE_QUEUE_SIZE)
+    searched = Queue.Queue(PIPELINE_QUEUE_SIZE)
+    results = Queue.Queue()
+    
+    extractor = multiprocessing.Process(target=extract_zones, 
+                                        args=(zones, extracted))
+    extractor.daemon = True
+    extractor.start()
+    
+    saver = threading.Thread(target=save_zones, args=(searched, results))
+    saver.daemon = True
+    saver.start()
+    
+    num_results = 0
+    
+    extractor_died = False
+    
+    try:
+        for zone in zones:
+            
+            ar, dec, ra_size, dec_size = zone["tile"][:4]
+            
+            item = None
+            
+            if not extractor_died:
+                item = get_extracted(extracted, extractor)
+            
+            if item is None:
+                extractor_died = True
+                
+                item = (None, False, EXTRACTOR_DIED % extractor.exitcode)
+                
+            zone_file, unchanged, error = item
+            
+            entry = zone["manifest_entry"]
+            
+            if error is not None:
+                searched.put((zone, (ar, dec, None, error, None, False, [])))
+            elif unchanged:
+                searched.put((zone, (ar, dec, entry["output"], None, 
+                                     dict(entry, catalog=zone["signature"]), 
+                                     True, [])))
+            else:
+                try:
+                    with instrument.stage("find_cpmb"):
+                        if zone["profile_file"] is None:
+                            store, candidates = search_cpmb(zone_file, 
+                                zone["engine"], 
+                                zone_core(ar, dec, ra_size, dec_size))
+                        else:
+                            with instrument.profile(zone["profile_file"]):
+                                store, candidates = search_cpmb(zone_file, 
+                                    zone["engine"], 
+                                    zone_core(ar, dec, ra_size, dec_size))
+                            
+                    searched.put((zone, zone_file, store, candidates))
+                except Exception:
+                    searched.put((zone, (ar, dec, None, 
+                                         traceback.format_exc(), None, 
+                                         False, [])))
+            
+            # The results saved are returned as soon as possible.
+            while True:
+                try:
+                    result = results.get_nowait()
+                except Queue.Empty:
+                    break
+                
+                num_results += 1
+                
+                yield result
+                
+        if not extractor_died:
+            measures = get_extracted(extracted, extractor)
+        
+            if measures is not None:
+                instrument.merge(measures)
+        
+        searched.put(None)
+        saver.join()
+            
+        while num_results < len(zones):
+            num_results += 1
+            
+            yield results.get()
+            
+    finally:
+        if extractor.is_alive():
+            extractor.terminate()
+            
+        extractor.join()
+
+def memory_zones(zones, catalog):
+    """Get the zones with their objects selected from the catalog loaded in
+    memory, one by one so only the objects of the zones being processed are
+    copied.
+    
+    Args:
+        zones: Dictionaries with the data of the zones.
+        catalog: Catalog as returned by load_catalog.
+        
+    Return:
+        The dictionaries of the zones with their objects.
+        
+    """
+    
+    for zone in zones:
+        
+        # The zones unchanged since the last run don't need their objects.
+        if zone["catalog_unchanged"]:
+            yield zone
+            
+            continue
+        
+        limits = zone_limits(*zone["tile"], 
+                             spherical=zone["engine"] in SPHERICAL_ENGINES)
+        
+        zone = dict(zone)
+        
+        zone["store"] = select_zone(catalog, limits)
+        
+        yield zone
+
+def profile_file_name(tile, profile_zone):
+    """Get the name of the file to save the profile of a zone, only if it
+    is the zone to profile.
+    
+    Args:
+        tile: Tile of the zone.
+        profile_zone: RA and DEC of the zone to profile, or None.
+        
+    """
+    
+    file_name = None
+    
+    if profile_zone is not None and \
+        (float(tile[0]), float(tile[1])) == tuple(profile_zone):
+        file_name = PROFILE_FILE_NAME % tile[:2]
+        
+    return file_name
+
+def process_catalog_file(catalog_file_name, engine, num_jobs, partition, 
+                         tiles, profile_zone=None, manifest_file_name=None, 
+                         resume=False, pipeline=False, memory=False):
     """Process the file containing the catalog of objects to find those 
     with common proper motion.
     
     First the catalog is divided into zones to distribute the checking of 
-    the pairs found.
-    The pairs are searched by zones.
-    There is some overlapping between zones to avoid loosing pairs.
+    the pairs found. The zones could be extracted one by one or all together
+    reading the catalog only once.
+    The pairs are searched by zones, several zones could be processed in 
+    parallel, but the results are always collected in the same order.
+    There is some overlapping between zones to avoid loosing pairs, but 
+    each pair is only saved by the zone whose core contains its first star.
+    The zones are those of the fixed grid or the tiles received, planned 
+    according to the density of objects.
+    A manifest records the objects of each zone and the parameters used to
+    search its pairs, so in the next run the zones that haven't changed are
+    not searched again.
+    A marker is saved for each zone completed until all the zones are 
+    completed, so a run interrupted could be resumed from the first zone not
+    completed.
+    In the pipelined mode the zones are processed by a single job, but the
+    extraction and saving of the zones overlap with the search of pairs.
+    In the in-memory mode the catalog is loaded once and the objects of each
+    zone are selected from it, without writing the files of the zones.
     
     Args:
         catalog_file_name: Name of the file with the catalog.
+        engine: Name of the engine used to search the near stars.
+        num_jobs: Number of zones processed in parallel.
+        partition: Indicates if all the zones are extracted in a single pass.
+        tiles: Tiles of the zones, if None the fixed grid is used.
+        profile_zone: RA and DEC of a zone whose search is profiled.
+        manifest_file_name: Name of the manifest, by default it is named 
+            after the catalog.
+        resume: Indicates if the zones completed by a previous run are 
+            skipped.
+        pipeline: Indicates if the zones are processed in a pipeline.
+        memory: Indicates if the zones are selected from the catalog loaded 
+            in memory.
         
     """
     
     print "Processing catalog file: %s" % catalog_file_name
     
-    for ar in range(RA_MIN, RA_MAX, RA_SIZE):
-        for dec in range(int(DEC_MIN), int(DEC_MAX), DEC_SIZE):
-            
-            print "Processing AR %d DEC %d" % (ar, dec)
+    if tiles is None:
+        tiles = grid_tiles()
+    
+    if manifest_file_name is None:
+        manifest_file_name = manifest_name(catalog_file_name)
+        
+    manifest = read_manifest(manifest_file_name)
+    
+    markers_dir = markers_name(catalog_file_name)
+    
+    if resume:
+        completed = read_markers(markers_dir)
+        
+        manifest.update(completed)
+        
+    num_pruned = prune_manifest(manifest, tiles)
+    
+    if num_pruned:
+        print "Removed %d zones no longer processed from the manifest." % \
+            num_pruned
+    
+    if resume:
+        tiles = [ t for t in tiles if tile_key(t) not in completed ]
+        
+        print "Resuming the processing, %d zones already completed." % \
+            len(completed)
+    else:
+        clear_markers(markers_dir)
+    
+    signature = catalog_signature(catalog_file_name)
+    
+    zones = [ { "catalog": catalog_file_name, "tile": t, "engine": engine, 
+               "zone_file": None, "store": None,
+               "profile_file": profile_file_name(t, profile_zone),
+               "manifest_entry": manifest.get(tile_key(t)),
+               "signature": signature,
+               "catalog_unchanged": \
+                   is_catalog_unchanged(manifest.get(tile_key(t)), signature,
+                                        engine) } \
+             for t in tiles ]
+    
+    tiles_to_extract = [ z["tile"] for z in zones \
+                        if not z["catalog_unchanged"] ]
+    
+    if partition and tiles_to_extract:
+        zone_files = partition_catalog(catalog_file_name, tiles_to_extract, 
+                                       engine in SPHERICAL_ENGINES)
+        
+        for zone in zones:
+            zone["zone_file"] = zone_files.get(zone["tile"])
+    
+    zones_to_search = zones
+    
+    if memory:
+        print "Loading catalog in memory: %s" % catalog_file_name
+        
+        zones_to_search = memory_zones(zones, load_catalog(catalog_file_name))
+    
+    pool = None
+    
+    if pipeline:
+        print "Processing %d zones in a pipeline." % len(zones)
+        
+        results = pipeline_zones(zones)
+    elif num_jobs > 1:
+        print "Processing %d zones using %d jobs." % (len(zones), num_jobs)
+        
+        # The workers start without the measures of this process.
+        pool = multiprocessing.Pool(num_jobs, instrument.reset)
+        
+        results = pool.imap(process_zone, zones_to_search)
+    else:
+        results = itertools.imap(process_zone, zones_to_search)
+        
+    failed_zones = []
+    
+    num_skipped = 0
+    
+    # The workers are stopped if the processing is interrupted by an error.
+    finished = False
+    
+    try:
+        for zone, (ar, dec, cpmb_file, error, entry, skipped, measures) in \
+            itertools.izip(zones, results):
             
-            out_file_name = extract_zone(catalog_file_name, ar, dec)
+            instrument.merge(measures)
             
-            cpmb_file = find_cpmb(out_file_name)
-
-            print "Saved out file %s" % cpmb_file
+            if error is None:
+                if skipped:
+                    print "Unchanged AR %s DEC %s, using out file %s" % \
+                        (ar, dec, cpmb_file)
+                    
+                    num_skipped += 1
+                else:
+                    print "Processed AR %s DEC %s, saved out file %s" % \
+                        (ar, dec, cpmb_file)
+                    
+                manifest[tile_key(zone["tile"])] = entry
+                
+                write_marker(markers_dir, zone["tile"], entry)
+            else:
+                print "ERROR: Processing AR %s DEC %s:\n%s" % (ar, dec, error)
+                
+                failed_zones.append((ar, dec))
+                
+                manifest.pop(tile_key(zone["tile"]), None)
+                
+        finished = True
+    finally:
+        if pool is not None:
+            if finished:
+                pool.close()
+            else:
+                pool.terminate()
+                
+            pool.join()
+        
+    write_manifest(manifest, manifest_file_name)
+    
+    # The markers are kept to resume the zones failed.
+    if not failed_zones:
+        clear_markers(markers_dir)
+    
+    if num_skipped:
+        print "%d zones unchanged since the last run." % num_skipped
+        
+    if failed_zones:
+        print "%d zones couldn't be processed: %s" % \
+            (len(failed_zones), 
+             ", ".join(["AR %s DEC %s" % z for z in failed_zones]))
             
     print "Finished the processing of the catalog file: %s" % catalog_file_name
     
@@ -66,7 +619,22 @@ def main(progargs):
 
     """    
     
-    process_catalog_file(progargs.file_name)
+    tiles = None
+    
+    if progargs.report_file_provided:
+        instrument.enable()
+    
+    if progargs.plan_file_provided:
+        tiles = read_plan(progargs.plan_file_name)
+    
+    process_catalog_file(progargs.file_name, progargs.engine, 
+                         progargs.num_jobs, progargs.partition, tiles,
+                         progargs.profile_zone, progargs.manifest_file_name,
+                         progargs.resume, progargs.pipeline, 
+                         progargs.memory)
+    
+    if progargs.report_file_provided:
+        instrument.save_report(progargs.report_file_name)
         
     print "Program finished."
     
@@ -23,26 +23,68 @@ catalog.
 """
 
 import sys
+import os
+import shutil
+import multiprocessing
 from ctes import *
+from common import compression, open_file
+from colcache import ColumnCacheWriter, cache_name, csv_to_cache
 
 NUM_ARGS = 2
 
+# Option to save also the columns in a binary cache.
+BINARY_OPTION = "-b"
+
+# Option to parse the file in parallel, followed by the number of processes.
+JOBS_OPTION = "-j"
+
 DATA_DELIMITER = '|' 
 
-def process_text_file(text_file_name):
+CHUNK_FILE_SUFFIX = ".part%03d"
+
+def filter_line(line):
+    """Get the columns of interest of a line of the text file.
+    
+    Args:
+        line: Line of the text file.
+        
+    Return:
+        The list of values of the columns of interest or None if the line 
+        doesn't contain data.
+        
+    """
+    
+    row_filtered = None
+    
+    line_stripped = line.strip()        
+    
+    if line_stripped[:1] == DATA_DELIMITER:
+        data_line = line_stripped[1:-1].strip()
+        
+        row = data_line.split(DATA_DELIMITER)
+        
+        row_filtered = [row[i].strip() for i in COLS_OF_INTEREST]
+        
+    return row_filtered
+
+def process_text_file(text_file_name, binary=False):
     """Process the data of the catalog to generate a output file containing
     only the columns of interest.
     
     The input file must use a text format with columns delimited by a separator.
-    The output file is saved in CSV format.
+    The output file is saved in CSV format. Optionally the columns are also 
+    saved in a binary cache that could be read without parsing text again.
     
     Args:
         text_file_name: Name of the text file containing the catalog.
+        binary: Indicates if the binary cache must be also created.
         
     """
     
     num_rows = 0
     
+    cache_writer = None
+    
     print "Opening text file for reading: %s" % text_file_name
     
     out_file_name = text_file_name.replace('.txt', '.csv')
@@ -52,19 +94,14 @@ def process_text_file(text_file_name):
         try:        
             print "Opening file for writing: %s" % out_file_name
             
-            out_file = open(out_file_name, 'w')
+            out_file = open_file(out_file_name, 'w')
             
-            with open(text_file_name, 'rb') as fr:
+            with open_file(text_file_name, 'rb') as fr:
                 for line in fr:
                     
-                    line_stripped = line.strip()        
+                    row_filtered = filter_line(line)
     
-                    if line_stripped[0] == DATA_DELIMITER:
-                        data_line = line_stripped[1:-1].strip()
-                        
-                        row = data_line.split(DATA_DELIMITER)
-                        
-                        row_filtered = [row[i].strip() for i in COLS_OF_INTEREST]
+                    if row_filtered is not None:
                         
                         out_line = CSV_DELIMITER.join(row_filtered)
                         
@@ -72,10 +109,24 @@ def process_text_file(text_file_name):
                         
                         out_file.write("\n")
                         
+                        # The first row contains the names of the columns.
+                        if binary:
+                            if cache_writer is None:
+                                cache_writer = ColumnCacheWriter( \
+                                    cache_name(text_file_name), row_filtered)
+                            else:
+                                cache_writer.add_row(row_filtered)
+                        
                         num_rows += 1
                         
             out_file.close()
             
+            if cache_writer is not None:
+                cache_writer.close()
+                
+                print "Binary cache saved with %d rows." % \
+                    cache_writer.num_rows
+            
             print "Process finished, %d rows saved." % num_rows
         
         except IOError as ioe:
@@ -84,10 +135,171 @@ def process_text_file(text_file_name):
     else:
         print "ERROR: Input file has the same name that output file must have."
 
+def chunk_ranges(text_file_name, num_chunks):
+    """Divide a file in ranges of bytes, each one beginning at the start of a
+    line.
+    
+    Args:
+        text_file_name: Name of the text file.
+        num_chunks: Number of ranges to get.
+        
+    Return:
+        List of tuples (start, end) for each range, some could be empty.
+        
+    """
+    
+    size = os.path.getsize(text_file_name)
+    
+    limits = [0]
+    
+    with open(text_file_name, 'rb') as fr:
+        for i in range(1, num_chunks):
+            
+            pos = max(size * i / num_chunks, limits[-1])
+            
+            # Move the limit to the start of the next line.
+            if pos > 0:
+                fr.seek(pos - 1)
+                fr.readline()
+                pos = fr.tell()
+            
+            limits.append(min(pos, size))
+            
+    limits.append(size)
+    
+    return [ (limits[i], limits[i + 1]) for i in range(num_chunks) ]
+
+def process_chunk(chunk):
+    """Process a range of bytes of the text file to save the columns of 
+    interest to a chunk file.
+    
+    Args:
+        chunk: Tuple with the name of the text file, the range of bytes and 
+            the name of the chunk file.
+        
+    Return:
+        The number of rows saved.
+        
+    """
+    
+    text_file_name, start, end, chunk_file_name = chunk
+    
+    num_rows = 0
+    
+    with open(chunk_file_name, 'w') as out_file:
+        with open(text_file_name, 'rb') as fr:
+            fr.seek(start)
+            
+            pos = start
+            
+            while pos < end:
+                line = fr.readline()
+                
+                if not line:
+                    break
+                
+                pos += len(line)
+                
+                row_filtered = filter_line(line)
+                
+                if row_filtered is not None:
+                    out_file.write(CSV_DELIMITER.join(row_filtered))
+                    out_file.write("\n")
+                    
+                    num_rows += 1
+                    
+    return num_rows
+
+def process_text_file_parallel(text_file_name, num_jobs, binary=False):
+    """Process the data of the catalog as process_text_file, but dividing the
+    text file in ranges of lines that are processed in parallel.
+    
+    The output of each range is saved to a chunk file and these files are
+    concatenated in order to create the output file.
+    The ranges of bytes of a compressed file can't be read separately, so a
+    compressed file is processed as process_text_file does.
+    
+    Args:
+        text_file_name: Name of the text file containing the catalog.
+        num_jobs: Number of processes used.
+        binary: Indicates if the binary cache must be also created.
+        
+    """
+    
+    if compression(text_file_name) is not None:
+        print "Compressed file processed without parallel jobs: %s" % \
+            text_file_name
+            
+        return process_text_file(text_file_name, binary)
+    
+    print "Opening text file for reading: %s" % text_file_name
+    
+    out_file_name = text_file_name.replace('.txt', '.csv')
+    
+    if out_file_name != text_file_name:
+        
+        try:
+            chunks = [ (text_file_name, start, end, 
+                        out_file_name + CHUNK_FILE_SUFFIX % i) \
+                      for i, (start, end) in \
+                      enumerate(chunk_ranges(text_file_name, num_jobs)) ]
+            
+            pool = multiprocessing.Pool(num_jobs)
+            
+            chunk_rows = pool.map(process_chunk, chunks)
+            
+            pool.close()
+            pool.join()
+            
+            print "Opening file for writing: %s" % out_file_name
+            
+            with open_file(out_file_name, 'w') as out_file:
+                for i, chunk in enumerate(chunks):
+                    
+                    print "Chunk %d: bytes %d to %d, %d rows." % \
+                        (i, chunk[1], chunk[2], chunk_rows[i])
+                    
+                    with open(chunk[3], 'rb') as fr:
+                        shutil.copyfileobj(fr, out_file)
+                        
+                    os.remove(chunk[3])
+                    
+            print "Process finished, %d rows saved." % sum(chunk_rows)
+            
+            if binary:
+                csv_to_cache(out_file_name)
+        
+        except IOError as ioe:
+            print "ERROR: %s: Opening text file: %s" % (ioe, text_file_name)  
+            
+    else:
+        print "ERROR: Input file has the same name that output file must have."
+
 if __name__ == "__main__":
     
-    if len(sys.argv) == NUM_ARGS:
-        sys.exit(process_text_file(sys.argv[1]))
+    args = sys.argv[1:]
+    
+    binary = BINARY_OPTION in args
+    
+    if binary:
+        args.remove(BINARY_OPTION)
+        
+    num_jobs = 1
+    
+    if JOBS_OPTION in args:
+        pos = args.index(JOBS_OPTION)
+        
+        try:
+            num_jobs = int(args[pos + 1])
+            
+            del args[pos:pos + 2]
+        except (IndexError, ValueError):
+            num_jobs = 0
+    
+    if len(args) == NUM_ARGS - 1 and num_jobs > 1:
+        sys.exit(process_text_file_parallel(args[0], num_jobs, binary))
+    elif len(args) == NUM_ARGS - 1 and num_jobs == 1:
+        sys.exit(process_text_file(args[0], binary))
     else:
-        print "ERROR: Wrong number of parameters. Use: %s input_file_name" % \
-                      sys.argv[0]
\ No newline at end of file
+        print "ERROR: Wrong number of parameters. Use: %s input_file_name " \
+            "[%s] [%s num_jobs]" % (sys.argv[0], BINARY_OPTION, JOBS_OPTION)
\ No newline at end of file
@@ -22,75 +22,472 @@
 """
 
 import sys
+import os
 import csv
+import math
+import itertools
+import numpy as np
+from collections import OrderedDict
 from ctes import *
 from common import *
+from colcache import CACHE_EXT, is_cache, open_cache, write_cache
+from instrument import measured, count
+from loader import read_header, read_chunks
 
 NUM_ARGS = 4
 
-def extract_zone(csv_file_name, ra, dec):
+# Maximum number of zone files kept open at the same time when partitioning.
+MAX_OPEN_FILES = 64
+
+# Rows kept in memory for each zone before writing them to its file.
+ZONE_BUFFER_ROWS = 1000
+
+def grid_tiles():
+    """Get the zones of the fixed grid used to divide the sky.
+    Each zone is a tile defined by its starting RA and DEC, its size in RA 
+    and DEC and its margin.
+    
+    Return:
+        List of tuples (ra, dec, ra_size, dec_size, margin) for each zone.
+        
+    """
+    
+    return [ (ra, dec, RA_SIZE, DEC_SIZE, ZONE_MARGIN) \
+            for ra in range(RA_MIN, RA_MAX, RA_SIZE) \
+            for dec in range(int(DEC_MIN), int(DEC_MAX), DEC_SIZE) ]
+
+def zone_limits(ra, dec, ra_size=RA_SIZE, dec_size=DEC_SIZE, 
+                margin=ZONE_MARGIN, spherical=False):
+    """Get the limits of a zone including its margin.
+    For a spherical margin the margin in RA is the largest difference in RA
+    of the positions at the angular distance of the margin from the core, 
+    that from the position of the core farthest from the equator. 
+    The zones whose core is nearer to a pole than the margin cover all the 
+    RA, as the positions around the pole could be near any of its stars, so
+    the stars of the rows of zones at the poles are in all the zones of the
+    row, although most of them are only near to stars of its core.
+    
+    Args:
+        ra: Starting RA for the zone.
+        dec: Starting DEC for the zone.
+        ra_size: Size in RA of the zone.
+        dec_size: Size in DEC of the zone.
+        margin: Margin of the zone.
+        spherical: Indicates if the margin is an angular distance.
+        
+    Return:
+        The minimum and maximum RA and the minimum and maximum DEC.
+        
+    """
+    
+    min_dec = float(dec) - margin
+    max_dec = float(dec) + dec_size + margin
+    
+    ra_margin = margin
+    
+    if spherical:
+        max_abs_dec = max(abs(float(dec)), abs(float(dec) + dec_size))
+        
+        sin_margin = math.sin(math.radians(margin))
+        cos_dec = math.cos(math.radians(max_abs_dec))
+        
+        if sin_margin < cos_dec:
+            ra_margin = math.degrees(math.asin(sin_margin / cos_dec))
+        else:
+            ra_margin = 180.0
+    
+    return float(ra) - ra_margin, float(ra) + ra_size + ra_margin, \
+        min_dec, max_dec
+
+def zone_core(ra, dec, ra_size=RA_SIZE, dec_size=DEC_SIZE):
+    """Get the limits of the core of a zone, without margin.
+    Every position of the sky is in the core of only one zone, so the pairs
+    are assigned to the zone whose core contains one of its stars.
+    The stars of a zone outside its core are in the halo of the zone, they 
+    are only used to complete the pairs of the stars in the core.
+    
+    Args:
+        ra: Starting RA for the zone.
+        dec: Starting DEC for the zone.
+        ra_size: Size in RA of the zone.
+        dec_size: Size in DEC of the zone.
+        
+    Return:
+        The minimum and maximum RA and the minimum and maximum DEC.
+        
+    """
+    
+    return float(ra), float(ra) + ra_size, float(dec), float(dec) + dec_size
+
+def in_core(ra, dec, core):
+    """Indicates if a position is inside the core of a zone. 
+    The minimum limits are included in the core but not the maximum ones.
+    Works also with arrays of positions.
+    
+    Args:
+        ra: RA of the position.
+        dec: DEC of the position.
+        core: Limits of the core as returned by zone_core.
+        
+    """
+    
+    min_ra, max_ra, min_dec, max_dec = core
+    
+    return (ra >= min_ra) & (ra < max_ra) & (dec >= min_dec) & (dec < max_dec)
+
+def in_zone(ra, dec, limits):
+    """Indicates if a position is inside the limits of a zone.
+    The limits in RA could be below 0 or above 360, so the RA is also 
+    compared turned once around the sky.
+    Works also with arrays of positions.
+    
+    Args:
+        ra: RA of the position.
+        dec: DEC of the position.
+        limits: Limits of the zone as returned by zone_limits.
+        
+    """
+    
+    min_ra, max_ra, min_dec, max_dec = limits
+    
+    in_ra = ((ra > min_ra) & (ra < max_ra)) | \
+        ((ra - 360.0 > min_ra) & (ra - 360.0 < max_ra)) | \
+        ((ra + 360.0 > min_ra) & (ra + 360.0 < max_ra))
+    
+    return in_ra & (dec > min_dec) & (dec < max_dec)
+
+def zone_file_name(csv_file_name, ra, dec):
+    """Get the name of the file for the objects of a zone.
+    The objects of a zone extracted from a binary cache are saved also as a
+    cache.
+    
+    Args:
+        csv_file_name: Name of the CSV file or cache with the data.
+        ra: Starting RA for the zone.
+        dec: Starting DEC for the zone.
+        
+    """
+    
+    if csv_file_name.endswith(CACHE_EXT):
+        file_name = "%s_%s_%s%s" % (csv_file_name[:-len(CACHE_EXT)], ra, dec, 
+                                    CACHE_EXT)
+    else:
+        suffix = "_%s_%s.csv" % (ra, dec)
+        
+        file_name = csv_file_name.replace(".csv", suffix)
+        
+    return file_name
+
+def extract_cache_zone(cache_dir, ra, dec, limits):
+    """Extract the objects of a zone from a binary cache to a new cache.
+    
+    Args:
+        cache_dir: Directory of the cache with the data.
+        ra: Starting RA for the zone.
+        dec: Starting DEC for the zone.
+        limits: Limits of the zone as returned by zone_limits.
+        
+    Return:
+        The cache created.
+        
+    """
+    
+    names, columns = open_cache(cache_dir)
+    
+    selected = in_zone(columns[RA_COL], columns[DEC_COL], limits)
+        
+    out_cache_dir = zone_file_name(cache_dir, ra, dec)
+    
+    count("rows_read", len(selected))
+    count("rows_written", np.count_nonzero(selected))
+    
+    print "Writing %d objects to cache: %s" % (np.count_nonzero(selected), 
+                                               out_cache_dir)
+    
+    write_cache(out_cache_dir, names, 
+                [ np.asarray(col[selected]) for col in columns ])
+    
+    return out_cache_dir
+
+@measured("extract_zone")
+def extract_zone(csv_file_name, ra, dec, ra_size=RA_SIZE, dec_size=DEC_SIZE, 
+                 margin=ZONE_MARGIN, spherical=False):
     """Calculate the proper motion of the objects and add it as a column.
+    If the data is in a binary cache the zone is saved also as a cache.
     
     Args:
-        csv_file_name: Name of the CSV file with the data.
+        csv_file_name: Name of the CSV file or cache with the data.
         ra: Starting RA for the zone.
         dec: Starting DEC for the zone.
+        ra_size: Size in RA of the zone.
+        dec_size: Size in DEC of the zone.
+        margin: Margin of the zone.
+        spherical: Indicates if the margin is an angular distance.
         
     Return:
         The output file created.
         
     """
     
-    min_ra = float(ra) - ZONE_MARGIN 
-    max_ra = float(ra) + RA_SIZE + ZONE_MARGIN 
+    limits = zone_limits(ra, dec, ra_size, dec_size, margin, spherical)
     
-    min_dec = float(dec) - ZONE_MARGIN 
-    max_dec = float(dec) + DEC_SIZE + ZONE_MARGIN   
+    print "RA between %.5g and %.5g DEC between %.5g and %.5g" % limits
     
-    print "RA between %.5g and %.5g DEC between %.5g and %.5g" % \
-                 (min_ra, max_ra, min_dec, max_dec)   
+    if is_cache(csv_file_name):
+        return extract_cache_zone(csv_file_name, ra, dec, limits)
     
     row_num = 0
+    num_written = 0
     
-    suffix = "_%s_%s.csv" % (ra, dec)
-    
-    out_file_name = csv_file_name.replace(".csv", suffix)
+    out_file_name = zone_file_name(csv_file_name, ra, dec)
     
     print "Opening file for writing: %s" % out_file_name   
     
     try:    
-        with open(out_file_name, 'w') as csv_out:   
+        with atomic_open(out_file_name) as csv_out:   
             writer = csv.writer(csv_out, delimiter=CSV_DELIMITER)
         
             print "Opening file for reading: %s" % csv_file_name
             
-            with open(csv_file_name, 'rb') as csv_in:
-                reader = csv.reader(csv_in, delimiter=CSV_DELIMITER)
+            header = read_header(csv_file_name)
+            
+            if header is not None:
+                writer.writerow([r.replace("...", "") for r in header])
                 
-                for row in reader:
+                # The positions of each chunk of rows are checked at once.
+                for rows, _, values in read_chunks(csv_file_name, 
+                                                   [RA_COL, DEC_COL]):
                     
-                    write_row = False
+                    selected = np.flatnonzero(in_zone(values[:, 0], 
+                                                      values[:, 1], limits))
                     
-                    if row_num == 0:
-                        write_row = True
-                    else:
-                        ra = get_float_value(row[RA_COL], row_num)
-                        dec = get_float_value(row[DEC_COL], row_num)
-                        
-                        if ra > min_ra and ra < max_ra and \
-                            dec > min_dec and dec < max_dec:
-                            write_row = True
-                        
-                    if write_row:                           
-                        writer.writerow([r.replace("...", "") for r in row])
+                    writer.writerows([ [r.replace("...", "") for r in rows[i]] \
+                                      for i in selected ])
                     
-                    row_num += 1   
+                    row_num += len(rows)
+                    num_written += len(selected)
                         
     except IOError as ioe:
         print "ERROR: %s" % ioe  
         
+    count("rows_read", row_num)
+    count("rows_written", num_written)
+        
     return out_file_name
         
+def grid_cell(ra, dec):
+    """Get the cell of the fixed grid of zones that contains a position.
+    The RA turns around the sky.
+    
+    Args:
+        ra: RA of the position.
+        dec: DEC of the position.
+        
+    """
+    
+    return int(math.floor((ra - RA_MIN) / RA_SIZE)) % (360 / RA_SIZE), \
+        int(math.floor((dec - DEC_MIN) / DEC_SIZE))
+
+def zone_buckets(zones):
+    """Get the zones that could contain the positions of each cell of the 
+    fixed grid of zones.
+    
+    Args:
+        zones: Dictionary of the limits of the zones indexed by its tile.
+        
+    Return:
+        A dictionary with the list of tiles for each cell of the grid.
+        
+    """
+    
+    buckets = {}
+    
+    for tile, limits in zones.items():
+        
+        min_ra, max_ra, min_dec, max_dec = limits
+        
+        first_ra = int(math.floor((min_ra - RA_MIN) / RA_SIZE))
+        last_ra = int(math.floor((max_ra - RA_MIN) / RA_SIZE))
+        
+        _, first_dec = grid_cell(min_ra, min_dec)
+        _, last_dec = grid_cell(max_ra, max_dec)
+        
+        # The cells of RA turn around the sky.
+        ra_cells = set([ i % (360 / RA_SIZE) for i in \
+                        range(first_ra, last_ra + 1) ])
+        
+        for i in ra_cells:
+            for j in range(first_dec, last_dec + 1):
+                buckets.setdefault((i, j), []).append(tile)
+                
+    return buckets
+
+def zones_of_position(ra, dec, zones, buckets):
+    """Get the zones whose limits, including the margin, contain a position.
+    
+    Args:
+        ra: RA of the position.
+        dec: DEC of the position.
+        zones: Dictionary of the limits of the zones indexed by its tile.
+        buckets: Tiles of each cell of the grid, as returned by zone_buckets.
+        
+    Return:
+        The tiles of the zones that contain the position.
+        
+    """
+    
+    return [ tile for tile in buckets.get(grid_cell(ra, dec), []) \
+            if in_zone(ra, dec, zones[tile]) ]
+
+def flush_zone_rows(file_name, rows, open_files, max_open_files):
+    """Write the rows buffered for a zone to its file.
+    The files are kept open to be reused, but when there are too many files
+    opened the least recently used is closed.
+    
+    Args:
+        file_name: Name of the file of the zone.
+        rows: Rows to write.
+        open_files: Ordered dictionary of files opened.
+        max_open_files: Maximum number of files opened at the same time.
+        
+    """
+    
+    f = open_files.pop(file_name, None)
+    
+    if f is None:
+        if len(open_files) >= max_open_files:
+            _, lru_file = open_files.popitem(last=False)
+            lru_file.close()
+            
+        f = open(file_name, 'a')
+        
+    # Reinsert the file as the most recently used.
+    open_files[file_name] = f
+    
+    writer = csv.writer(f, delimiter=CSV_DELIMITER)
+    
+    writer.writerows(rows)
+    
+    del rows[:]
+
+@measured("partition_catalog")
+def partition_catalog(csv_file_name, tiles=None, spherical=False, 
+                      max_open_files=MAX_OPEN_FILES):
+    """Extract the objects of all the zones reading the catalog only once.
+    Each row is written to the files of all the zones that contain it, 
+    including their margins, so the files created are the same that 
+    extract_zone creates for each zone.
+    The zones of a binary cache are extracted directly from its columns.
+    
+    Args:
+        csv_file_name: Name of the CSV file or cache with the data.
+        tiles: Tiles of the zones, by default those of the fixed grid.
+        spherical: Indicates if the margins are angular distances.
+        max_open_files: Maximum number of zone files opened at the same time.
+        
+    Return:
+        A dictionary with the file created for each zone, indexed by the 
+        tile of the zone, empty if the catalog couldn't be partitioned.
+        
+    """
+    
+    if tiles is None:
+        tiles = grid_tiles()
+        
+    zones = OrderedDict([ (t, zone_limits(*t, spherical=spherical)) \
+                         for t in tiles ])
+    
+    if is_cache(csv_file_name):
+        return OrderedDict([ (t, extract_cache_zone(csv_file_name, t[0], t[1], 
+                                                    zones[t])) for t in zones ])
+    
+    buckets = zone_buckets(zones)
+    
+    out_file_names = OrderedDict([ (z, zone_file_name(csv_file_name, z[0], 
+                                                      z[1])) for z in zones ])
+    
+    # The zones are written to temporary files renamed at the end, so no zone
+    # file is left partially written. These files aren't compressed, so 
+    # their names are those of the uncompressed zone files.
+    tmp_file_names = dict([ (z, temp_file_name(uncompressed_name(f))) \
+                           for z, f in out_file_names.items() ])
+    
+    buffers = dict([ (z, []) for z in zones ])
+    
+    open_files = OrderedDict()
+    
+    row_num = 0
+    num_written = 0
+    
+    print "Opening file for reading: %s" % csv_file_name
+    
+    try:
+        header = read_header(csv_file_name)
+        
+        # Create the files of all the zones with the header.
+        for file_name in tmp_file_names.values():
+            with open(file_name, 'w') as csv_out:
+                if header is not None:
+                    writer = csv.writer(csv_out, delimiter=CSV_DELIMITER)
+                
+                    writer.writerow([r.replace("...", "") for r in header])
+                
+        for rows, _, values in read_chunks(csv_file_name, [RA_COL, DEC_COL]):
+            
+            for row, (ra, dec) in itertools.izip(rows, values.tolist()):
+                
+                for z in zones_of_position(ra, dec, zones, buckets):
+                    buffers[z].append([r.replace("...", "") for r in row])
+                    
+                    num_written += 1
+                    
+                    if len(buffers[z]) >= ZONE_BUFFER_ROWS:
+                        flush_zone_rows(tmp_file_names[z], buffers[z], 
+                                        open_files, max_open_files)
+                        
+            row_num += len(rows)
+                        
+        for z in zones:
+            if buffers[z]:
+                flush_zone_rows(tmp_file_names[z], buffers[z], 
+                                open_files, max_open_files)
+                
+        for f in open_files.values():
+            f.close()
+            
+        open_files.clear()
+                
+        # The zone files are appended while they are written, so they are
+        # compressed once they are complete.
+        for z in zones:
+            if compression(out_file_names[z]) is None:
+                os.rename(tmp_file_names[z], out_file_names[z])
+            else:
+                compress_file(tmp_file_names[z], out_file_names[z])
+                    
+    except (IOError, OSError) as ioe:
+        print "ERROR: %s" % ioe
+        
+        # No zone is returned, so they are extracted again one by one.
+        out_file_names = OrderedDict()
+        
+    finally:
+        for f in open_files.values():
+            f.close()
+            
+        # The temporary files left are those of the zones not completed.
+        for file_name in tmp_file_names.values():
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+            
+    count("rows_read", row_num)
+    count("rows_written", num_written)
+            
+    print "Catalog partitioned in %d zones, %d rows read." % \
+        (len(out_file_names), row_num)
+        
+    return out_file_names
+
 if __name__ == "__main__":
     
     if len(sys.argv) == NUM_ARGS:
@@ -26,13 +26,22 @@ Bull. Inf. Centre Donnees Stellaires, 30, p.129.
 
 import sys
 import os
-import csv
 import math
+import array
+import bisect
+import itertools
 import numpy as np
+from collections import deque
 
 from ctes import *
+from common import atomic_open
+from colcache import CACHE_EXT, is_cache, open_cache
+from extzone import in_core, in_zone
+from instrument import stage, measured, count
+from loader import read_file
 
 NUM_ARGS = 2
+NUM_ARGS_WITH_ENGINE = 3
 
 # 84" in decimal degrees.
 ANG_DIST_DEC_DEG = 0.0233333333
@@ -42,33 +51,23 @@ MIN_PM_MODULE = 50.0
 
 MAX_PM_ERROR_PERCENT = 0.2
 
+# Returned instead of a file name when no candidate is found.
+NO_CANDIDATES_FILE = "NO FILE WITH CANDIDATES"
+
 DEC_DEG_TO_MAS = (3600 * 1000) 
 DEC_DEG_TO_RAD = 0.017453293
 
 LN_0_05 = -2.995732274
 
-def read_csv_data(csv_file_name):
-    """Read data from a CSV file.
-    
-    Args:
-        csv_file_name: Name of the CSV file.
-        
-    """
-    
-    data = []
-    
-    with open(csv_file_name, 'rb') as f:
-        
-        reader = csv.reader(f)
-    
-        try:
-            for row in reader:
-                data.append(row)
-        
-        except csv.Error:
-            print "ERROR: reading file %s" % csv_file_name
-            
-    return data
+# Relative margin added to the windows of proper motion searched, so the 
+# rounding never discards a pair that meets Halbwachs first criteria.
+PM_WINDOW_MARGIN = 1e-9
+
+# Number of pairs of stars evaluated at once by the criteria.
+PAIRS_BATCH_SIZE = 100000
+
+# Type of the indexes of the stars of the candidates in the store of a zone.
+CANDIDATE_DTYPE = np.int32
 
 def near_objects(star_a, star_b):
     """Indicates if both stars are close enough to be considered for common 
@@ -172,20 +171,785 @@ def Halbwachs_second_criteria(star_a_pm, star_b_pm, sep_in_deg_dec):
     # From Halbwachs 3.
     return sep_in_mas / star_a_pm < 1000 and sep_in_mas / star_b_pm < 1000   
 
-def get_numbers(data):
-    """Get the data received as a list of numbers.
-    The first item of the row is a number and the rest are converted to float.
+def float_array(values):
+    """Get values as a compact array of floats, whose items are converted to
+    Python floats only when they are read.
+    
+    Args:
+        values: Array with the values.
+        
+    """
+    
+    return array.array("d", np.ascontiguousarray(values, 
+                                                 dtype=np.float64).tostring())
+
+def index_array(indexes):
+    """Get indexes as a compact array of integers, whose items are converted
+    to Python integers only when they are read.
+    
+    Args:
+        indexes: Array with the indexes.
+        
+    """
+    
+    return array.array("l", np.ascontiguousarray(indexes, 
+                                                 dtype=np.int_).tostring())
+
+def near_stars(ra, dec, i, j):
+    """Indicates if two stars are close enough to be considered for common 
+    proper motion, as near_objects does.
+    
+    Args:
+        ra: Array with the RA of the stars.
+        dec: Array with the DEC of the stars.
+        i: Index of the star A.
+        j: Index of the star B.
+    
+    """
+    
+    ra_dif = ra[i] - ra[j]
+    dec_dif = dec[i] - dec[j]
+        
+    sep_in_deg_dec = math.sqrt( math.pow(ra_dif, 2) + math.pow(dec_dif, 2) )
+    
+    return sep_in_deg_dec < ANG_DIST_DEC_DEG, sep_in_deg_dec
+
+def brute_force_pairs(columns):
+    """Search the pairs of stars close enough comparing each star with all the
+    stars that follow it.
+    
+    Args:
+        columns: Array with the data of the stars.
+        
+    Return:
+        Tuples (i, j, sep_in_deg_dec) for each pair of near stars, i < j.
+        
+    """
+    
+    ra = float_array(columns[:, RA_COL])
+    dec = float_array(columns[:, DEC_COL])
+    
+    for i in xrange(len(ra)):
+        for j in xrange(i+1, len(ra)):
+            
+            near, sep_in_deg_dec = near_stars(ra, dec, i, j)
+            
+            if near:
+                yield i, j, sep_in_deg_dec
+
+def grid_cells(columns):
+    """Get the cells of the grid that contain the stars.
+    The size of the cells is the maximum separation allowed between stars, so 
+    the stars near a given one are in its cell or in the adjacent ones.
+    
+    Args:
+        columns: Array with the data of the stars.
+        
+    Return:
+        The arrays with the cell in RA and in DEC of each star.
+        
+    """
+    
+    return np.floor(columns[:, RA_COL] / ANG_DIST_DEC_DEG).astype(np.int64), \
+        np.floor(columns[:, DEC_COL] / ANG_DIST_DEC_DEG).astype(np.int64)
+
+def cell_keys(cells):
+    """Encode the cells of the stars in a grid as integers. There is room 
+    for the cells adjacent to those of the stars, so the key of an adjacent 
+    cell is the key of the cell plus the shift of each coordinate multiplied
+    by its stride.
+    
+    Args:
+        cells: List of arrays with each coordinate of the cell of the stars.
+        
+    Return:
+        The array with the key of the cell of each star and the list of the
+        strides of the coordinates.
+        
+    """
+    
+    keys = np.zeros(len(cells[0]), dtype=np.int64)
+    strides = [ 1 ] * len(cells)
+    
+    stride = 1
+    
+    for d in reversed(range(len(cells))):
+        
+        strides[d] = stride
+        
+        if len(keys):
+            low = cells[d].min() - 1
+            
+            keys += (cells[d] - low) * stride
+            
+            stride *= int(cells[d].max() - low + 2)
+            
+    return keys, strides
+
+def cell_index(keys, values=None):
+    """Index the stars by the key of their cell. The stars are sorted by the
+    key of their cell and, in each cell, by the values received and then by
+    their index.
+    The index only keeps compact arrays, without a Python object for each 
+    star or cell.
+    
+    Args:
+        keys: Array with the key of the cell of each star.
+        values: Array with the values to sort the stars of each cell.
+        
+    Return:
+        The compact arrays with the indexes of the stars sorted, the keys of
+        the cells sorted and the position in the first array of the first 
+        star of each cell, followed by the number of stars.
+        
+    """
+    
+    order = np.lexsort((keys,) if values is None else (values, keys))
+    
+    sorted_keys = keys[order]
+    
+    starts = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    
+    if len(order):
+        starts = np.append(0, starts)
+    
+    return index_array(order), index_array(sorted_keys[starts]), \
+        index_array(np.append(starts, len(order)))
+
+def cell_limits(index, key):
+    """Get the positions of the stars of a cell in an index.
+    
+    Args:
+        index: Index as returned by cell_index.
+        key: Key of the cell.
+        
+    Return:
+        The first position and the position after the last one of the stars
+        of the cell, or None if there is no star in the cell.
+        
+    """
+    
+    _, keys, starts = index
+    
+    pos = bisect.bisect_left(keys, key)
+    
+    if pos < len(keys) and keys[pos] == key:
+        return starts[pos], starts[pos + 1]
+    
+    return None
+
+def grid_pairs(columns):
+    """Search the pairs of stars close enough using a grid hash to compare 
+    each star only with the stars in the adjacent cells.
+    The pairs are returned in the same order than brute_force_pairs.
+    
+    Args:
+        columns: Array with the data of the stars.
+        
+    Return:
+        Tuples (i, j, sep_in_deg_dec) for each pair of near stars, i < j.
+        
+    """
+    
+    ra = float_array(columns[:, RA_COL])
+    dec = float_array(columns[:, DEC_COL])
+    
+    keys, (ra_stride, dec_stride) = cell_keys(grid_cells(columns))
+    
+    index = cell_index(keys)
+    
+    order = index[0]
+    
+    keys = index_array(keys)
+    
+    shifts = [ ra_shift * ra_stride + dec_shift * dec_stride \
+              for ra_shift in (-1, 0, 1) for dec_shift in (-1, 0, 1) ]
+        
+    for i in xrange(len(ra)):
+        
+        neighbours = []
+        
+        for shift in shifts:
+            limits = cell_limits(index, keys[i] + shift)
+            
+            if limits is not None:
+                neighbours.extend([ j for j in order[limits[0]:limits[1]] \
+                                   if j > i ])
+                
+        for j in sorted(neighbours):
+            
+            near, sep_in_deg_dec = near_stars(ra, dec, i, j)
+            
+            if near:
+                yield i, j, sep_in_deg_dec
+
+def sweep_pairs(columns):
+    """Search the pairs of stars close enough sweeping the stars sorted by 
+    DEC. A window keeps only the stars whose DEC is close enough to the DEC 
+    of the current star, and only the stars of the window close enough in RA
+    are compared with it.
+    The pairs aren't returned in the same order than brute_force_pairs.
+    
+    Args:
+        columns: Array with the data of the stars.
+        
+    Return:
+        Tuples (i, j, sep_in_deg_dec) for each pair of near stars, i < j.
+        
+    """
+    
+    ra = float_array(columns[:, RA_COL])
+    dec = float_array(columns[:, DEC_COL])
+    
+    order = index_array(np.argsort(columns[:, DEC_COL], kind="mergesort"))
+    
+    window = deque()
+    
+    for i in order:
+        
+        ra_i = ra[i]
+        dec_i = dec[i]
+        
+        # The stars left behind are too far in DEC of the rest of stars.
+        while window and dec_i - dec[window[0]] >= ANG_DIST_DEC_DEG:
+            window.popleft()
+            
+        for j in window:
+            
+            if abs(ra_i - ra[j]) < ANG_DIST_DEC_DEG:
+                
+                near, sep_in_deg_dec = near_stars(ra, dec, i, j)
+                
+                if near:
+                    yield min(i, j), max(i, j), sep_in_deg_dec
+                    
+        window.append(i)
+
+def pm_tolerance(pm_error, max_pm_error):
+    """Get the maximum difference of proper motion allowed by Halbwachs first 
+    criteria between a star and any star whose error is not greater than the
+    maximum error received.
+    
+    Args:
+        pm_error: Proper motion error of the star.
+        max_pm_error: Maximum proper motion error of the stars.
+        
+    """
+    
+    # From Halbwachs (9), with the sigma of (3) for the maximum error.
+    sigma = math.sqrt( math.pow(pm_error, 2) + math.pow(max_pm_error, 2) )
+    
+    return math.sqrt(-2 * sigma * LN_0_05) * (1 + PM_WINDOW_MARGIN)
+
+def error_bands(columns):
+    """Get the bands of the proper motion errors of the stars. The bands are 
+    powers of two of the errors in RA and DEC, so the errors of the stars of
+    a band are at most twice those of any other star of the band.
+    
+    Args:
+        columns: Array with the data of the stars.
+        
+    Return:
+        The arrays with the band of the error in RA and in DEC of each star.
+        
+    """
+    
+    return np.frexp(np.abs(columns[:, PMRA_TOTERR_COL]))[1].astype(np.int64), \
+        np.frexp(np.abs(columns[:, PMDEC_TOTERR_COL]))[1].astype(np.int64)
+
+def band_max_errors(columns, bands):
+    """Get the maximum errors in RA and DEC of the stars of each band.
+    
+    Args:
+        columns: Array with the data of the stars.
+        bands: Array with the key of the band of each star.
+        
+    Return:
+        A dictionary with the maximum errors in RA and DEC of each band, 
+        indexed by the key of the band.
+        
+    """
+    
+    max_errors = {}
+    
+    for band in np.unique(bands).tolist():
+        in_band = bands == band
+        
+        max_errors[band] = \
+            (float(np.abs(columns[in_band, PMRA_TOTERR_COL]).max()),
+             float(np.abs(columns[in_band, PMDEC_TOTERR_COL]).max()))
+            
+    return max_errors
+
+def pm_index_pairs(columns):
+    """Search the pairs of stars close enough whose proper motions could meet
+    Halbwachs first criteria.
+    The stars are indexed by their cell in a grid like that of grid_pairs 
+    and, in each cell, by the band of their errors, as returned by 
+    error_bands, and sorted by their RA proper motion. For each star only 
+    the stars of the adjacent cells inside a window of RA proper motion are 
+    compared, the window for the stars of each band is calculated from the 
+    error of the star and the maximum error of the band, so no pair that 
+    meets the criteria is lost. As the errors of a band are at most twice 
+    the smallest one, the window for a pair is at most that of the pair with
+    the errors of its second star doubled, so a star with a large error only
+    widens the windows for the stars of its band.
+    The pairs returned must still be checked with the criteria.
+    The pairs aren't returned in the same order than brute_force_pairs.
+    
+    Args:
+        columns: Array with the data of the stars.
+        
+    Return:
+        Tuples (i, j, sep_in_deg_dec) for each pair of near stars, i < j.
+        
+    """
+    
+    ra = float_array(columns[:, RA_COL])
+    dec = float_array(columns[:, DEC_COL])
+    dec_pm = float_array(columns[:, DEC_PM_COL])
+    ra_error = float_array(columns[:, PMRA_TOTERR_COL])
+    dec_error = float_array(columns[:, PMDEC_TOTERR_COL])
+    
+    keys, (ra_stride, dec_stride) = cell_keys(grid_cells(columns))
+    
+    bands, _ = cell_keys(error_bands(columns))
+    
+    max_errors = band_max_errors(columns, bands)
+    
+    num_bands = int(bands.max()) + 1 if len(bands) else 1
+    
+    # The stars are grouped by cell and band, the groups of a cell are 
+    # consecutive in the index.
+    index = cell_index(keys * num_bands + bands, columns[:, RA_PM_COL])
+    
+    order, group_keys, starts = index
+    
+    # The RA proper motion of the stars in the order of the index.
+    pms = float_array(columns[np.frombuffer(order, dtype=np.int_), 
+                              RA_PM_COL])
+    
+    ra_pm = float_array(columns[:, RA_PM_COL])
+    
+    keys = index_array(keys)
+    
+    shifts = [ ra_shift * ra_stride + dec_shift * dec_stride \
+              for ra_shift in (-1, 0, 1) for dec_shift in (-1, 0, 1) ]
+        
+    for i in xrange(len(ra)):
+        
+        star_ra_pm = ra_pm[i]
+        star_dec_pm = dec_pm[i]
+        
+        tolerances = dict([ (band, 
+                             (pm_tolerance(ra_error[i], max_ra_error),
+                              pm_tolerance(dec_error[i], max_dec_error))) \
+                           for band, (max_ra_error, max_dec_error) in \
+                           max_errors.items() ])
+        
+        for shift in shifts:
+            
+            first_key = (keys[i] + shift) * num_bands
+            
+            first_group = bisect.bisect_left(group_keys, first_key)
+            last_group = bisect.bisect_left(group_keys, first_key + num_bands,
+                                            first_group)
+                
+            for g in xrange(first_group, last_group):
+                
+                ra_tol, dec_tol = tolerances[group_keys[g] - first_key]
+                
+                first = bisect.bisect_left(pms, star_ra_pm - ra_tol, 
+                                           starts[g], starts[g + 1])
+                last = bisect.bisect_right(pms, star_ra_pm + ra_tol, 
+                                           first, starts[g + 1])
+                
+                for j in order[first:last]:
+                    
+                    if j > i and abs(star_dec_pm - dec_pm[j]) <= dec_tol:
+                        
+                        near, sep_in_deg_dec = near_stars(ra, dec, i, j)
+                        
+                        if near:
+                            yield i, j, sep_in_deg_dec
+
+def unit_vector(ra, dec):
+    """Get the unit vector on the sphere of a position.
     
     Args:
-        data: data with values.
+        ra: RA of the position.
+        dec: DEC of the position.
         
     """
+    
+    ra = math.radians(ra)
+    dec = math.radians(dec)
+    
+    return math.cos(dec) * math.cos(ra), math.cos(dec) * math.sin(ra), \
+        math.sin(dec)
+
+def sphere_pairs(columns):
+    """Search the pairs of stars close enough using the unit vectors of their
+    positions, hashed in a grid of cubes whose side is the maximum chord 
+    allowed between stars.
+    The chord distance doesn't depend on the RA and DEC, so the pairs at 
+    both sides of RA 0 and near the poles are found, and the separation 
+    returned is the angular distance on the sphere.
+    
+    Args:
+        columns: Array with the data of the stars.
+        
+    Return:
+        Tuples (i, j, sep_in_deg_dec) for each pair of near stars, i < j.
+        
+    """
+    
+    max_chord = 2 * math.sin(math.radians(ANG_DIST_DEC_DEG) / 2)
+    
+    vectors = [ array.array("d") for _ in range(3) ]
+    
+    for ra, dec in itertools.izip(float_array(columns[:, RA_COL]), 
+                                  float_array(columns[:, DEC_COL])):
+        for v, c in zip(vectors, unit_vector(ra, dec)):
+            v.append(c)
+    
+    keys, strides = cell_keys([ np.floor(np.frombuffer(v, dtype=np.float64) \
+                                         / max_chord).astype(np.int64) \
+                               for v in vectors ])
+    
+    index = cell_index(keys)
+    
+    order = index[0]
+    
+    keys = index_array(keys)
+    
+    xs, ys, zs = vectors
+        
+    shifts = [ x * strides[0] + y * strides[1] + z * strides[2] \
+              for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1) ]
+        
+    for i in xrange(len(xs)):
+        
+        neighbours = []
+        
+        for shift in shifts:
+            limits = cell_limits(index, keys[i] + shift)
+            
+            if limits is not None:
+                neighbours.extend([ j for j in order[limits[0]:limits[1]] \
+                                   if j > i ])
+            
+        xi = xs[i]
+        yi = ys[i]
+        zi = zs[i]
+            
+        for j in sorted(neighbours):
+            
+            chord = math.sqrt(math.pow(xi - xs[j], 2) + \
+                              math.pow(yi - ys[j], 2) + \
+                              math.pow(zi - zs[j], 2))
+            
+            if chord < max_chord:
+                sep_in_deg_dec = math.degrees(2 * math.asin(chord / 2))
+                
+                if sep_in_deg_dec < ANG_DIST_DEC_DEG:
+                    yield i, j, sep_in_deg_dec
+
+# Engines available to search the pairs of near stars.
+ENGINES = { "brute": brute_force_pairs, "grid": grid_pairs, 
+           "sphere": sphere_pairs, "sweep": sweep_pairs, 
+           "pm": pm_index_pairs }
+
+# Engines that use the angular distance on the sphere, these engines need 
+# zones whose margins cover the same distance at any DEC.
+SPHERICAL_ENGINES = [ "sphere" ]
+
+DEFAULT_ENGINE = "grid"
+
+def pair_batches(pairs):
+    """Group the pairs of stars received in batches of arrays.
+    
+    Args:
+        pairs: Tuples (i, j, sep_in_deg_dec) for each pair of near stars.
+        
+    Return:
+        Tuples of arrays (idx_a, idx_b, sep_in_deg_dec) with up to 
+        PAIRS_BATCH_SIZE pairs.
+        
+    """
+    
+    pairs = iter(pairs)
+    
+    while True:
+        batch = np.array(list(itertools.islice(pairs, PAIRS_BATCH_SIZE)), 
+                         dtype=np.float64)
+        
+        if not len(batch):
+            break
+        
+        yield batch[:, 0].astype(np.intp), batch[:, 1].astype(np.intp), \
+            batch[:, 2]
+
+def vector_module_batch(ra_pm, dec_pm):
+    """Calculates the module for the proper motion of several stars.
+    
+    Args:
+        ra_pm: Array of RA proper motions.
+        dec_pm: Array of DEC proper motions.
+        
+    """
+    
+    return np.sqrt( np.square(ra_pm) + np.square(dec_pm) )
+
+def pm_reliability_criteria_batch(columns, idx_a, idx_b):
+    """Applies the reliability criteria to a batch of pairs of stars.
+    The checks are the same than those of pm_reliability_criteria.
+    
+    Args:
+        columns: Array with the data of the stars.
+        idx_a: Indexes of the stars A.
+        idx_b: Indexes of the stars B.
+    
+    """
+    
+    return low_pm_error(columns[idx_a, RA_PM_COL], 
+                        columns[idx_a, PMRA_TOTERR_COL]) & \
+        low_pm_error(columns[idx_a, DEC_PM_COL], 
+                     columns[idx_a, PMDEC_TOTERR_COL]) & \
+        low_pm_error(columns[idx_b, RA_PM_COL], 
+                     columns[idx_b, PMRA_TOTERR_COL])
+
+def Halbwachs_first_criteria_batch(columns, idx_a, idx_b):
+    """Applies Halbwachs first criteria to a batch of pairs of stars.
+    
+    Args:
+        columns: Array with the data of the stars.
+        idx_a: Indexes of the stars A.
+        idx_b: Indexes of the stars B.
+        
+    """
+    
+    delta_pm_ra = columns[idx_a, RA_PM_COL] - columns[idx_b, RA_PM_COL]
+    delta_pm_dec = columns[idx_a, DEC_PM_COL] - columns[idx_b, DEC_PM_COL]
+    
+    # sigma calculation from Halbwachs (3).
+    sigma_ra = np.sqrt( np.square(columns[idx_a, PMRA_TOTERR_COL]) + \
+                np.square(columns[idx_b, PMRA_TOTERR_COL]) )
+                
+    sigma_dec = np.sqrt( np.square(columns[idx_a, PMDEC_TOTERR_COL]) + \
+                np.square(columns[idx_b, PMDEC_TOTERR_COL]) )
+    
+    # From Halbwachs (9).
+    return (np.square(delta_pm_ra) < (-2 * sigma_ra * LN_0_05)) & \
+        (np.square(delta_pm_dec) < (-2 * sigma_dec * LN_0_05))
+        
+def Halbwachs_second_criteria_batch(stars_pm, idx_a, idx_b, sep_in_deg_dec):
+    """Applies Halbwachs second criteria to a batch of pairs of stars.
+    
+    Args:
+        stars_pm: Array with the proper motion module of the stars.
+        idx_a: Indexes of the stars A.
+        idx_b: Indexes of the stars B.
+        sep_in_deg_dec: Separations of the pairs in decimal degrees.
+        
+    """
+    
+    sep_in_mas = sep_in_deg_dec * DEC_DEG_TO_MAS
+    
+    # A star without proper motion gives an infinite or undefined ratio, 
+    # so its pairs don't meet the criteria.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # From Halbwachs 3.
+        return (sep_in_mas / stars_pm[idx_a] < 1000) & \
+            (sep_in_mas / stars_pm[idx_b] < 1000)
+        
+def criteria_batch(columns, stars_pm, idx_a, idx_b, sep_in_deg_dec):
+    """Applies all the criteria to a batch of pairs of near stars.
+    The criteria for the module of the proper motion isn't applied, it is
+    expected that the stars have been already selected by this criteria.
+    
+    Args:
+        columns: Array with the data of the stars.
+        stars_pm: Array with the proper motion module of the stars.
+        idx_a: Indexes of the stars A.
+        idx_b: Indexes of the stars B.
+        sep_in_deg_dec: Separations of the pairs in decimal degrees.
+        
+    Return:
+        A boolean array indicating the pairs that meet all the criteria.
+        
+    """
+    
+    with stage("pm_reliability_criteria"):
+        reliable = pm_reliability_criteria_batch(columns, idx_a, idx_b)
+    
+    with stage("Halbwachs_second_criteria"):
+        second = Halbwachs_second_criteria_batch(stars_pm, idx_a, idx_b, 
+                                                 sep_in_deg_dec)
+    
+    with stage("Halbwachs_first_criteria"):
+        first = Halbwachs_first_criteria_batch(columns, idx_a, idx_b)
+    
+    # Pairs passing each criteria on its own.
+    count("pairs_pm_reliability", np.count_nonzero(reliable))
+    count("pairs_Halbwachs_second", np.count_nonzero(second))
+    count("pairs_Halbwachs_first", np.count_nonzero(first))
+    
+    return reliable & second & first
+
+def new_store(num_stars, id_dtype):
+    """Create the store of the stars of a zone.
+    The store is a structured array with a row for each star, with its 
+    identifier as a fixed width string and its values as numbers in the same
+    column indexes than the CSV data. The column of the identifier isn't 
+    numeric so it is set to NaN.
+    
+    Args:
+        num_stars: Number of stars.
+        id_dtype: Type of the identifiers.
+        
+    Return:
+        The structured array, with fields 'id' and 'values'.
         
-    number_list = [data[0]] 
+    """
+    
+    dtype = np.dtype([ ("id", id_dtype), 
+                      ("values", np.float64, (len(NAMES_COLS_OF_INTEREST),)) ])
+    
+    store = np.empty(num_stars, dtype=dtype)
     
-    number_list.extend([ float(x) for x in data[1:] ])
+    store["values"][:, ID_COL] = np.nan
     
-    return number_list
+    return store
+
+@measured("load_zone")
+def load_zone(csv_file_name):
+    """Load the stars of a zone from a CSV file to a store.
+    The values of each star are converted to numbers only once.
+    
+    Args:
+        csv_file_name: Name of the CSV file or cache with the stars.
+        
+    Return:
+        The store with the stars, as returned by new_store.
+        
+    """
+    
+    if is_cache(csv_file_name):
+        _, cache_columns = open_cache(csv_file_name)
+        
+        store = new_store(len(cache_columns[ID_COL]), 
+                          cache_columns[ID_COL].dtype)
+        
+        store["id"] = cache_columns[ID_COL]
+        
+        for c in range(len(cache_columns)):
+            if c != ID_COL:
+                store["values"][:, c] = cache_columns[c]
+        
+        return store
+    
+    float_cols = [ c for c in range(len(NAMES_COLS_OF_INTEREST)) \
+                  if c != ID_COL ]
+    
+    texts, values = read_file(csv_file_name, float_cols, [ ID_COL ])
+    
+    ids = np.array(texts[0], dtype=np.string_)
+    
+    store = new_store(len(ids), ids.dtype)
+    
+    store["id"] = ids
+    store["values"][:, float_cols] = values
+    
+    return store
+
+@measured("load_catalog")
+def load_catalog(csv_file_name):
+    """Load all the stars of a catalog to a store, to select the stars of 
+    each zone in memory instead of extracting them to files.
+    
+    Args:
+        csv_file_name: Name of the CSV file or cache with the catalog.
+        
+    Return:
+        The store with the stars, the indexes of the stars sorted by DEC and
+        their DEC in that order.
+        
+    """
+    
+    store = load_zone(csv_file_name)
+    
+    dec_order = np.argsort(store["values"][:, DEC_COL], kind="mergesort")
+    
+    return store, dec_order, store["values"][dec_order, DEC_COL]
+
+@measured("select_zone")
+def select_zone(catalog, limits):
+    """Select the stars of a zone from a catalog loaded in memory. 
+    Only the stars in the range of DEC of the zone are checked, and they are
+    kept in the order of the catalog, as extract_zone saves them, so the 
+    pairs found are the same.
+    
+    Args:
+        catalog: Catalog as returned by load_catalog.
+        limits: Limits of the zone as returned by zone_limits.
+        
+    Return:
+        The store with the stars of the zone.
+        
+    """
+    
+    store, dec_order, decs = catalog
+    
+    _, _, min_dec, max_dec = limits
+    
+    first = np.searchsorted(decs, min_dec, side="right")
+    last = np.searchsorted(decs, max_dec, side="left")
+    
+    indexes = np.sort(dec_order[first:last])
+    
+    columns = store["values"]
+    
+    selected = indexes[in_zone(columns[indexes, RA_COL], 
+                               columns[indexes, DEC_COL], limits)]
+    
+    count("rows_read", len(indexes))
+    count("rows_written", len(selected))
+    
+    return store[selected]
+
+def select_pm_stars(store):
+    """Select the stars that meet the criteria for the minimum module of the 
+    proper motion.
+    
+    Args:
+        store: Store with the data of the stars.
+        
+    Return:
+        The store with the stars selected and their proper motion module.
+        
+    """
+    
+    columns = store["values"]
+    
+    stars_pm = vector_module_batch(columns[:, RA_PM_COL], 
+                                   columns[:, DEC_PM_COL])
+    
+    selected = np.flatnonzero(pm_module_criteria(stars_pm))
+    
+    return store[selected], stars_pm[selected]
+
+def get_star(store, i):
+    """Get the data of a star as a list with its identifier and the rest of 
+    values as numbers.
+    
+    Args:
+        store: Store with the data of the stars.
+        i: Index of the star.
+        
+    """
+    
+    return [store["id"][i]] + store["values"][i, 1:].tolist()
 
 def get_column_values(row):
     """Get the data of the row as a string.
@@ -201,88 +965,145 @@ def get_column_values(row):
     
     return "%s%s%s" % (row[0], CSV_DELIMITER, CSV_DELIMITER.join(str_values))
 
-def save_candidates(candidates, csv_file_name):
+@measured("save_candidates")
+def save_candidates(store, candidates, csv_file_name):
     """Save the candidates found to a file in CSV format.
+    The candidates are saved sorted by the identifiers of both stars.
     
     Args:
-        candidates: List of candidates.
+        store: Store with the data of the stars.
+        candidates: Array with a row for each candidate with the indexes of 
+            both stars in the store.
         csv_file_name: Name of the file with the initial list of stars.
     
     """
     
-    output_file_name= "NO FILE WITH CANDIDATES"
+    output_file_name = NO_CANDIDATES_FILE
     
-    if not candidates:
+    if not len(candidates):
         print "No candidate pair found in file: %s" % csv_file_name
     else:
         path, file = os.path.split(csv_file_name)
         
+        # The candidates found in a cache are also saved as CSV.
+        if file.endswith(CACHE_EXT):
+            file = file[:-len(CACHE_EXT)] + ".csv"
+        
         output_file_name = os.path.join(path, OUT_FILE_PREFIX + file)
         
         print "Saving candidates to %s" % output_file_name
         
-        with open(output_file_name, "w") as fw:
+        with atomic_open(output_file_name) as fw:
         
             columns = CSV_DELIMITER.join(NAMES_COLS_OF_INTEREST)
         
             fw.write("%s%s%s\n" % (columns, CSV_DELIMITER, columns))
         
-            for c in candidates:
+            ids = store["id"]
+            
+            order = np.lexsort((ids[candidates[:, 1]], ids[candidates[:, 0]]))
+        
+            for i, j in candidates[order].tolist():
                 
-                columns_a = get_column_values(c[0])
-                columns_b = get_column_values(c[1])
+                columns_a = get_column_values(get_star(store, i))
+                columns_b = get_column_values(get_star(store, j))
                 
                 fw.write("%s%s%s\n" % (columns_a, CSV_DELIMITER, columns_b))
                 
+        count("rows_written", len(candidates))
+                
     return output_file_name
 
-def find_cpmb(csv_file_name):
-    """Find stars with common proper motion.
-    The stars are received in a file in CSV format.
+def search_cpmb(csv_file_name, engine=DEFAULT_ENGINE, core=None, store=None):
+    """Search stars with common proper motion, without saving them.
+    The stars are received in a file in CSV format, or already in a store.
     Only some columns are used for the calculations.
-    Each star is compared with all the stars that follow to find the matches.
+    The stars are read once to a store and those with a low proper motion 
+    are discarded before searching for pairs. The candidates are kept as the 
+    indexes of their stars in the store until they are saved.
+    The pairs of near stars are searched with the engine indicated and then 
+    the criteria are applied to batches of pairs.
+    When the core of the zone is indicated only the pairs whose first star, 
+    the anchor, is in the core are checked, the pairs anchored in the halo
+    of the zone belong to other zone.
     
     Args:
         csv_file_name: CSV file with the list of stars.
+        engine: Name of the engine used to search the near stars.
+        core: Limits of the core of the zone, as returned by zone_core.
+        store: Store with the stars, if they are already loaded.
+        
+    Return:
+        The store with the stars and the array with the indexes of the 
+        stars of each candidate, to save them with save_candidates.
         
     """
     
-    # To store the candidates with common proper motion.
+    # To store the indexes of the candidates with common proper motion.
     candidates = []
     
-    data = read_csv_data(csv_file_name)   
+    if store is None:
+        store = load_zone(csv_file_name)
+    
+    count("rows_read", len(store))
+    
+    store, stars_pm = select_pm_stars(store)
+    
+    count("stars_pm_module", len(store))
+    
+    columns = store["values"]
     
-    for i in range(1, len(data)):
+    if core is not None:
+        halo = ~in_core(columns[:, RA_COL], columns[:, DEC_COL], core)
+    else:
+        halo = np.zeros(len(columns), dtype=bool)
+    
+    for idx_a, idx_b, sep_in_deg_dec in pair_batches(ENGINES[engine](columns)):
         
-        star_a = get_numbers(data[i])
+        owned = ~halo[idx_a]
         
-        star_a_pm = vector_module(star_a[RA_PM_COL], star_a[DEC_PM_COL])
+        count("pairs_tested", len(idx_a))
+        count("pairs_owned", np.count_nonzero(owned))
         
-        # Proper motion vector_module criteria for star A.
-        if pm_module_criteria(star_a_pm):
+        idx_a = idx_a[owned]
+        idx_b = idx_b[owned]
+        sep_in_deg_dec = sep_in_deg_dec[owned]
         
-            for j in range(i+1, len(data)):
-                
-                star_b = get_numbers(data[j])
-                
-                star_b_pm = vector_module(star_b[RA_PM_COL], star_b[DEC_PM_COL])
-                
-                # Proper motion vector_module criteria for star B.
-                if pm_module_criteria(star_b_pm):
-                
-                    near, sep_in_deg_dec = near_objects(star_a, star_b)
-                    
-                    # Separation criteria and proper motion reliability.
-                    if near and pm_reliability_criteria(star_a, star_b) and \
-                        Halbwachs_second_criteria(star_a_pm, \
-                                                  star_b_pm, \
-                                                  sep_in_deg_dec):
-                    
-                        if Halbwachs_first_criteria(star_a, star_b, \
-                                                    sep_in_deg_dec):
-                            candidates.append([star_a, star_b])
+        selected = criteria_batch(columns, stars_pm, idx_a, idx_b, 
+                                  sep_in_deg_dec)
+        
+        candidates.append(np.column_stack((idx_a[selected], 
+                                           idx_b[selected])))
+    
+    if candidates:
+        candidates = np.concatenate(candidates).astype(CANDIDATE_DTYPE)
+    else:
+        candidates = np.empty((0, 2), dtype=CANDIDATE_DTYPE)
+    
+    count("candidates", len(candidates))
+    
+    return store, candidates
+
+@measured("find_cpmb")
+def find_cpmb(csv_file_name, engine=DEFAULT_ENGINE, core=None, store=None):
+    """Find stars with common proper motion and save them to a file in CSV
+    format, as search_cpmb and save_candidates do.
+    
+    Args:
+        csv_file_name: CSV file with the list of stars.
+        engine: Name of the engine used to search the near stars.
+        core: Limits of the core of the zone, as returned by zone_core.
+        store: Store with the stars, if they are already loaded. The file 
+            is then only used to name the file of the candidates.
+        
+    Return:
+        The name of the file with the candidates.
+        
+    """
+    
+    store, candidates = search_cpmb(csv_file_name, engine, core, store)
             
-    output_file_name = save_candidates(candidates, csv_file_name)
+    output_file_name = save_candidates(store, candidates, csv_file_name)
     
     return output_file_name
 
@@ -290,6 +1111,8 @@ if __name__ == "__main__":
     
     if len(sys.argv) == NUM_ARGS:
         sys.exit(find_cpmb(sys.argv[1]))
+    elif len(sys.argv) == NUM_ARGS_WITH_ENGINE and sys.argv[2] in ENGINES:
+        sys.exit(find_cpmb(sys.argv[1], sys.argv[2]))
     else:
-        print "ERROR: Wrong number of parameters. Use: %s input_file_name" % \
-        sys.argv[0]
\ No newline at end of file
+        print "ERROR: Wrong number of parameters. Use: %s input_file_name " \
+            "[%s]" % (sys.argv[0], "|".join(sorted(ENGINES)))
\ No newline at end of file
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Instrumentation of the stages of the processing.
+
+The stages record in a registry of the process their wall and CPU time,
+counters of the rows and pairs processed and the peak of memory. The
+instrumentation is disabled by default, so the stages only cost a function
+call until it is enabled.
+The registries of several processes could be merged and saved as a JSON
+report.
+"""
+
+import os
+import time
+import json
+import platform
+import resource
+import cProfile
+import functools
+import threading
+import contextlib
+from collections import OrderedDict
+
+# The memory allocated by python is traced when possible, otherwise only the
+# maximum resident set size of the process is known.
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Counter used to calculate the throughput of the stages.
+ROWS_COUNTER = "rows_read"
+
+_enabled = False
+
+# Measures of the stages by name.
+_stages = OrderedDict()
+
+# Stages running in each thread, the innermost is the last one.
+_local = threading.local()
+
+def enable(trace_memory=True):
+    """Enable the instrumentation.
+    
+    Args:
+        trace_memory: Indicates if the memory allocated must be traced, if
+            tracemalloc is available.
+            
+    """
+    
+    global _enabled
+    
+    _enabled = True
+    
+    if trace_memory and tracemalloc is not None and \
+        not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def active_stages():
+    """Get the stages running in the current thread.
+    
+    """
+    
+    if not hasattr(_local, "stages"):
+        _local.stages = []
+        
+    return _local.stages
+
+def is_enabled():
+    """Indicates if the instrumentation is enabled.
+    
+    """
+    
+    return _enabled
+
+def traced_peak():
+    """Get the peak of memory traced since the last reset, in kilobytes,
+    or None if the memory isn't traced.
+    
+    """
+    
+    peak = None
+    
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        peak = tracemalloc.get_traced_memory()[1] / 1024
+        
+    return peak
+
+def max_rss():
+    """Get the maximum resident set size of the process, in kilobytes in
+    Linux.
+    
+    """
+    
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def new_measures():
+    """Get the initial measures of a stage.
+    
+    """
+    
+    return { "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+             "peak_traced_kb": None, "max_rss_kb": 0,
+             "counters": OrderedDict() }
+
+def max_value(val1, val2):
+    """Get the maximum of two values that could be None.
+    
+    """
+    
+    if val1 is None:
+        return val2
+    elif val2 is None:
+        return val1
+    else:
+        return max(val1, val2)
+
+@contextlib.contextmanager
+def stage(name):
+    """Measure a stage while the context is active. The stages could be
+    nested, the counters are added to the innermost stage of the thread.
+    The peak of memory traced is that of the stage only when tracemalloc
+    could reset it, otherwise it is the peak since the tracing started.
+    
+    Args:
+        name: Name of the stage.
+        
+    """
+    
+    if not _enabled:
+        yield
+        return
+        
+    active = active_stages()
+    
+    can_reset = tracemalloc is not None and tracemalloc.is_tracing() and \
+        hasattr(tracemalloc, "reset_peak")
+    
+    # The peak reached until now belongs to the stage that contains this one.
+    if can_reset:
+        if active:
+            active[-1]["peak"] = max_value(active[-1]["peak"], traced_peak())
+        tracemalloc.reset_peak()
+        
+    frame = { "name": name, "peak": None }
+    
+    active.append(frame)
+    
+    # The stages are reported in the order they start.
+    _stages.setdefault(name, new_measures())
+    
+    start_time = time.time()
+    start_cpu = os.times()
+    
+    try:
+        yield
+    finally:
+        end_cpu = os.times()
+        
+        active.pop()
+        
+        measures = _stages.setdefault(name, new_measures())
+        
+        peak = max_value(frame["peak"], traced_peak())
+        
+        measures["calls"] += 1
+        measures["wall_seconds"] += time.time() - start_time
+        measures["cpu_seconds"] += (end_cpu[0] - start_cpu[0]) + \
+            (end_cpu[1] - start_cpu[1])
+        measures["peak_traced_kb"] = max_value(measures["peak_traced_kb"],
+                                               peak)
+        measures["max_rss_kb"] = max(measures["max_rss_kb"], max_rss())
+        
+        if active:
+            active[-1]["peak"] = max_value(active[-1]["peak"], peak)
+
+def measured(name):
+    """Decorator to measure each call to a function as a stage.
+    
+    Args:
+        name: Name of the stage.
+        
+    """
+    
+    def decorator(function):
+        
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+                
+        return wrapper
+        
+    return decorator
+
+def count(counter, value=1):
+    """Add a value to a counter of the innermost stage running in the current
+    thread.
+    
+    Args:
+        counter: Name of the counter.
+        value: Value to add.
+        
+    """
+    
+    active = active_stages()
+    
+    if _enabled and active:
+        counters = _stages.setdefault(active[-1]["name"],
+                                      new_measures())["counters"]
+        
+        counters[counter] = counters.get(counter, 0) + int(value)
+
+def reset():
+    """Clear the measures recorded.
+    
+    """
+    
+    _stages.clear()
+
+def collect():
+    """Get the measures recorded and clear the registry, so the measures of
+    a child process could be sent to its parent.
+    
+    Return:
+        List of tuples with the name and the measures of each stage.
+        
+    """
+    
+    measures = _stages.items()
+    
+    _stages.clear()
+    
+    return measures
+
+def merge(measures):
+    """Add to the registry the measures collected in other process.
+    The times and counters are added and for the memory the maximum is kept.
+    
+    Args:
+        measures: List of tuples with the name and the measures of each
+            stage.
+            
+    """
+    
+    for name, m in measures:
+        
+        current = _stages.setdefault(name, new_measures())
+        
+        current["calls"] += m["calls"]
+        current["wall_seconds"] += m["wall_seconds"]
+        current["cpu_seconds"] += m["cpu_seconds"]
+        current["peak_traced_kb"] = max_value(current["peak_traced_kb"],
+                                              m["peak_traced_kb"])
+        current["max_rss_kb"] = max(current["max_rss_kb"], m["max_rss_kb"])
+        
+        for counter, value in m["counters"].items():
+            current["counters"][counter] = \
+                current["counters"].get(counter, 0) + value
+
+def report():
+    """Get the report of the measures recorded.
+    The throughput of a stage is calculated from its counter of rows read.
+    
+    Return:
+        A dictionary with the information of the run and the measures of
+        each stage.
+        
+    """
+    
+    stages = OrderedDict()
+    
+    for name, m in _stages.items():
+        
+        s = dict(m)
+        
+        rows = m["counters"].get(ROWS_COUNTER)
+        
+        if rows is not None and m["wall_seconds"] > 0:
+            s["rows_per_second"] = rows / m["wall_seconds"]
+            
+        stages[name] = s
+        
+    return { "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+             "python": platform.python_version(),
+             "tracemalloc": tracemalloc is not None and \
+                tracemalloc.is_tracing(),
+             "max_rss_kb": max_rss(),
+             "stages": stages }
+
+def save_report(report_file_name):
+    """Save the report of the measures recorded to a JSON file.
+    
+    Args:
+        report_file_name: Name of the file.
+        
+    """
+    
+    print "Saving instrumentation report to file: %s" % report_file_name
+    
+    with open(report_file_name, "w") as fw:
+        json.dump(report(), fw, indent=2)
+
+@contextlib.contextmanager
+def profile(profile_file_name):
+    """Profile the code run while the context is active with cProfile and
+    save the statistics to a file, that could be read with pstats.
+    
+    Args:
+        profile_file_name: Name of the file.
+        
+    """
+    
+    profiler = cProfile.Profile()
+    
+    profiler.enable()
+    
+    try:
+        yield
+    finally:
+        profiler.disable()
+        
+        print "Saving profile to file: %s" % profile_file_name
+        
+        profiler.dump_stats(profile_file_name)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Bulk loader of the numeric columns of CSV files.
+
+The lines of a file are read by chunks and each column of a chunk is
+converted at once to a NumPy array. Only when a column contains a value that
+can't be converted, its values are converted one by one with
+get_float_value, that removes the '...' of the truncated values and reports
+the rows with wrong values.
+"""
+
+import csv
+import itertools
+import numpy as np
+
+from ctes import *
+from common import get_float_value, open_file
+
+# Rows read and converted at once.
+CHUNK_ROWS = 100000
+
+QUOTE_CHAR = '"'
+
+def float_column(str_values, row_nums, default=0.0):
+    """Convert the values of a column to floats.
+    
+    Args:
+        str_values: Values of the column as strings.
+        row_nums: Number of row of each value, to report the wrong values.
+        default: Value for the values that can't be converted.
+        
+    Return:
+        An array with the values converted.
+        
+    """
+    
+    try:
+        values = np.array(str_values, dtype=np.float64)
+    except ValueError:
+        values = np.array([ get_float_value(v, row_nums[i], default) \
+                           for i, v in enumerate(str_values) ],
+                          dtype=np.float64)
+        
+    return values
+
+def split_lines(lines, delimiter=CSV_DELIMITER):
+    """Split the lines of a CSV file in values. The lines are only parsed as
+    CSV when some value is quoted.
+    
+    Args:
+        lines: Lines of the file.
+        delimiter: Delimiter of the values.
+        
+    Return:
+        The list of values of each line.
+        
+    """
+    
+    if any([ QUOTE_CHAR in l for l in lines ]):
+        rows = list(csv.reader(lines, delimiter=delimiter))
+    else:
+        rows = [ l.rstrip("\r\n").split(delimiter) for l in lines ]
+        
+    return rows
+
+def read_header(file_name, delimiter=CSV_DELIMITER):
+    """Read the first row of a CSV file.
+    
+    Args:
+        file_name: Name of the file.
+        delimiter: Delimiter of the values.
+        
+    Return:
+        The list of values of the first row or None if the file is empty.
+        
+    """
+    
+    with open_file(file_name, "rb") as fr:
+        line = fr.readline()
+        
+    return split_lines([ line ], delimiter)[0] if line else None
+
+def read_chunks(file_name, float_cols, text_cols=(), skip_header=True,
+                delimiter=CSV_DELIMITER, chunk_rows=CHUNK_ROWS, default=0.0):
+    """Read a CSV file by chunks of rows converting some columns to floats.
+    The empty lines are ignored and the rows without all the columns needed
+    are reported and ignored. The rows are numbered from the first one after
+    the header.
+    
+    Args:
+        file_name: Name of the file.
+        float_cols: Indexes of the columns to convert to floats.
+        text_cols: Indexes of the columns to return as text, without '...'.
+        skip_header: Indicates if the first row is a header to ignore.
+        delimiter: Delimiter of the values.
+        chunk_rows: Number of rows of each chunk.
+        default: Value for the values that can't be converted.
+        
+    Return:
+        Tuples with, for each chunk, the list of values of each row, a list
+        with the values of each text column and an array with a row for each
+        row of the chunk and a column for each column converted.
+        
+    """
+    
+    num_cols = max(list(float_cols) + list(text_cols)) + 1
+    
+    row_num = 0
+    
+    with open_file(file_name, "rb") as fr:
+        
+        if skip_header:
+            fr.readline()
+            
+        while True:
+            lines = list(itertools.islice(fr, chunk_rows))
+            
+            if not lines:
+                break
+                
+            rows = split_lines(lines, delimiter)
+            
+            row_nums = xrange(row_num + 1, row_num + len(rows) + 1)
+            
+            row_num += len(rows)
+            
+            if any([ len(r) < num_cols for r in rows ]):
+                valid = [ i for i, r in enumerate(rows) \
+                         if len(r) >= num_cols ]
+                
+                for i, r in enumerate(rows):
+                    if 0 < len(r) < num_cols and r != [ "" ]:
+                        print "ERROR: Missing values in row %d" % row_nums[i]
+                        
+                rows = [ rows[i] for i in valid ]
+                row_nums = [ row_nums[i] for i in valid ]
+                
+            # The rows are transposed to get the values of each column.
+            columns = zip(*rows) if rows else [ () ] * num_cols
+            
+            values = np.empty((len(rows), len(float_cols)), dtype=np.float64)
+            
+            for i, c in enumerate(float_cols):
+                values[:, i] = float_column(columns[c], row_nums, default)
+                
+            texts = [ [ v.replace("...", "") for v in columns[c] ] \
+                     for c in text_cols ]
+            
+            yield rows, texts, values
+
+def read_file(file_name, float_cols, text_cols=(), skip_header=True,
+              delimiter=CSV_DELIMITER, default=0.0):
+    """Read a complete CSV file converting some columns to floats.
+    
+    Args:
+        file_name: Name of the file.
+        float_cols: Indexes of the columns to convert to floats.
+        text_cols: Indexes of the columns to return as text, without '...'.
+        skip_header: Indicates if the first row is a header to ignore.
+        delimiter: Delimiter of the values.
+        default: Value for the values that can't be converted.
+        
+    Return:
+        A list with the values of each text column and an array with a row
+        for each row of the file and a column for each column converted.
+        
+    """
+    
+    texts = [ [] for _ in text_cols ]
+    chunks = []
+    
+    for _, chunk_texts, values in read_chunks(file_name, float_cols,
+                                              text_cols, skip_header,
+                                              delimiter, default=default):
+        for i, t in enumerate(chunk_texts):
+            texts[i].extend(t)
+            
+        chunks.append(values)
+        
+    if chunks:
+        values = np.concatenate(chunks)
+    else:
+        values = np.empty((0, len(float_cols)), dtype=np.float64)
+        
+    return texts, values
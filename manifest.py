@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Manifest of the zones processed.
+
+For each zone the manifest records a hash of the objects extracted, the
+parameters of the criteria and the file with the candidates found, so a zone
+whose objects and parameters haven't changed since the last run doesn't need
+to be processed again.
+While a catalog is processed, a marker with the entry of the manifest is
+saved for each zone completed, so an interrupted run could be resumed.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+from common import atomic_open, uncompressed_name
+from findcpmb import ANG_DIST_DEC_DEG, MIN_PM_MODULE, MAX_PM_ERROR_PERCENT, \
+    NO_CANDIDATES_FILE, SPHERICAL_ENGINES
+
+MANIFEST_EXT = ".manifest.json"
+
+# Extension of the directory with the markers of the zones completed.
+MARKERS_EXT = ".done"
+
+MARKER_EXT = ".json"
+
+# Bytes read at once to calculate the hash of a file.
+HASH_BLOCK_SIZE = 1 << 20
+
+def manifest_name(catalog_file_name):
+    """Get the name of the manifest for a catalog.
+    
+    Args:
+        catalog_file_name: Name of the file or cache with the catalog.
+        
+    """
+    
+    return os.path.splitext(uncompressed_name( \
+        catalog_file_name.rstrip(os.sep)))[0] + MANIFEST_EXT
+
+def markers_name(catalog_file_name):
+    """Get the name of the directory with the markers of the zones completed
+    for a catalog.
+    
+    Args:
+        catalog_file_name: Name of the file or cache with the catalog.
+        
+    """
+    
+    return os.path.splitext(uncompressed_name( \
+        catalog_file_name.rstrip(os.sep)))[0] + MARKERS_EXT
+
+def criteria_params(engine):
+    """Get the parameters of the criteria that determine the candidates.
+    The engine is included because the spherical engines measure the true
+    angular separation, so they could find other pairs in the same zone.
+    
+    Args:
+        engine: Name of the engine used to search the near stars.
+        
+    """
+    
+    return { "ANG_DIST_DEC_DEG": ANG_DIST_DEC_DEG,
+             "MIN_PM_MODULE": MIN_PM_MODULE,
+             "MAX_PM_ERROR_PERCENT": MAX_PM_ERROR_PERCENT,
+             "ENGINE": engine,
+             "SPHERICAL": engine in SPHERICAL_ENGINES }
+
+def tile_key(tile):
+    """Get the key of a zone in the manifest.
+    
+    Args:
+        tile: Tile of the zone.
+        
+    """
+    
+    return ",".join([ repr(v) for v in tile ])
+
+def store_hash(store):
+    """Calculate the hash of the objects of a zone kept in a store. The hash
+    is calculated from the identifiers without padding and the values of the
+    objects, so it doesn't depend on the width of the identifiers of the 
+    catalog the zone is selected from.
+    
+    Args:
+        store: Store with the objects of the zone.
+        
+    """
+    
+    values = np.ascontiguousarray(store["values"])
+    
+    sha = hashlib.sha1()
+    
+    sha.update("%s %s\n" % (values.dtype.str, values.shape))
+    sha.update("\n".join([ i.strip() for i in store["id"].tolist() ]))
+    sha.update("\n")
+    sha.update(values.data)
+    
+    return sha.hexdigest()
+
+def zone_hash(zone_file_name):
+    """Calculate the hash of the objects of a zone, saved in a CSV file or
+    in a cache, whose files are hashed in order, or kept in a store in 
+    memory, hashed as store_hash does.
+    
+    Args:
+        zone_file_name: Name of the file or cache of the zone, or store with
+            its objects.
+            
+    """
+    
+    if isinstance(zone_file_name, np.ndarray):
+        return store_hash(zone_file_name)
+        
+    sha = hashlib.sha1()
+    
+    if os.path.isdir(zone_file_name):
+        file_names = [ os.path.join(zone_file_name, f) for f in \
+                      sorted(os.listdir(zone_file_name)) ]
+    else:
+        file_names = [ zone_file_name ]
+        
+    for file_name in file_names:
+        with open(file_name, "rb") as fr:
+            while True:
+                block = fr.read(HASH_BLOCK_SIZE)
+                
+                if not block:
+                    break
+                    
+                sha.update(block)
+                
+    return sha.hexdigest()
+
+def catalog_signature(catalog_file_name):
+    """Get the size and the time of modification of a catalog, those of the
+    files of a cache are added, to check cheaply if it hasn't changed.
+    
+    Args:
+        catalog_file_name: Name of the file or cache with the catalog.
+        
+    Return:
+        A list with the size and the latest time of modification.
+        
+    """
+    
+    if os.path.isdir(catalog_file_name):
+        file_names = [ os.path.join(catalog_file_name, f) for f in \
+                      sorted(os.listdir(catalog_file_name)) ]
+    else:
+        file_names = [ catalog_file_name ]
+        
+    stats = [ os.stat(f) for f in file_names ]
+    
+    return [ sum([ s.st_size for s in stats ]),
+             max([ s.st_mtime for s in stats ] or [ 0.0 ]) ]
+
+def zone_entry(zone_file_name, output_file_name, engine, signature=None):
+    """Get the entry of the manifest for a zone processed.
+    
+    Args:
+        zone_file_name: Name of the file or cache of the zone, or store with
+            its objects.
+        output_file_name: Name of the file with the candidates found.
+        engine: Name of the engine used to search the near stars.
+        signature: Signature of the catalog the zone is extracted from, as
+            returned by catalog_signature.
+            
+    """
+    
+    return { "hash": zone_hash(zone_file_name),
+             "catalog": signature,
+             "params": criteria_params(engine),
+             "output": output_file_name }
+
+def output_exists(entry):
+    """Indicates if the output recorded in an entry of the manifest exists.
+    
+    Args:
+        entry: Entry of the manifest for a zone.
+        
+    """
+    
+    return entry["output"] == NO_CANDIDATES_FILE or \
+        os.path.exists(entry["output"])
+
+def is_unchanged(entry, zone_file_name, engine):
+    """Indicates if a zone doesn't need to be processed again because its
+    objects and the parameters of the criteria are the same recorded in its
+    entry of the manifest, and its output still exists.
+    
+    Args:
+        entry: Entry of the manifest for the zone, or None.
+        zone_file_name: Name of the file or cache of the zone, or store with
+            its objects.
+        engine: Name of the engine used to search the near stars.
+        
+    """
+    
+    return entry is not None and \
+        entry["params"] == criteria_params(engine) and \
+        output_exists(entry) and \
+        entry["hash"] == zone_hash(zone_file_name)
+
+def is_catalog_unchanged(entry, signature, engine):
+    """Indicates if a zone doesn't need to be processed again because the
+    catalog it is extracted from and the parameters of the criteria are the
+    same recorded in its entry of the manifest, and its output still exists.
+    This check doesn't need to extract the zone, but when the catalog has 
+    changed is_unchanged could still find that the zone hasn't changed.
+    
+    Args:
+        entry: Entry of the manifest for the zone, or None.
+        signature: Signature of the catalog, as returned by 
+            catalog_signature.
+        engine: Name of the engine used to search the near stars.
+        
+    """
+    
+    return entry is not None and \
+        entry.get("catalog") == signature and \
+        entry["params"] == criteria_params(engine) and \
+        output_exists(entry)
+
+def prune_manifest(manifest, tiles):
+    """Remove from a manifest the entries of the zones that aren't processed
+    now, because the plan of the zones has changed, and remove their 
+    outputs, unless they are also the output of a zone processed now, so 
+    their candidates aren't merged with the current ones.
+    
+    Args:
+        manifest: Dictionary with the entry of each zone.
+        tiles: Tiles of the zones processed now.
+        
+    Return:
+        The number of entries removed.
+        
+    """
+    
+    keys = set([ tile_key(t) for t in tiles ])
+    
+    outputs = set([ manifest[k]["output"] for k in keys if k in manifest ])
+    
+    old_keys = [ k for k in manifest if k not in keys ]
+    
+    for key in old_keys:
+        entry = manifest.pop(key)
+        
+        if entry["output"] not in outputs and os.path.isfile(entry["output"]):
+            os.remove(entry["output"])
+            
+    return len(old_keys)
+
+def read_manifest(manifest_file_name):
+    """Read the entries of a manifest, if it exists.
+    
+    Args:
+        manifest_file_name: Name of the file of the manifest.
+        
+    Return:
+        A dictionary with the entry of each zone indexed by its key.
+        
+    """
+    
+    manifest = {}
+    
+    if os.path.exists(manifest_file_name):
+        try:
+            with open(manifest_file_name, "r") as fr:
+                manifest = json.load(fr)
+                
+            print "Read manifest with %d zones: %s" % (len(manifest),
+                                                      manifest_file_name)
+        except ValueError as ve:
+            print "ERROR: %s: Reading manifest: %s" % (ve, manifest_file_name)
+            
+    return manifest
+
+def write_manifest(manifest, manifest_file_name):
+    """Save the entries of a manifest.
+    
+    Args:
+        manifest: Dictionary with the entry of each zone.
+        manifest_file_name: Name of the file of the manifest.
+        
+    """
+    
+    print "Saving manifest with %d zones: %s" % (len(manifest),
+                                                 manifest_file_name)
+    
+    with atomic_open(manifest_file_name) as fw:
+        json.dump(manifest, fw, indent=1, sort_keys=True)
+
+def write_marker(markers_dir, tile, entry):
+    """Save the marker of a zone completed, with its entry of the manifest.
+    
+    Args:
+        markers_dir: Directory of the markers.
+        tile: Tile of the zone.
+        entry: Entry of the manifest for the zone.
+        
+    """
+    
+    if not os.path.isdir(markers_dir):
+        os.makedirs(markers_dir)
+        
+    with atomic_open(os.path.join(markers_dir,
+                                  tile_key(tile) + MARKER_EXT)) as fw:
+        json.dump(entry, fw)
+
+def read_markers(markers_dir):
+    """Read the markers of the zones completed whose output still exists.
+    
+    Args:
+        markers_dir: Directory of the markers.
+        
+    Return:
+        A dictionary with the entry of each zone completed indexed by its
+        key.
+        
+    """
+    
+    entries = {}
+    
+    if os.path.isdir(markers_dir):
+        for file_name in os.listdir(markers_dir):
+            
+            # The temporary files start with a dot.
+            if file_name.endswith(MARKER_EXT) and \
+                not file_name.startswith("."):
+            
+                with open(os.path.join(markers_dir, file_name), "r") as fr:
+                    entry = json.load(fr)
+                    
+                if output_exists(entry):
+                    entries[file_name[:-len(MARKER_EXT)]] = entry
+                    
+    return entries
+
+def clear_markers(markers_dir):
+    """Remove the markers of the zones completed.
+    
+    Args:
+        markers_dir: Directory of the markers.
+        
+    """
+    
+    if os.path.isdir(markers_dir):
+        shutil.rmtree(markers_dir)
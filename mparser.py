@@ -26,6 +26,8 @@ and provides these arguments to other modules.
 import argparse
 import logging
 
+from findcpmb import ENGINES, DEFAULT_ENGINE
+
 class ProgramArgumentsException(Exception):
     
     def __init__(self, msg):
@@ -42,6 +44,7 @@ class ProgramArguments(object):
     
     DEFAULT_LOG_LEVEL_NAME = logging.DEBUG
     DEFAULT_LOG_FILE_NAME = "log.txt"    
+    DEFAULT_NUM_JOBS = 1
     
     FIT_FORMAT_FILE = "FIT"
     FIT_FORMAT_FILE = "CSV"
@@ -49,6 +52,11 @@ class ProgramArguments(object):
     # Error messages related to parameters coherence.
     NO_FILE_NAME_PROVIDED = "The name of the file that contains the catalog " \
         "must be provided."                       
+    WRONG_NUM_JOBS = "The number of jobs must be greater than zero."
+    WRONG_MEMORY_MODE = "The in-memory mode can't be used with the " \
+        "partition of the catalog or the pipeline."
+    WRONG_PIPELINE_JOBS = "The pipeline uses a single job, it can't be " \
+        "used with several jobs."
     
     def __init__(self):
         """Initializes parser. 
@@ -67,6 +75,57 @@ class ProgramArguments(object):
         self.__parser.add_argument("-ff", dest="ff", metavar="file_format",
                                    help="Format of the catalog file.")                     
                 
+        self.__parser.add_argument("-e", dest="e", metavar="engine",
+                                   choices=sorted(ENGINES),
+                                   help="Engine to search the near stars: " \
+                                   "%s." % ", ".join(sorted(ENGINES)))
+        
+        self.__parser.add_argument("-j", dest="j", metavar="num_jobs", 
+                                   type=int,
+                                   help="Number of zones processed in " \
+                                   "parallel.")
+        
+        self.__parser.add_argument("-p", dest="p", action="store_true",
+                                   help="Split the catalog in all the " \
+                                   "zones reading it only once.")
+        
+        self.__parser.add_argument("-t", dest="t", metavar="plan_file",
+                                   help="File with the tiles to process, " \
+                                   "instead of the fixed grid of zones.")
+        
+        self.__parser.add_argument("-r", dest="r", metavar="report_file",
+                                   help="File to save a JSON report of " \
+                                   "the time, counters and memory of the " \
+                                   "stages.")
+        
+        self.__parser.add_argument("-z", dest="z", metavar=("ra", "dec"), 
+                                   nargs=2, type=float,
+                                   help="Zone whose search is profiled " \
+                                   "with cProfile.")
+        
+        self.__parser.add_argument("-m", dest="m", metavar="manifest_file",
+                                   help="File of the manifest of the zones " \
+                                   "processed, to skip those unchanged.")
+        
+        self.__parser.add_argument("--resume", dest="resume", 
+                                   action="store_true",
+                                   help="Resume an interrupted processing " \
+                                   "skipping the zones already completed.")
+        
+        self.__parser.add_argument("--pipeline", dest="pipeline", 
+                                   action="store_true",
+                                   help="Overlap the extraction of the " \
+                                   "zones and the saving of the candidates " \
+                                   "with the search of pairs, using a " \
+                                   "single job for the search.")
+        
+        self.__parser.add_argument("--memory", dest="memory", 
+                                   action="store_true",
+                                   help="Load the catalog once and select " \
+                                   "the objects of each zone in memory, " \
+                                   "without writing the files of the " \
+                                   "zones.")
+        
         self.__parser.add_argument("-l", metavar="log_file", dest="l",
                                    help="File to save the log messages.") 
         
@@ -78,6 +137,17 @@ class ProgramArguments(object):
         if not self.file_name_provided:
             raise ProgramArgumentsException(ProgramArguments.NO_FILE_NAME_PROVIDED) 
         
+        if self.num_jobs_provided and self.__args.j < 1:
+            raise ProgramArgumentsException(ProgramArguments.WRONG_NUM_JOBS)
+        
+        if self.memory and (self.partition or self.pipeline):
+            raise ProgramArgumentsException( \
+                ProgramArguments.WRONG_MEMORY_MODE)
+            
+        if self.pipeline and self.num_jobs > 1:
+            raise ProgramArgumentsException( \
+                ProgramArguments.WRONG_PIPELINE_JOBS)
+        
     @property    
     def file_name_provided(self): 
         return self.__args.f is not None           
@@ -98,6 +168,80 @@ class ProgramArguments(object):
     def file_format_is_csv(self):        
         return self.__args.ff == ProgramArguments.CSV_FORMAT_FILE    
     
+    @property
+    def engine_provided(self):
+        return self.__args.e is not None
+    
+    @property
+    def engine(self):
+        if not self.engine_provided:
+            eng = DEFAULT_ENGINE
+        else:
+            eng = self.__args.e
+            
+        return eng
+    
+    @property
+    def num_jobs_provided(self):
+        return self.__args.j is not None
+    
+    @property
+    def num_jobs(self):
+        if not self.num_jobs_provided:
+            nj = ProgramArguments.DEFAULT_NUM_JOBS
+        else:
+            nj = self.__args.j
+            
+        return nj
+    
+    @property
+    def partition(self):
+        return self.__args.p
+    
+    @property
+    def plan_file_provided(self):
+        return self.__args.t is not None
+    
+    @property
+    def plan_file_name(self):
+        return self.__args.t
+    
+    @property
+    def report_file_provided(self):
+        return self.__args.r is not None
+    
+    @property
+    def report_file_name(self):
+        return self.__args.r
+    
+    @property
+    def profile_zone_provided(self):
+        return self.__args.z is not None
+    
+    @property
+    def profile_zone(self):
+        return self.__args.z
+    
+    @property
+    def manifest_file_provided(self):
+        return self.__args.m is not None
+    
+    @property
+    def manifest_file_name(self):
+        return self.__args.m
+    
+    @property
+    def resume(self):
+        return self.__args.resume
+    
+    @property
+    def pipeline(self):
+        return self.__args.pipeline
+    
+    @property
+    def memory(self):
+        return self.__args.memory
+    
     @property    
     def log_file_provided(self): 
         return self.__args.l is not None      
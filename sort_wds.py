@@ -21,8 +21,16 @@
 """Sort the WDS catalog by RA and DEC."""
 
 import sys
+import os
 import csv
+import heapq
 import operator
+import itertools
+import tempfile
+import numpy as np
+
+from common import open_file
+from loader import read_chunks
 
 ID_COL = 0
 RA_COL = 1
@@ -30,38 +38,44 @@ DEC_COL = 2
 
 OUT_FILE_PREFIX = 'ord_'
 
-def process_file(csv_file_name):
-    
-    rows = []
+NUM_ARGS = 2
+NUM_ARGS_WITH_MAX_ROWS = 3
+
+# Maximum number of runs merged at the same time.
+MAX_MERGE_RUNS = 64
+
+def read_rows(csv_file_name):
+    """Read the identifier, RA and DEC of the rows of the WDS catalog, 
+    ignoring the header and the rows with wrong coordinates.
     
-    is_header =  True
+    Args:
+        csv_file_name: Name of the CSV file with the WDS catalog.
+        
+    """
     
-    with open(csv_file_name, 'rb') as f:
+    for _, texts, values in read_chunks(csv_file_name, [RA_COL, DEC_COL], 
+                                        [ID_COL], default=np.nan):
+        
+        valid = np.flatnonzero(~np.isnan(values).any(axis=1))
         
-        reader = csv.reader(f)
+        coords = values.tolist()
+        
+        for i in valid:
+            yield [texts[0][i]] + coords[i]
+
+def write_rows(rows, output_file_name):
+    """Write the rows, already sorted, ignoring the duplicated ones.
     
-        try:
-            for row in reader:
-                # If it is not the header.
-                if not is_header:
-                
-                    rows.append([row[ID_COL], float(row[RA_COL]), \
-                                 float(row[DEC_COL])])
-                else:
-                    # Ignore the header.
-                    is_header = False
+    Args:
+        rows: Rows to write.
+        output_file_name: Name of the output file.
         
-        except csv.Error:
-            print "ERROR: reading file %s" % csv_file_name  
-            
-    rows.sort(key=operator.itemgetter(RA_COL, DEC_COL))  
-            
-    output_file_name = OUT_FILE_PREFIX + csv_file_name
+    """
     
     previous_out_str = ''
     out_str = ''
     
-    with open(output_file_name, "w") as fw:
+    with open_file(output_file_name, "w") as fw:
                     
         for r in rows:   
             r_pro = [r[ID_COL], str(r[RA_COL]), str(r[DEC_COL])]
@@ -74,8 +88,151 @@ def process_file(csv_file_name):
             
             previous_out_str = out_str
 
-if __name__ == "__main__":
+def write_run(rows):
+    """Write a sorted run of rows to a temporary file.
+    The values are written with all their precision to read them back exactly.
+    
+    Args:
+        rows: Rows sorted.
+        
+    Return:
+        The name of the temporary file.
+        
+    """
+    
+    fd, run_file_name = tempfile.mkstemp(prefix=OUT_FILE_PREFIX, 
+                                         suffix=".run")
+    
+    with os.fdopen(fd, "wb") as fw:
+        writer = csv.writer(fw)
+        
+        for r in rows:
+            writer.writerow([r[ID_COL], repr(r[RA_COL]), repr(r[DEC_COL])])
+            
+    return run_file_name
+
+def read_run(run_file_name, run_index):
+    """Read the rows of a run from its temporary file.
+    
+    Args:
+        run_file_name: Name of the temporary file of the run.
+        run_index: Index of the run.
+        
+    Return:
+        Tuples with the sorting values, the index of the run, the position 
+        in the run and the row, so the merge keeps the order of the rows 
+        with the same RA and DEC as in the input file.
+        
+    """
+    
+    with open(run_file_name, "rb") as fr:
+        for i, row in enumerate(csv.reader(fr)):
+            ra = float(row[RA_COL])
+            dec = float(row[DEC_COL])
+            
+            yield ra, dec, run_index, i, [row[ID_COL], ra, dec]
+
+def merge_runs(run_file_names):
+    """Merge the rows of several sorted runs.
+    
+    Args:
+        run_file_names: Names of the temporary files of the runs, in the 
+            order of the input file.
+            
+    Return:
+        The rows sorted.
+        
+    """
+    
+    for merged in heapq.merge(*[ read_run(f, i) for i, f in \
+                                enumerate(run_file_names) ]):
+        yield merged[-1]
+
+def external_sort(csv_file_name, max_rows):
+    """Sort the rows of the WDS catalog by RA and DEC keeping in memory up 
+    to a maximum number of rows.
+    Runs of rows are sorted in memory and saved to temporary files, and then
+    the runs are merged. When there are too many runs to open all of them, 
+    consecutive runs are merged first into longer runs.
+    
+    Args:
+        csv_file_name: Name of the CSV file with the WDS catalog.
+        max_rows: Maximum number of rows kept in memory.
+        
+    Return:
+        The rows sorted.
+        
+    """
+    
+    run_file_names = []
+    
+    rows_iter = read_rows(csv_file_name)
     
-    process_file(sys.argv[1])
+    try:
+        while True:
+            rows = list(itertools.islice(rows_iter, max_rows))
+            
+            if not rows:
+                break
+            
+            rows.sort(key=operator.itemgetter(RA_COL, DEC_COL))
+            
+            run_file_names.append(write_run(rows))
+            
+        while len(run_file_names) > MAX_MERGE_RUNS:
+            
+            print "Merging %d sorted runs into longer runs." % \
+                len(run_file_names)
+            
+            merged_run_file_names = []
+            
+            try:
+                for i in range(0, len(run_file_names), MAX_MERGE_RUNS):
+                    merged_run_file_names.append(write_run(merge_runs( \
+                        run_file_names[i:i + MAX_MERGE_RUNS])))
+            finally:
+                for f in run_file_names:
+                    os.remove(f)
+                
+                run_file_names = merged_run_file_names
+            
+        print "Merging %d sorted runs." % len(run_file_names)
+            
+        for row in merge_runs(run_file_names):
+            yield row
+            
+    finally:
+        for f in run_file_names:
+            os.remove(f)
+
+def process_file(csv_file_name, max_rows=None):
+    """Sort the WDS catalog by RA and DEC and save it without duplicated rows.
+    
+    Args:
+        csv_file_name: Name of the CSV file with the WDS catalog.
+        max_rows: Maximum number of rows kept in memory, if not indicated
+            all the rows are sorted in memory.
+    
+    """
+    
+    if max_rows is None:
+        rows = list(read_rows(csv_file_name))
+            
+        rows.sort(key=operator.itemgetter(RA_COL, DEC_COL))  
+    else:
+        rows = external_sort(csv_file_name, max_rows)
+            
+    output_file_name = OUT_FILE_PREFIX + csv_file_name
+    
+    write_rows(rows, output_file_name)
+
+if __name__ == "__main__":
     
-    
\ No newline at end of file
+    if len(sys.argv) == NUM_ARGS:
+        process_file(sys.argv[1])
+    elif len(sys.argv) == NUM_ARGS_WITH_MAX_ROWS and sys.argv[2].isdigit() \
+        and int(sys.argv[2]) > 0:
+        process_file(sys.argv[1], int(sys.argv[2]))
+    else:
+        print "ERROR: Wrong number of parameters. Use: %s input_file_name " \
+            "[max_rows_in_memory]" % sys.argv[0]
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Script to generate a synthetic catalog of stars to test and benchmark the
+processing of the catalogs.
+
+The catalog is saved as a text file with the format of Topcat, as expected by
+extcol.py. The density of stars grows towards the galactic plane and a set
+of pairs with common proper motion is injected. The pairs injected are saved
+to a JSON file and some of them to a file with the format of the WDS catalog.
+"""
+
+import sys
+import json
+import numpy as np
+
+from ctes import *
+from extcol import DATA_DELIMITER
+from findcpmb import ANG_DIST_DEC_DEG, MIN_PM_MODULE
+
+NUM_ARGS = 3
+NUM_ARGS_WITH_SEED = 4
+
+DEFAULT_SEED = 1
+
+# Rows generated at once.
+CHUNK_ROWS = 100000
+
+# Fraction of stars that are the first star of a pair injected.
+PAIRS_FRACTION = 0.01
+
+# Fraction of the pairs injected that are also saved as WDS stars.
+WDS_FRACTION = 0.5
+
+# Fraction of stars placed near the galactic plane, and the standard
+# deviation of their galactic latitude in degrees.
+PLANE_FRACTION = 0.6
+PLANE_SIGMA_DEG = 5.0
+
+# Standard deviation of the proper motion of the field stars in mas/yr and
+# range of their errors.
+FIELD_PM_SIGMA = 30.0
+FIELD_PM_ERROR_RANGE = (1.0, 10.0)
+
+# Range of the module of the proper motion of the pairs injected in mas/yr,
+# range of their errors and standard deviation of the difference of proper
+# motion between the stars of a pair.
+PAIR_PM_RANGE = (2 * MIN_PM_MODULE, 8 * MIN_PM_MODULE)
+PAIR_PM_ERROR_RANGE = (1.0, 3.0)
+PAIR_PM_DIFF_SIGMA = 0.3
+
+# Maximum separation of the stars of the pairs injected, relative to the
+# maximum separation searched.
+PAIR_SEP_FRACTION = 0.7
+
+WDS_HEADER = "name,ra,dec"
+
+# Formats of the positions and of the proper motions written, fixed formats
+# are much faster to write than the shortest representation of the values.
+POSITION_FORMAT = "%.9f"
+PM_FORMAT = "%.6f"
+
+# Rotation from equatorial (J2000) to galactic coordinates.
+EQ_TO_GAL = np.array([[-0.0548755604, -0.8734370902, -0.4838350155],
+                      [ 0.4941094279, -0.4448296300,  0.7469822445],
+                      [-0.8676661490, -0.1980763734,  0.4559837762]])
+
+def random_positions(rnd, num):
+    """Get random positions, uniform on the sphere for some of them and near
+    the galactic plane for the rest.
+    
+    Args:
+        rnd: Random generator.
+        num: Number of positions.
+        
+    Return:
+        Arrays of RA and DEC in degrees.
+        
+    """
+    
+    lon = rnd.uniform(0, 2 * np.pi, num)
+    
+    # Uniform on the sphere.
+    lat = np.arcsin(rnd.uniform(-1, 1, num))
+    
+    in_plane = rnd.uniform(0, 1, num) < PLANE_FRACTION
+    
+    lat[in_plane] = np.clip(rnd.normal(0, np.radians(PLANE_SIGMA_DEG),
+                                       np.count_nonzero(in_plane)),
+                            -np.pi / 2, np.pi / 2)
+    
+    # The latitude and longitude are galactic for the stars near the plane,
+    # they are converted to equatorial.
+    gal = np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon),
+                    np.sin(lat)])
+    
+    eq = np.dot(EQ_TO_GAL.T, gal)
+    
+    ra = np.where(in_plane, np.degrees(np.arctan2(eq[1], eq[0])) % 360.0,
+                  np.degrees(lon))
+    dec = np.where(in_plane, np.degrees(np.arcsin(np.clip(eq[2], -1, 1))),
+                   np.degrees(lat))
+    
+    return ra, dec
+
+def text_line(values):
+    """Get a line of the text file with the columns of interest.
+    
+    Args:
+        values: Values of the columns of interest, as strings.
+        
+    """
+    
+    cols = [ "0" ] * (max(COLS_OF_INTEREST) + 1)
+    
+    for i, c in enumerate(COLS_OF_INTEREST):
+        cols[c] = values[i]
+        
+    return "%s %s %s\n" % (DATA_DELIMITER,
+                           (" %s " % DATA_DELIMITER).join(cols),
+                           DATA_DELIMITER)
+
+def line_format():
+    """Get the format of a line of the text file, with a placeholder for 
+    each column generated, in the order of the columns of the line, and 0 
+    for the rest of columns.
+    
+    Return:
+        The format and the indexes of the columns of interest of each 
+        placeholder, in order.
+        
+    """
+    
+    cols = [ "0" ] * (max(COLS_OF_INTEREST) + 1)
+    
+    formats = { ID_COL: "%s",
+                RA_COL: POSITION_FORMAT, DEC_COL: POSITION_FORMAT,
+                RA_PM_COL: PM_FORMAT, DEC_PM_COL: PM_FORMAT,
+                PMRA_TOTERR_COL: PM_FORMAT, PMDEC_TOTERR_COL: PM_FORMAT }
+    
+    generated = sorted(formats)
+    
+    for i in generated:
+        cols[COLS_OF_INTEREST[i]] = formats[i]
+        
+    placeholders = sorted(generated, key=lambda i: COLS_OF_INTEREST[i])
+    
+    return "%s %s %s" % (DATA_DELIMITER,
+                         (" %s " % DATA_DELIMITER).join(cols),
+                         DATA_DELIMITER), placeholders
+
+def generate_block(rnd, num, num_rows_left):
+    """Generate the stars of a block, each one a field star or the first 
+    star of a pair injected, followed by its companion.
+    
+    Args:
+        rnd: Random generator.
+        num: Number of field stars or pairs of the block.
+        num_rows_left: Number of stars still to generate.
+        
+    Return:
+        A list with the array of values of each column of interest, None 
+        for the identifiers and the columns not generated, the positions in 
+        the block of the first stars of the pairs and the positions of the
+        pairs also saved as WDS stars.
+        
+    """
+    
+    first_of_pair = rnd.uniform(0, 1, num) < PAIRS_FRACTION
+    
+    sizes = 1 + first_of_pair
+    starts = np.cumsum(sizes) - sizes
+    
+    # Only the stars that fit in the rows left, the last pair could become a
+    # field star.
+    fit = starts < num_rows_left
+    
+    first_of_pair = first_of_pair[fit]
+    starts = starts[fit]
+    
+    if len(starts) and starts[-1] + 1 >= num_rows_left:
+        first_of_pair[-1] = False
+        
+    num_stars = starts[-1] + 1 + first_of_pair[-1] if len(starts) else 0
+    
+    ra, dec = random_positions(rnd, len(starts))
+    
+    columns = [ None ] * len(NAMES_COLS_OF_INTEREST)
+    
+    for c in (RA_COL, DEC_COL, RA_PM_COL, DEC_PM_COL, PMRA_TOTERR_COL,
+              PMDEC_TOTERR_COL):
+        columns[c] = np.empty(num_stars, dtype=np.float64)
+        
+    field = starts[~first_of_pair]
+    
+    columns[RA_COL][field] = ra[~first_of_pair]
+    columns[DEC_COL][field] = dec[~first_of_pair]
+    columns[RA_PM_COL][field] = rnd.normal(0, FIELD_PM_SIGMA, len(field))
+    columns[DEC_PM_COL][field] = rnd.normal(0, FIELD_PM_SIGMA, len(field))
+    columns[PMRA_TOTERR_COL][field] = rnd.uniform(FIELD_PM_ERROR_RANGE[0],
+                                                  FIELD_PM_ERROR_RANGE[1],
+                                                  len(field))
+    columns[PMDEC_TOTERR_COL][field] = rnd.uniform(FIELD_PM_ERROR_RANGE[0],
+                                                   FIELD_PM_ERROR_RANGE[1],
+                                                   len(field))
+    
+    pairs = starts[first_of_pair]
+    num_pairs = len(pairs)
+    
+    # The pairs have a positive proper motion, low errors and a separation
+    # lower than the maximum searched.
+    pm = rnd.uniform(PAIR_PM_RANGE[0], PAIR_PM_RANGE[1], num_pairs)
+    pm_angle = rnd.uniform(0.1, np.pi / 2 - 0.1, num_pairs)
+    sep = rnd.uniform(0.1, PAIR_SEP_FRACTION, num_pairs) * ANG_DIST_DEC_DEG
+    sep_angle = rnd.uniform(0, 2 * np.pi, num_pairs)
+    
+    pair_ra = ra[first_of_pair]
+    pair_dec = dec[first_of_pair]
+    
+    columns[RA_COL][pairs] = pair_ra
+    columns[DEC_COL][pairs] = pair_dec
+    columns[RA_COL][pairs + 1] = (pair_ra + sep * np.sin(sep_angle)) % 360.0
+    columns[DEC_COL][pairs + 1] = np.clip(pair_dec + sep * np.cos(sep_angle),
+                                          -90.0, 90.0)
+    
+    columns[RA_PM_COL][pairs] = pm * np.cos(pm_angle)
+    columns[DEC_PM_COL][pairs] = pm * np.sin(pm_angle)
+    columns[RA_PM_COL][pairs + 1] = pm * np.cos(pm_angle) + \
+        rnd.normal(0, PAIR_PM_DIFF_SIGMA, num_pairs)
+    columns[DEC_PM_COL][pairs + 1] = pm * np.sin(pm_angle) + \
+        rnd.normal(0, PAIR_PM_DIFF_SIGMA, num_pairs)
+    
+    for c in (PMRA_TOTERR_COL, PMDEC_TOTERR_COL):
+        for star in (pairs, pairs + 1):
+            columns[c][star] = rnd.uniform(PAIR_PM_ERROR_RANGE[0],
+                                           PAIR_PM_ERROR_RANGE[1],
+                                           num_pairs)
+            
+    in_wds = pairs[rnd.uniform(0, 1, num_pairs) < WDS_FRACTION]
+    
+    return columns, pairs, in_wds
+
+def generate_catalog(text_file_name, num_rows, seed=DEFAULT_SEED):
+    """Generate a synthetic catalog and save it as a Topcat text file.
+    The pairs injected are saved to a JSON file and some of them to a CSV
+    file with the format of the WDS catalog, both with the name of the text
+    file and the extensions .pairs.json and .wds.csv.
+    The stars are generated and written by blocks, the values of each block
+    are generated at once.
+    
+    Args:
+        text_file_name: Name of the text file.
+        num_rows: Number of stars of the catalog, including the pairs.
+        seed: Seed of the random generator.
+        
+    Return:
+        The list of pairs injected, each one with the identifiers of both
+        stars.
+        
+    """
+    
+    rnd = np.random.RandomState(seed)
+    
+    pairs = []
+    
+    num_stars = 0
+    
+    base_name = text_file_name.replace(".txt", "")
+    
+    line, placeholders = line_format()
+    
+    print "Generating %d stars to file: %s" % (num_rows, text_file_name)
+    
+    with open(text_file_name, "w") as fw, \
+        open(base_name + ".wds.csv", "w") as fw_wds:
+    
+        fw.write(text_line(NAMES_COLS_OF_INTEREST))
+        
+        fw_wds.write("%s\n" % WDS_HEADER)
+        
+        while num_stars < num_rows:
+            
+            columns, block_pairs, in_wds = \
+                generate_block(rnd, min(CHUNK_ROWS, num_rows - num_stars),
+                               num_rows - num_stars)
+            
+            num = len(columns[RA_COL])
+            
+            columns[ID_COL] = [ "SYN%09d" % i for i in \
+                               xrange(num_stars, num_stars + num) ]
+            
+            values = [ columns[i] if i == ID_COL else columns[i].tolist() \
+                      for i in placeholders ]
+            
+            fw.write("\n".join([ line % v for v in zip(*values) ]))
+            fw.write("\n")
+            
+            pairs.extend([ [columns[ID_COL][i], columns[ID_COL][i + 1]] \
+                          for i in block_pairs.tolist() ])
+            
+            fw_wds.writelines([ ("WDS%09d," + POSITION_FORMAT + "," + \
+                                 POSITION_FORMAT + "\n") % \
+                               (num_stars + i, ra, dec) \
+                               for i, ra, dec in \
+                               zip(in_wds.tolist(),
+                                   columns[RA_COL][in_wds].tolist(),
+                                   columns[DEC_COL][in_wds].tolist()) ])
+            
+            num_stars += num
+            
+    with open(base_name + ".pairs.json", "w") as fw:
+        json.dump(pairs, fw)
+        
+    print "Generated %d stars with %d pairs injected." % \
+        (num_stars, len(pairs))
+    
+    return pairs
+
+if __name__ == "__main__":
+    
+    if len(sys.argv) == NUM_ARGS:
+        generate_catalog(sys.argv[1], int(sys.argv[2]))
+    elif len(sys.argv) == NUM_ARGS_WITH_SEED:
+        generate_catalog(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        print "ERROR: Wrong number of parameters. Use: " \
+            "%s text_file_name num_rows [seed]" % sys.argv[0]
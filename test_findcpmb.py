@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the engines that search the pairs of near stars and of the
+criteria applied to batches of pairs.
+
+The stars are generated with a fixed seed in clusters placed at the edges of
+the cells of the engines and at the corner of four zones, so every engine
+must find the same pairs than brute_force_pairs. The separations of the
+pairs are kept far enough from the maximum distance, so the planar and the
+angular distances give the same pairs.
+"""
+
+import math
+import random
+import unittest
+import numpy as np
+
+from ctes import *
+from extzone import zone_limits, zone_core
+from findcpmb import ANG_DIST_DEC_DEG, ENGINES, SPHERICAL_ENGINES, \
+    MIN_PM_MODULE, new_store, select_pm_stars, select_zone, search_cpmb, \
+    brute_force_pairs, sphere_pairs, pair_batches, near_objects, \
+    pm_reliability_criteria, Halbwachs_first_criteria, \
+    Halbwachs_second_criteria, pm_reliability_criteria_batch, \
+    Halbwachs_first_criteria_batch, Halbwachs_second_criteria_batch, \
+    criteria_batch
+
+SEED = 20161
+
+# Tiles of the four zones around the corner at RA 10 and DEC 10.
+CORNER_TILES = [ (ra, dec, RA_SIZE, DEC_SIZE, ZONE_MARGIN) \
+                for ra in (0, 10) for dec in (0, 10) ]
+
+# Relative distance to the maximum separation kept by all the pairs.
+SEPARATION_GAP = 0.05
+
+def make_store(rows):
+    """Create a store with the stars received.
+    
+    Args:
+        rows: Tuples (ra, dec, ra_pm, dec_pm, ra_pm_error, dec_pm_error).
+        
+    """
+    
+    store = new_store(len(rows), "S8")
+    
+    store["id"] = [ "s%d" % i for i in range(len(rows)) ]
+    
+    for i, row in enumerate(rows):
+        store["values"][i, [ RA_COL, DEC_COL, RA_PM_COL, DEC_PM_COL,
+                            PMRA_TOTERR_COL, PMDEC_TOTERR_COL ]] = row
+        
+    return store
+
+def planar_separation(a, b):
+    """Get the separation in degrees of two positions as near_objects does.
+    
+    Args:
+        a: RA and DEC of the first position.
+        b: RA and DEC of the second position.
+        
+    """
+    
+    return math.sqrt(math.pow(a[0] - b[0], 2) + math.pow(a[1] - b[1], 2))
+
+def ambiguous(position, positions):
+    """Indicates if a position is at a separation from any other near the
+    maximum distance, where the planar and angular distances could differ.
+    
+    Args:
+        position: RA and DEC of the position.
+        positions: RA and DEC of the other positions.
+        
+    """
+    
+    return any([ abs(planar_separation(position, p) / ANG_DIST_DEC_DEG - 1) \
+                < SEPARATION_GAP for p in positions ])
+
+def cluster_rows(rnd, centers):
+    """Generate the stars of clusters around the centers received. Each
+    cluster has an anchor and companions at several distances, some of them
+    with the proper motion of the anchor, and the stars with different
+    proper motions, errors and proper motions below the minimum.
+    
+    Args:
+        rnd: Random generator.
+        centers: RA and DEC of the anchor of each cluster.
+        
+    """
+    
+    rows = []
+    positions = []
+    
+    for center in centers:
+        
+        if ambiguous(center, positions):
+            continue
+            
+        ra_pm = rnd.choice([ -1, 1 ]) * rnd.uniform(30.0, 300.0)
+        dec_pm = rnd.choice([ -1, 1 ]) * rnd.uniform(30.0, 300.0)
+        
+        cluster = [ center ]
+        
+        while len(cluster) < 6:
+            distance = rnd.choice([ 0.1, 0.4, 0.8, 1.2, 1.6 ]) * \
+                ANG_DIST_DEC_DEG
+            angle = rnd.uniform(0, 2 * math.pi)
+            
+            position = (center[0] + distance * math.cos(angle),
+                        center[1] + distance * math.sin(angle))
+            
+            if not ambiguous(position, positions + cluster):
+                cluster.append(position)
+                
+        positions.extend(cluster)
+        
+        for ra, dec in cluster:
+            
+            pm_shift = rnd.choice([ 0.0, 0.0, 2.0, 20.0 ])
+            
+            # The errors cover several bands of the proper motion index and
+            # some of them are too large for the reliability criteria.
+            ra_error = math.pow(2, rnd.uniform(-3, 4))
+            dec_error = math.pow(2, rnd.uniform(-3, 4))
+            
+            rows.append((ra, dec,
+                         ra_pm + rnd.uniform(-pm_shift, pm_shift),
+                         dec_pm + rnd.uniform(-pm_shift, pm_shift),
+                         ra_error, dec_error))
+            
+    return rows
+
+def corner_store():
+    """Get a store with clusters at the edges of the cells of the engines
+    and around the corner of the zones in CORNER_TILES.
+    
+    """
+    
+    rnd = random.Random(SEED)
+    
+    edges = [ math.floor(10.0 / ANG_DIST_DEC_DEG + k) * ANG_DIST_DEC_DEG \
+             for k in range(-3, 4) ]
+    
+    # The anchors are just at both sides of the edges of the cells and at
+    # the edges of the zones.
+    centers = [ (ra + ra_offset, dec + dec_offset) \
+               for ra in edges[::3] + [ 10.0 ] \
+               for dec in edges[::3] + [ 10.0 ] \
+               for ra_offset in (-1e-7, 1e-7) \
+               for dec_offset in (-1e-7, 1e-7) ]
+    
+    # Clusters away from the edges so the anchors don't overlap.
+    centers = [ (ra + 4 * ANG_DIST_DEC_DEG * (i % 2), dec) \
+               for i, (ra, dec) in enumerate(centers) ]
+    
+    return make_store(cluster_rows(rnd, centers))
+
+def candidate_ids(store, candidates):
+    """Get the identifiers of the stars of the candidates found.
+    
+    Args:
+        store: Store with the stars.
+        candidates: Indexes of the stars of each candidate.
+        
+    """
+    
+    return sorted([ (store["id"][a], store["id"][b]) \
+                   for a, b in candidates.tolist() ])
+
+def index_pairs(pairs):
+    """Get the sorted indexes of the pairs returned by an engine.
+    
+    Args:
+        pairs: Tuples (i, j, sep_in_deg_dec) for each pair of near stars.
+        
+    """
+    
+    return sorted([ (i, j) for i, j, _ in pairs ])
+
+class TestEngines(unittest.TestCase):
+    """Compare the pairs found by each engine with those of the brute force
+    search.
+    
+    """
+    
+    def setUp(self):
+        
+        self.store, self.stars_pm = select_pm_stars(corner_store())
+        self.columns = self.store["values"]
+        
+        self.brute = index_pairs(brute_force_pairs(self.columns))
+        
+    def test_data(self):
+        
+        self.assertTrue(len(self.brute) > 100)
+        
+        # Some pairs cross the edges of the zones.
+        crossing = [ (i, j) for i, j in self.brute \
+                    if (self.columns[i, RA_COL] < 10.0) != \
+                    (self.columns[j, RA_COL] < 10.0) ]
+        
+        self.assertTrue(crossing)
+        
+    def test_engines(self):
+        
+        for engine in sorted(ENGINES):
+            if engine != "pm":
+                self.assertEqual(index_pairs(ENGINES[engine](self.columns)),
+                                 self.brute, engine)
+                
+    def test_pm_engine(self):
+        
+        pm_pairs = index_pairs(ENGINES["pm"](self.columns))
+        
+        # Only pairs of near stars are returned and no pair that meets the
+        # first criteria is pruned.
+        self.assertTrue(set(pm_pairs) <= set(self.brute))
+        self.assertTrue(len(pm_pairs) < len(self.brute))
+        
+        idx_a = np.array([ i for i, _ in self.brute ], dtype=np.intp)
+        idx_b = np.array([ j for _, j in self.brute ], dtype=np.intp)
+        
+        first = Halbwachs_first_criteria_batch(self.columns, idx_a, idx_b)
+        
+        self.assertTrue(np.any(first))
+        self.assertTrue(set([ p for p, f in zip(self.brute, first) if f ]) \
+                        <= set(pm_pairs))
+        
+    def test_empty(self):
+        
+        for engine in sorted(ENGINES):
+            self.assertEqual(list(ENGINES[engine](self.columns[:0])), [],
+                             engine)
+            self.assertEqual(list(ENGINES[engine](self.columns[:1])), [],
+                             engine)
+            
+    def test_candidates(self):
+        
+        store = corner_store()
+        
+        expected = candidate_ids(*search_cpmb(None, "brute",
+                                              store=store.copy()))
+        
+        self.assertTrue(expected)
+        
+        for engine in sorted(ENGINES):
+            self.assertEqual(candidate_ids(*search_cpmb(None, engine,
+                                                        store=store.copy())),
+                             expected, engine)
+            
+    def test_zones(self):
+        
+        store = corner_store()
+        
+        columns = store["values"]
+        
+        dec_order = np.argsort(columns[:, DEC_COL], kind="mergesort")
+        
+        catalog = (store, dec_order, columns[dec_order, DEC_COL])
+        
+        expected = candidate_ids(*search_cpmb(None, "brute",
+                                              store=store.copy()))
+        
+        # Each candidate is found only by the zone whose core contains its
+        # first star.
+        for engine in sorted(ENGINES):
+            spherical = engine in SPHERICAL_ENGINES
+            
+            found = []
+            
+            for tile in CORNER_TILES:
+                zone_store = select_zone(catalog,
+                                         zone_limits(*tile,
+                                                     spherical=spherical))
+                
+                found.extend(candidate_ids(*search_cpmb(None, engine,
+                    zone_core(*tile[:4]), zone_store)))
+                
+            self.assertEqual(sorted(found), expected, engine)
+
+class TestSphereEngine(unittest.TestCase):
+    """Check the pairs found by the sphere engine at RA 0 and at the poles.
+    
+    """
+    
+    def test_wraparound_and_poles(self):
+        
+        positions = [ (359.995, 0.0), (0.005, 0.0),
+                      (0.0, 89.995), (180.0, 89.995),
+                      (90.0, -89.995), (270.0, -89.995),
+                      (0.0, 89.9), (180.0, 89.9),
+                      (359.95, 20.0), (0.05, 20.0) ]
+        
+        columns = make_store([ p + (100.0, 100.0, 1.0, 1.0) \
+                              for p in positions ])["values"]
+        
+        pairs = list(sphere_pairs(columns))
+        
+        self.assertEqual(index_pairs(pairs), [ (0, 1), (2, 3), (4, 5) ])
+        
+        for _, _, sep_in_deg_dec in pairs:
+            self.assertAlmostEqual(sep_in_deg_dec, 0.01, places=6)
+            
+        # The planar distance doesn't find them.
+        self.assertEqual(index_pairs(brute_force_pairs(columns)), [])
+
+class TestCriteriaBatch(unittest.TestCase):
+    """Compare the criteria applied to batches of pairs with the criteria
+    applied to each pair.
+    
+    """
+    
+    def setUp(self):
+        
+        self.store, self.stars_pm = select_pm_stars(corner_store())
+        self.columns = self.store["values"]
+        
+        idx_a, idx_b, self.seps = \
+            next(pair_batches(brute_force_pairs(self.columns)))
+        
+        self.idx_a = idx_a
+        self.idx_b = idx_b
+        self.stars = [ self.columns[i] for i in range(len(self.columns)) ]
+        
+    def pairs(self):
+        
+        return zip(self.idx_a.tolist(), self.idx_b.tolist(),
+                   self.seps.tolist())
+        
+    def test_separation(self):
+        
+        for i, j, sep in self.pairs():
+            self.assertAlmostEqual(near_objects(self.stars[i],
+                                                self.stars[j])[1], sep)
+            
+    def test_pm_module(self):
+        
+        self.assertTrue(np.all(self.stars_pm >= MIN_PM_MODULE))
+        
+    def test_pm_reliability(self):
+        
+        batch = pm_reliability_criteria_batch(self.columns, self.idx_a,
+                                              self.idx_b)
+        
+        self.assertTrue(np.any(batch) and not np.all(batch))
+        self.assertEqual(batch.tolist(),
+                         [ bool(pm_reliability_criteria(self.stars[i],
+                                                        self.stars[j])) \
+                          for i, j, _ in self.pairs() ])
+        
+    def test_Halbwachs_first(self):
+        
+        batch = Halbwachs_first_criteria_batch(self.columns, self.idx_a,
+                                               self.idx_b)
+        
+        self.assertTrue(np.any(batch) and not np.all(batch))
+        self.assertEqual(batch.tolist(),
+                         [ bool(Halbwachs_first_criteria(self.stars[i],
+                                                         self.stars[j], sep)) \
+                          for i, j, sep in self.pairs() ])
+        
+    def test_Halbwachs_second(self):
+        
+        batch = Halbwachs_second_criteria_batch(self.stars_pm, self.idx_a,
+                                                self.idx_b, self.seps)
+        
+        self.assertEqual(batch.tolist(),
+                         [ bool(Halbwachs_second_criteria(self.stars_pm[i],
+                                                          self.stars_pm[j],
+                                                          sep)) \
+                          for i, j, sep in self.pairs() ])
+        
+    def test_Halbwachs_second_without_pm(self):
+        
+        stars_pm = np.array([ 0.0, 100.0 ])
+        
+        with np.errstate(all="raise"):
+            batch = Halbwachs_second_criteria_batch(stars_pm,
+                                                    np.array([ 0, 1 ]),
+                                                    np.array([ 1, 1 ]),
+                                                    np.array([ 0.0, 1e-5 ]))
+            
+        self.assertEqual(batch.tolist(), [ False, True ])
+        
+    def test_criteria(self):
+        
+        batch = criteria_batch(self.columns, self.stars_pm, self.idx_a,
+                               self.idx_b, self.seps)
+        
+        self.assertTrue(np.any(batch))
+        self.assertEqual(batch.tolist(),
+            [ bool(pm_reliability_criteria(self.stars[i], self.stars[j]) and
+                   Halbwachs_second_criteria(self.stars_pm[i],
+                                             self.stars_pm[j], sep) and
+                   Halbwachs_first_criteria(self.stars[i], self.stars[j],
+                                            sep)) \
+             for i, j, sep in self.pairs() ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,12 +21,18 @@
 """This script finds matches between the WDS catalog and a list of stars."""
 
 import sys
-import csv
-import operator
+import numpy as np
 
 from ctes import *
+from common import open_file
+from instrument import measured, count, enable, save_report
+from loader import read_file
 
 NUM_ARGS = 3
+NUM_ARGS_WITH_REPORT = 5
+
+# Option to save a JSON report of the instrumentation to a file.
+REPORT_OPTION = "-r"
 # SDSS has an all-sky precision of 70 mas and systematic errors of less than 
 # 30 mas, this adds 0.1 s.
 COORD_MARGIN = 0.00002778
@@ -40,8 +46,12 @@ WDS_DEC_COL = 2
 CAT_NAME_COL = 0
 CAT_RA_DEC = [[1, 2], [8, 9]]
 
+# WDS rows matched at once against the index of the other catalog.
+WDS_CHUNK_ROWS = 100000
+
 def in_range(val1, val2):
     """Check if the values received accomplished the criteria of proximity.
+    Works also with arrays of values.
     
     Args:
         val1: First value to compare.
@@ -49,45 +59,7 @@ def in_range(val1, val2):
         
     """
     
-    return val1 - COORD_MARGIN < val2 and val1 + COORD_MARGIN > val2
-
-def check_match(wds_row, cat_row, matches):
-    """Check if the stars in both rows match.
-    
-    Args:
-        wds_row: Row of the WDS catalog.
-        cat_row: Row of the second catalog.
-        matches: List of matches.
-        
-    """
-    
-    matchFound = False
-    
-    try:
-        
-        # Get WDS RA and DEC values.
-        wds_ra = float(wds_row[WDS_RA_COL])
-        wds_dec = float(wds_row[WDS_DEC_COL])          
-        
-        # The catalog could contain more than one star per line. 
-        # So try to find a match with any of them.
-        for pair in CAT_RA_DEC:
-            cat_ra = float(cat_row[pair[0]])
-            cat_dec = float(cat_row[pair[1]])                      
-            
-            if in_range(cat_ra, wds_ra) and \
-                in_range(cat_dec, wds_dec):
-                
-                matches.append([wds_row[WDS_NAME_COL], \
-                                cat_row[CAT_NAME_COL]])
-                
-                break
-            
-    except ValueError as ve:
-        print "ERROR %s: %s %s %s %s" % (ve, cat_row[CAT_RA_COL], \
-                                         cat_row[CAT_DEC_COL], \
-                                         wds_row[WDS_RA_COL], \
-                                         wds_row[WDS_DEC_COL])
+    return (val1 - COORD_MARGIN < val2) & (val1 + COORD_MARGIN > val2)
 
 def write_matches(matches):
     """Saves the matches between the WDS catalog and the pairs to a file.
@@ -99,57 +71,131 @@ def write_matches(matches):
     
     print "Saving matches found to file '%s'" % MATCHES_FILENAME
     
-    with open(MATCHES_FILENAME, "w") as fw:
+    with open_file(MATCHES_FILENAME, "w") as fw:
     
         for m in matches:    
             
             fw.write("%s%s%s\n" % (m[0], CSV_DELIMITER, m[1]))            
 
 def read_second_catalog(other_cat_file_name):
-    """Read the second catalog
+    """Read the second catalog and sort it by the RA and DEC of the first 
+    star of each pair.
     
     Args:
         other_cat_file_name: Name of the file containing another catalog.
         
+    Return:
+        The list of names of the pairs and an array with the RA and DEC of 
+        the stars of each pair, in the order of CAT_RA_DEC.
+        
     """
     
-    cat_list = []
-    
     print "Reading catalog file: %s" % other_cat_file_name
     
     # Flatten the list of indexes with RA DEC values.
     CAT_RA_DEC_INDEXES = [item for sublist in CAT_RA_DEC for item in sublist]
     
-    with open(other_cat_file_name, 'rb') as cat_f:
-        
-        cat = csv.reader(cat_f)
-        
-        try:
-            for row in cat:
-                new_row = []
-                
-                for i in range(len(row)):                    
-                    if i in CAT_RA_DEC_INDEXES:
-                        new_row.append(float(row[i]))
-                    else:
-                        new_row.append(row[i])
-                    
-                cat_list.append(new_row)
-        
-        except csv.Error:
-            print "ERROR: reading file %s" % other_cat_file_name
+    texts, coords = read_file(other_cat_file_name, CAT_RA_DEC_INDEXES, 
+                              [CAT_NAME_COL], skip_header=False, 
+                              default=np.nan)
             
     print "Read %d lines from file '%s'. Now sorting by RA and DEC." % \
-        (len(cat_list), other_cat_file_name)
+        (len(coords), other_cat_file_name)
+        
+    # Sort the catalog, keeping the order of the rows with the same values.
+    order = np.lexsort((coords[:, 1], coords[:, 0]))
+            
+    return [ texts[0][i] for i in order ], coords[order]
+
+def build_index(coords):
+    """Build an index with the positions of all the stars of the catalog of 
+    pairs, sorted by RA.
+    
+    Args:
+        coords: Array with the RA and DEC of the stars of each pair.
+        
+    Return:
+        The arrays of RA and DEC of all the stars sorted by RA, and the row 
+        of the catalog for each star.
+        
+    """
+    
+    num_rows = len(coords)
+    
+    ra = np.concatenate([ coords[:, 2 * i] for i in range(len(CAT_RA_DEC)) ])
+    dec = np.concatenate([ coords[:, 2 * i + 1] \
+                          for i in range(len(CAT_RA_DEC)) ])
+    rows = np.tile(np.arange(num_rows), len(CAT_RA_DEC))
+    
+    order = np.argsort(ra, kind="mergesort")
+    
+    return ra[order], dec[order], rows[order]
+
+def read_wds(wds_file_name):
+    """Read the names and positions of the WDS catalog, ignoring the rows 
+    with wrong coordinates.
+    
+    Args:
+        wds_file_name: File containing the WDS catalog.
+        
+    Return:
+        The list of names and the arrays of RA and DEC.
         
-    # Sort the catalog.
-    cat_list.sort(key=operator.itemgetter(CAT_RA_DEC_INDEXES[0], \
-                                          CAT_RA_DEC_INDEXES[1]))             
+    """
+    
+    print "Opening WDS file '%s' to find matches." % wds_file_name
+    
+    texts, coords = read_file(wds_file_name, [WDS_RA_COL, WDS_DEC_COL], 
+                              [WDS_NAME_COL], skip_header=False, 
+                              default=np.nan)
+    
+    valid = np.flatnonzero(~np.isnan(coords).any(axis=1))
             
-    return cat_list
+    return [ texts[0][i] for i in valid ], coords[valid, 0], coords[valid, 1]
+
+def crossmatch(index, wds_ra, wds_dec):
+    """Find the stars of the index near to each WDS position.
+    For each WDS position the window of stars of the index with a RA in 
+    range is found with a binary search, and the DEC is checked for the stars
+    in the window.
+    
+    Args:
+        index: Index of the catalog of pairs, as returned by build_index.
+        wds_ra: Array of RA of the WDS stars.
+        wds_dec: Array of DEC of the WDS stars.
+        
+    Return:
+        The arrays of indexes of the WDS stars and of the rows of the catalog
+        of pairs that match.
+        
+    """
+    
+    index_ra, index_dec, index_rows = index
+    
+    # The windows are a bit wider than the margin, the exact check is done 
+    # after with in_range.
+    first = np.searchsorted(index_ra, wds_ra - 2 * COORD_MARGIN, 'left')
+    last = np.searchsorted(index_ra, wds_ra + 2 * COORD_MARGIN, 'right')
+    
+    counts = last - first
+    
+    # Expand the windows to get a pair of indexes for each star to check.
+    wds_idx = np.repeat(np.arange(len(wds_ra)), counts)
+    
+    starts = np.repeat(first - np.cumsum(counts) + counts, counts)
+    
+    idx = starts + np.arange(len(wds_idx))
+    
+    match = in_range(index_ra[idx], wds_ra[wds_idx]) & \
+        in_range(index_dec[idx], wds_dec[wds_idx])
+    
+    return wds_idx[match], index_rows[idx[match]]
 
+@measured("match_catalogs")
 def match_catalogs(wds_file_name, other_cat_file_name):
     """Check if the pairs in catalog 2 are already in the WDS catalog.
+    All the stars of the pairs, not only the first one, are compared with 
+    the WDS catalog.
     
     Args:
         wds_file_name: File containing the WDS catalog.
@@ -160,48 +206,34 @@ def match_catalogs(wds_file_name, other_cat_file_name):
     matches = []
     
     # Read and sort the second catalog.
-    sorted_catalog = read_second_catalog(other_cat_file_name)
+    cat_names, cat_coords = read_second_catalog(other_cat_file_name)
+    
+    count("rows_read", len(cat_names))
             
-    if len(sorted_catalog) > 0:        
-        cat_index = 0
+    if len(cat_names) > 0:        
         
-        cat_row = sorted_catalog[cat_index]
-        cat_ra = float(cat_row[CAT_RA_DEC[0][0]])
-        cat_dec = float(cat_row[CAT_RA_DEC[0][1]])
+        index = build_index(cat_coords)
         
-        print "Opening WDS file '%s' to find matches." % wds_file_name
-    
-        # Open the WDS catalog, already sorted, and look for matches.
-        with open(wds_file_name, 'rb') as wds_f:
+        wds_names, wds_ra, wds_dec = read_wds(wds_file_name)
+        
+        count("wds_rows_read", len(wds_names))
+        
+        for start in range(0, len(wds_names), WDS_CHUNK_ROWS):
             
-            wds_cat = csv.reader(wds_f)                        
+            end = start + WDS_CHUNK_ROWS
             
-            try:                                                       
-                for wds_row in wds_cat:
-                    
-                    wds_ra = float(wds_row[WDS_RA_COL])
-                    wds_dec = float(wds_row[WDS_DEC_COL])
-                    
-                    check_match(wds_row, cat_row, matches)
-                    
-                    # Read from second catalog when WDS RA is greater than 
-                    # RA from second catalog and there is some item in
-                    # second cat.
-                    while ( ( wds_ra > cat_ra ) or \
-                            (wds_ra >= cat_ra and wds_dec > cat_dec) ) and \
-                        cat_index < len(sorted_catalog) - 1:
-       
-                        cat_index += 1
-                 
-                        cat_row = sorted_catalog[cat_index]   
-                        cat_ra = float(cat_row[CAT_RA_DEC[0][0]])     
-                        cat_dec = float(cat_row[CAT_RA_DEC[0][1]])                         
-                        
-                        check_match(wds_row, cat_row, matches)                           
+            wds_idx, cat_rows = crossmatch(index, wds_ra[start:end], 
+                                           wds_dec[start:end])
             
-            except csv.Error:
-                print "ERROR: reading file %s" % wds_file_name
+            # A pair matches once although both stars match.
+            found = sorted(set(zip((wds_idx + start).tolist(), 
+                                   cat_rows.tolist())))
+            
+            matches.extend([ [wds_names[w], cat_names[r]] \
+                            for w, r in found ])
                 
+        count("matches", len(matches))
+        
         print "Found %d matches" % len(matches)
         
         if len(matches) > 0:            
@@ -211,6 +243,14 @@ if __name__ == "__main__":
     
     if len(sys.argv) == NUM_ARGS:
         sys.exit(match_catalogs(sys.argv[1], sys.argv[2]))
+    elif len(sys.argv) == NUM_ARGS_WITH_REPORT and \
+        sys.argv[3] == REPORT_OPTION:
+        enable()
+        
+        match_catalogs(sys.argv[1], sys.argv[2])
+        
+        save_report(sys.argv[4])
     else:
         print "ERROR: Wrong number of parameters. Use: "
-        print "\t%s wds_file_name other_catalog_file_name" % sys.argv[0]
\ No newline at end of file
+        print "\t%s wds_file_name other_catalog_file_name [%s report_file]" % \
+            (sys.argv[0], REPORT_OPTION)
\ No newline at end of file
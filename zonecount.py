@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Count the objects of a catalog in each zone of a grid that divides the 
+sky.
+"""
+
+import numpy as np
+from ctes import *
+from colcache import is_cache, open_cache
+from loader import read_chunks
+
+# Number of positions read and counted at once.
+CHUNK_ROWS = 100000
+
+def read_positions(csv_file_name):
+    """Read the RA and DEC of the objects from a CSV file or from a binary 
+    cache, in chunks.
+    
+    Args:
+        csv_file_name: Name of the CSV file or cache with the data.
+        
+    Return:
+        Tuples with the arrays of RA and DEC of each chunk of objects.
+        
+    """
+    
+    print "Opening file: %s" % csv_file_name
+    
+    if is_cache(csv_file_name):
+        _, columns = open_cache(csv_file_name)
+        
+        for start in range(0, len(columns[RA_COL]), CHUNK_ROWS):
+            yield columns[RA_COL][start:start + CHUNK_ROWS], \
+                columns[DEC_COL][start:start + CHUNK_ROWS]
+    else:
+        for _, _, values in read_chunks(csv_file_name, [RA_COL, DEC_COL], 
+                                        chunk_rows=CHUNK_ROWS):
+            yield values[:, 0], values[:, 1]
+
+def count_zones(csv_file_name, ra_size=RA_SIZE, dec_size=DEC_SIZE):
+    """Count the number of objects in each zone of a grid that divides the 
+    sky.
+    
+    Args:
+        csv_file_name: Name of the CSV file or cache with the data.
+        ra_size: Size in RA of the zones.
+        dec_size: Size in DEC of the zones.
+        
+    Return:
+        An array with the number of objects in each zone, with a row for 
+        each DEC and a column for each RA, and the minimum and maximum RA
+        and DEC of the objects.
+        
+    """
+    
+    num_cols = int(np.ceil(360.0 / ra_size))
+    num_rows = int(np.ceil((DEC_MAX - DEC_MIN) / dec_size))
+    
+    counts = np.zeros(num_rows * num_cols, dtype=np.int64)
+    
+    ra_min = 9999.0
+    ra_max = -9999.0
+    dec_min = 9999.0
+    dec_max = -9999.0
+    
+    out_of_range = 0
+    
+    for ra, dec in read_positions(csv_file_name):
+        
+        if len(ra):
+            ra_min = min(ra_min, ra.min())
+            ra_max = max(ra_max, ra.max())
+            dec_min = min(dec_min, dec.min())
+            dec_max = max(dec_max, dec.max())
+        
+        ra_index = np.floor(ra / ra_size).astype(np.int64)
+        dec_index = np.floor((dec - DEC_MIN) / dec_size).astype(np.int64)
+        
+        # RA 360 is RA 0 and the maximum DEC belongs to the last row.
+        ra_index[ra_index == num_cols] = 0
+        dec_index[dec_index == num_rows] = num_rows - 1
+        
+        valid = (ra_index >= 0) & (ra_index < num_cols) & \
+            (dec_index >= 0) & (dec_index < num_rows)
+        
+        out_of_range += len(valid) - np.count_nonzero(valid)
+        
+        counts += np.bincount(dec_index[valid] * num_cols + ra_index[valid], 
+                              minlength=len(counts))
+        
+    if out_of_range:
+        print "%d objects out of the range of the zones." % out_of_range
+        
+    return counts.reshape((num_rows, num_cols)), \
+        (ra_min, ra_max, dec_min, dec_max)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/cpmb
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Script to plan the tiles used to process a catalog according to the
+density of objects.
+
+Each zone of the fixed grid is divided recursively in four tiles, as a
+quadtree, while it contains more objects than a given number, so the cost of
+searching pairs is similar for all the tiles.
+"""
+
+import sys
+import csv
+from ctes import *
+from extzone import grid_tiles
+from findcpmb import ANG_DIST_DEC_DEG
+from zonecount import count_zones
+
+NUM_ARGS = 4
+
+# Maximum number of times a zone of the fixed grid is divided.
+MAX_DEPTH = 6
+
+def tile_margin(ra_size, dec_size):
+    """Get the margin of a tile in proportion to its size, but never smaller
+    than the separation searched between stars.
+    
+    Args:
+        ra_size: Size in RA of the tile.
+        dec_size: Size in DEC of the tile.
+        
+    """
+    
+    scale = min(float(ra_size) / RA_SIZE, float(dec_size) / DEC_SIZE)
+    
+    return max(ZONE_MARGIN * scale, min(ZONE_MARGIN, ANG_DIST_DEC_DEG))
+
+def split_tile(counts, col, row, num_cols, num_rows, max_stars, tiles):
+    """Divide a tile in four while it contains too many objects.
+    The tiles are defined in cells of the grid of counts.
+    
+    Args:
+        counts: Array with the number of objects of each cell.
+        col: First column of cells of the tile.
+        row: First row of cells of the tile.
+        num_cols: Number of columns of cells of the tile.
+        num_rows: Number of rows of cells of the tile.
+        max_stars: Maximum number of objects desired for a tile.
+        tiles: List to add the tiles that are not divided.
+        
+    """
+    
+    num_stars = counts[row:row + num_rows, col:col + num_cols].sum()
+    
+    if num_stars > max_stars and (num_cols > 1 or num_rows > 1):
+        
+        half_cols = num_cols / 2
+        half_rows = num_rows / 2
+        
+        cols = [ (col, num_cols) ] if num_cols == 1 else \
+            [ (col, half_cols), (col + half_cols, num_cols - half_cols) ]
+        
+        rows = [ (row, num_rows) ] if num_rows == 1 else \
+            [ (row, half_rows), (row + half_rows, num_rows - half_rows) ]
+        
+        for c, nc in cols:
+            for r, nr in rows:
+                split_tile(counts, c, r, nc, nr, max_stars, tiles)
+    else:
+        tiles.append((col, row, num_cols, num_rows, num_stars))
+
+def plan_tiles(counts, cell_ra, cell_dec, max_stars):
+    """Plan the tiles to process a catalog from the counts of objects in a
+    grid of cells that divides each zone of the fixed grid.
+    
+    Args:
+        counts: Array with the number of objects of each cell, with a row
+            for each DEC and a column for each RA starting at 0.
+        cell_ra: Size in RA of the cells.
+        cell_dec: Size in DEC of the cells.
+        max_stars: Maximum number of objects desired for a tile.
+        
+    Return:
+        List of tuples (ra, dec, ra_size, dec_size, margin) for each tile.
+        
+    """
+    
+    tiles = []
+    
+    for ra, dec, ra_size, dec_size, _ in grid_tiles():
+        
+        cells = []
+        
+        split_tile(counts, int(round(ra / cell_ra)),
+                   int(round((dec - DEC_MIN) / cell_dec)),
+                   int(round(ra_size / cell_ra)),
+                   int(round(dec_size / cell_dec)), max_stars, cells)
+        
+        for col, row, num_cols, num_rows, num_stars in cells:
+            
+            tile_ra_size = num_cols * cell_ra
+            tile_dec_size = num_rows * cell_dec
+            
+            # A zone not divided keeps its own values.
+            if tile_ra_size == ra_size and tile_dec_size == dec_size:
+                tiles.append((ra, dec, ra_size, dec_size, ZONE_MARGIN))
+            else:
+                tiles.append((col * cell_ra, row * cell_dec + DEC_MIN,
+                              tile_ra_size, tile_dec_size,
+                              tile_margin(tile_ra_size, tile_dec_size)))
+                
+    return tiles
+
+def write_plan(tiles, plan_file_name):
+    """Save the tiles planned to a CSV file.
+    
+    Args:
+        tiles: List of tiles.
+        plan_file_name: Name of the file.
+        
+    """
+    
+    print "Saving %d tiles to file: %s" % (len(tiles), plan_file_name)
+    
+    with open(plan_file_name, "wb") as fw:
+        writer = csv.writer(fw, delimiter=CSV_DELIMITER)
+        
+        for t in tiles:
+            writer.writerow([ repr(v) for v in t ])
+
+def number_value(str_val):
+    """Get the value of a number, as integer if it hasn't decimals.
+    
+    Args:
+        str_val: String with the number.
+        
+    """
+    
+    val = float(str_val)
+    
+    if val.is_integer():
+        val = int(val)
+        
+    return val
+
+def read_plan(plan_file_name):
+    """Read the tiles planned from a CSV file.
+    
+    Args:
+        plan_file_name: Name of the file.
+        
+    Return:
+        List of tuples (ra, dec, ra_size, dec_size, margin) for each tile.
+        
+    """
+    
+    with open(plan_file_name, "rb") as fr:
+        reader = csv.reader(fr, delimiter=CSV_DELIMITER)
+        
+        tiles = [ tuple([ number_value(v) for v in row ]) for row in reader ]
+        
+    print "Read %d tiles from file: %s" % (len(tiles), plan_file_name)
+    
+    return tiles
+
+def plan_catalog(csv_file_name, max_stars, plan_file_name):
+    """Plan the tiles to process a catalog and save them to a file.
+    
+    Args:
+        csv_file_name: Name of the CSV file or cache with the data.
+        max_stars: Maximum number of objects desired for a tile.
+        plan_file_name: Name of the file to save the tiles.
+        
+    """
+    
+    cell_ra = float(RA_SIZE) / 2 ** MAX_DEPTH
+    cell_dec = float(DEC_SIZE) / 2 ** MAX_DEPTH
+    
+    counts, _ = count_zones(csv_file_name, cell_ra, cell_dec)
+    
+    tiles = plan_tiles(counts, cell_ra, cell_dec, max_stars)
+    
+    write_plan(tiles, plan_file_name)
+    
+    return tiles
+
+if __name__ == "__main__":
+    
+    if len(sys.argv) == NUM_ARGS:
+        plan_catalog(sys.argv[1], int(sys.argv[2]), sys.argv[3])
+    else:
+        print "ERROR: Wrong number of parameters. Use: " \
+            "%s input_file max_stars_by_tile plan_file" % sys.argv[0]
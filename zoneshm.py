@@ -22,110 +22,128 @@
 """
 
 import sys
-import csv
+import os
 import numpy as np
+import matplotlib
+
+# Without a display the heat map can only be saved to a file.
+if not os.environ.get("DISPLAY"):
+    matplotlib.use("Agg")
+    
 import matplotlib.pyplot as plt
 from ctes import *
-from common import *
+from zonecount import count_zones
 
 NUM_ARGS = 2
+NUM_ARGS_WITH_IMAGE = 3
+NUM_ARGS_WITH_COUNTS = 4
 
 CSV_DELIMITER = ','
 
-ZONE_NUM_COLS = 360/RA_SIZE
-ZONE_NUM_ROWS = int(DEC_MAX + abs(DEC_MIN)) / DEC_SIZE
+NPY_EXT = ".npy"
 
-zones = [[0 for x in range(ZONE_NUM_COLS)] for x in range(ZONE_NUM_ROWS)]
+# Image argument to save only the counts, without the heat map.
+NO_IMAGE = "-"
 
-def plot_heatmap():
+def plot_heatmap(zones, ra_size=RA_SIZE, dec_size=DEC_SIZE, image_file=None):
     """Plot a heat map of the zones.
+    
+    Args:
+        zones: Array with the number of objects in each zone.
+        ra_size: Size in RA of the zones.
+        dec_size: Size in DEC of the zones.
+        image_file: File to save the heat map, if not indicated it is shown.
+        
     """
     
-    print "Matrix of %d rows by %d columns." % (len(zones), len(zones[0]))
+    print "Matrix of %d rows by %d columns." % zones.shape
     
-    column_labels = [x for x in range(0, 360, RA_SIZE)] 
-    row_labels = [ x for x in range(int(DEC_MIN), int(DEC_MAX), DEC_SIZE)]
+    column_labels = [ "%g" % x for x in np.arange(zones.shape[1]) * ra_size ]
+    row_labels = [ "%g" % x for x in \
+                  np.arange(zones.shape[0]) * dec_size + DEC_MIN ]
     
     fig, ax = plt.subplots()
     
-    data = np.array(zones)
-    
-    heatmap = ax.pcolor(data, cmap=plt.cm.Blues)
+    heatmap = ax.pcolor(zones, cmap=plt.cm.Blues)
     
     # put the major ticks at the middle of each cell
-    ax.set_yticks(np.arange(data.shape[0]), minor=False)
-    ax.set_xticks(np.arange(data.shape[1]), minor=False)
+    ax.set_yticks(np.arange(zones.shape[0]), minor=False)
+    ax.set_xticks(np.arange(zones.shape[1]), minor=False)
     
     ax.set_yticklabels(row_labels, minor=False)
     ax.set_xticklabels(column_labels, minor=False)
     
     plt.xticks(rotation=90) 
     
-    plt.show() 
+    if image_file is None:
+        plt.show() 
+    else:
+        print "Saving heat map to file: %s" % image_file
+        
+        plt.savefig(image_file)
+        
+    plt.close(fig)
 
-def get_pos_stats(csv_file_name):
+def save_counts(zones, counts_file):
+    """Save the number of objects of each zone to a file, in NumPy format if
+    the file has the .npy extension or in CSV format otherwise.
+    
+    Args:
+        zones: Array with the number of objects in each zone.
+        counts_file: Name of the file.
+        
+    """
+    
+    print "Saving counts to file: %s" % counts_file
+    
+    if counts_file.endswith(NPY_EXT):
+        np.save(counts_file, zones)
+    else:
+        np.savetxt(counts_file, zones, fmt="%d", delimiter=CSV_DELIMITER)
+
+def get_pos_stats(csv_file_name, image_file=None, counts_file=None, 
+                  plot=True):
     """Calculate the range of RA and DEC for the objects and count the number
     of objects is each zone used to divide the sky.
-    The input file must use the CSV format.
-    A list containing an item for each zone is used to store the counts.
+    The input file must use the CSV format or be a binary cache.
+    The file is read by chunks of objects that are counted at once.
     
     Args:
         csv_file_name: Name of the CSV file with the data.
+        image_file: File to save the heat map, if not indicated it is shown.
+        counts_file: File to save the counts, if indicated.
+        plot: Indicates if the heat map is plotted.
+        
+    Return:
+        The array with the number of objects in each zone.
+        
     """
     
-    ra_min = 9999.0
-    ra_max = -9999.0
-    dec_min = 9999.0
-    dec_max = -9999.0
-    
-    row_num = 0
+    zones, ranges = count_zones(csv_file_name)
+           
+    print "Min RA: %.5g Max. RA: %.5g Min. DEC: %.5g Max. DEC: %.5g" % ranges
     
-    print "Opening file: %s" % csv_file_name
+    if counts_file is not None:
+        save_counts(zones, counts_file)
     
-    with open(csv_file_name, 'rb') as csvfile:
-        reader = csv.reader(csvfile, delimiter=CSV_DELIMITER)
-        
-        for row in reader:
-            
-            # Ignore header.
-            if row_num > 0:
-                ra = get_float_value(row[RA_COL], row_num)
-                
-                if ra < ra_min:
-                    ra_min = ra
-                    
-                if ra > ra_min:
-                    ra_max = ra      
-                    
-                ra_index = int(ra / RA_SIZE) - 1         
-
-                dec = get_float_value(row[DEC_COL], row_num)
-                
-                if dec < dec_min:
-                    dec_min = dec
-                    
-                if dec > dec_max:
-                    dec_max = dec  
-                 
-                dec_index = int((dec + abs(DEC_MIN)) / DEC_SIZE) - 1
-                
-                try:
-                    zones[dec_index][ra_index ] += 1
-                except IndexError:
-                    print "dec %.5g dec_index %d ra %.5g ra_index %d" % \
-                        (dec, dec_index, ra, ra_index)
-                    
-            row_num += 1                                                             
-           
-    print "Min RA: %.5g Max. RA: %.5g Min. DEC: %.5g Max. DEC: %.5g" % \
-        (ra_min, ra_max, dec_min, dec_max)   
+    if plot:
+        plot_heatmap(zones, image_file=image_file)
     
-    plot_heatmap()
+    return zones
 
 if __name__ == "__main__":
     
     if len(sys.argv) == NUM_ARGS:
-        sys.exit(get_pos_stats(sys.argv[1]))
+        get_pos_stats(sys.argv[1])
+    elif len(sys.argv) in (NUM_ARGS_WITH_IMAGE, NUM_ARGS_WITH_COUNTS):
+        image_file = sys.argv[2]
+        counts_file = sys.argv[3] if len(sys.argv) == NUM_ARGS_WITH_COUNTS \
+            else None
+        
+        if image_file == NO_IMAGE:
+            get_pos_stats(sys.argv[1], None, counts_file, False)
+        else:
+            get_pos_stats(sys.argv[1], image_file, counts_file)
     else:
-        print "ERROR: Wrong number of parameters. Use: %s input_file_name" % \
-        sys.argv[0]
\ No newline at end of file
+        print "ERROR: Wrong number of parameters. Use: %s input_file_name " \
+            "[image_file|%s [counts_file]]" % (sys.argv[0], NO_IMAGE)